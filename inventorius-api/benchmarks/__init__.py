@@ -0,0 +1,18 @@
+"""
+    benchmarks
+    ~~~~~~~~~~~~~~
+
+    Load tests for the inventorius api against a local mongo.
+
+        python -m benchmarks --scale 1k --duration 10 --threads 8 \
+            --output results.json --baseline benchmarks/baseline.json
+
+    seeds a synthetic warehouse (see benchmarks.seed) into the `benchmark`
+    database, drives the key routes from concurrent threads (see
+    benchmarks.load) and writes p50/p99 latency and ops/sec per scenario as
+    json. With a baseline, the exit status is 1 when a scenario is slower
+    than the baseline by more than --tolerance.
+
+    benchmarks/test_microbenchmarks.py times the in-process hot paths with
+    pytest-benchmark (make microbench).
+"""
@@ -0,0 +1,94 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from inventorius.db import database_name, get_mongo_client
+
+from benchmarks.load import (SCENARIOS, HttpClient, compare, prepare_worker,
+                             run_scenario, use_database)
+from benchmarks.seed import SCALES, seed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Load test the inventorius api.")
+    parser.add_argument("--scale", choices=SCALES, default="1k",
+                        help="bins and skus to seed (default 1k)")
+    parser.add_argument("--chain-depth", type=int, default=50,
+                        help="step instances in the traceability chain (default 50)")
+    parser.add_argument("--skip-seed", action="store_true",
+                        help="reuse the warehouse seeded by a previous run")
+    parser.add_argument("--database", default="benchmark",
+                        help="mongo database to seed and use (default benchmark)")
+    parser.add_argument("--url", help="load a running server instead of the app in process, "
+                                      "started with INVENTORIUS_DATABASE set to --database")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds each scenario runs (default 10)")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenarios to run (default all)")
+    parser.add_argument("--output", help="write the results json here")
+    parser.add_argument("--baseline", help="results json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline (default 0.2)")
+    args = parser.parse_args(argv)
+    if not args.skip_seed and args.database in ("inventoriusdb", database_name()):
+        # seeding replaces the collections of the database the app serves
+        parser.error(f"refusing to seed {args.database}, the app's own database")
+
+    database = get_mongo_client()[args.database]
+    use_database(database)
+    from inventorius import app
+
+    if args.skip_seed:
+        facts = database.benchmark_facts.find_one({"_id": "facts"})
+        if facts is None:
+            parser.error("nothing seeded yet, run without --skip-seed")
+    else:
+        facts = seed(database, SCALES[args.scale], args.chain_depth,
+                     log=lambda message: print(message, file=sys.stderr))
+        database.benchmark_facts.replace_one({"_id": "facts"}, {"_id": "facts", **facts},
+                                             upsert=True)
+
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        make_client = app.test_client
+
+    setup_client = make_client()
+    workers = [prepare_worker(setup_client, number, facts) for number in range(args.threads)]
+
+    results = {
+        "scale": args.scale,
+        "threads": args.threads,
+        "duration": args.duration,
+        "target": args.url or "in-process",
+        "python": platform.python_version(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        results["scenarios"][name] = run_scenario(name, make_client, workers, args.duration)
+        print(f"{name}: {json.dumps(results['scenarios'][name])}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
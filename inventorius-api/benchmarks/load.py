@@ -0,0 +1,221 @@
+"""
+    benchmarks.load
+    ~~~~~~~~~~~~~~
+
+    Concurrent load on the key routes of a seeded warehouse.
+
+    Each scenario runs for a fixed time on every thread, the threads share
+    nothing but the database. Requests go to the app in process (a flask
+    test client per thread, so the numbers are the app and mongo without a
+    web server) or with --url to a running server.
+"""
+
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from flask import g, request_started
+
+from inventorius import app
+from benchmarks.seed import CHAIN, WORDS, label
+
+
+def use_database(database):
+    """Serve in process requests from `database`. Event subscribers and jobs
+    run inline so each request's time includes the work it causes."""
+    app.config.update(EVENT_BUS_SYNC=True, JOBS_SYNC=True)
+
+    def set_database(sender):
+        g.db = database
+    request_started.connect(set_database, app, weak=False)
+
+
+class _HttpResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+
+class HttpClient:
+    """Just enough of the flask test client api, for a server at base_url."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def _send(self, method, path, query_string=None, json_body=None):
+        url = self.base_url + path
+        if query_string:
+            url += "?" + urllib.parse.urlencode(query_string)
+        data = None
+        headers = {"Accept": "application/json"}
+        if json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req) as resp:
+                return _HttpResponse(resp.status, resp.read())
+        except urllib.error.HTTPError as e:
+            return _HttpResponse(e.code, e.read())
+
+    def get(self, path, query_string=None):
+        return self._send("GET", path, query_string)
+
+    def post(self, path, json=None):
+        return self._send("POST", path, json_body=json)
+
+    def put(self, path, json=None):
+        return self._send("PUT", path, json_body=json)
+
+
+# scenarios, called as scenario(client, rng, worker) where worker holds the
+# thread's own resources and counters, return the response
+
+
+def search(client, rng, worker):
+    count = worker["facts"]["count"]
+    query = rng.choice([
+        lambda: rng.choice(WORDS),
+        lambda: label("SKU", rng.randrange(count)),
+        lambda: label("BIN", rng.randrange(count)),
+        lambda: f"LOT{rng.randrange(max(1, worker['facts']['batch_count']))}",
+    ])()
+    return client.get("/api/search", query_string={"query": query, "limit": 20})
+
+
+def move(client, rng, worker):
+    # one unit goes back and forth between the thread's two bins
+    source, destination = worker["bins"]
+    worker["bins"] = destination, source
+    return client.put(f"/api/bin/{source}/contents/move",
+                      json={"id": worker["sku"], "destination": destination, "quantity": 1})
+
+
+def contents_post(client, rng, worker):
+    count = worker["facts"]["count"]
+    return client.post(f"/api/bin/{label('BIN', rng.randrange(count))}/contents",
+                       json={"id": label("SKU", rng.randrange(count)), "quantity": 1})
+
+
+def step_instance_create(client, rng, worker):
+    worker["steps"] += 1
+    suffix = f"{worker['run']}{worker['number']:03d}{worker['steps']:07d}"
+    return client.post("/api/step-instances", json={
+        "instance_id": f"INS{suffix}",
+        "template_id": "TPL000001",
+        "operator": {"id": "benchmark"},
+        "consumed": [{"resource_id": worker["batch"], "quantity": 1, "bin_id": worker["home"]}],
+        "produced": [{"batch_id": f"BAT{suffix}", "sku_id": label("SKU", CHAIN),
+                      "quantity": 1, "bin_id": worker["home"]}],
+    })
+
+
+def traceability(client, rng, worker):
+    return client.post("/api/traceability",
+                       json={"batch_ids": [worker["facts"]["chain_last_batch"]]})
+
+
+SCENARIOS = {
+    "search": search,
+    "move": move,
+    "contents_post": contents_post,
+    "step_instance_create": step_instance_create,
+    "traceability": traceability,
+}
+
+
+def prepare_worker(client, number, facts):
+    """Bins and stock the thread's scenarios work on. Ids are past the
+    step chain's, existing ones are reused by later runs."""
+    fixture = CHAIN + 100_000 + 10 * number
+    bins = (label("BIN", fixture), label("BIN", fixture + 1))
+    sku, batch = label("SKU", fixture), label("BAT", fixture)
+    for bin_id in bins:
+        client.post("/api/bins", json={"id": bin_id, "props": {}})
+    client.post("/api/skus", json={"id": sku, "name": f"worker {number}"})
+    client.post("/api/batches", json={"id": batch, "sku_id": label("SKU", CHAIN),
+                                      "qty_remaining": 10**9})
+    client.post(f"/api/bin/{bins[0]}/contents", json={"id": sku, "quantity": 10**6})
+    client.post(f"/api/bin/{bins[0]}/contents", json={"id": batch, "quantity": 10**9})
+    return {"number": number, "facts": facts, "bins": bins, "home": bins[0],
+            "sku": sku, "batch": batch, "run": int(time.time()), "steps": 0}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1,
+                       int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "ops_per_sec": round(len(latencies) / seconds, 2) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+def run_scenario(name, make_client, workers, duration, seed=0):
+    """Run one scenario from len(workers) threads for `duration` seconds."""
+    scenario = SCENARIOS[name]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def work(worker):
+        rng = random.Random(f"{seed}-{name}-{worker['number']}")
+        client = make_client()
+        own_latencies, own_errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            resp = scenario(client, rng, worker)
+            own_latencies.append(time.perf_counter() - start)
+            if resp.status_code >= 400:
+                own_errors += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in workers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def error_rate(result):
+    return result["errors"] / result["requests"] if result["requests"] else 0.0
+
+
+def compare(results, baseline, tolerance):
+    """Scenarios slower than the baseline by more than tolerance (a fraction),
+    or failing more often. Any error fails a scenario that had none."""
+    regressions = []
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not result["requests"]:
+            continue
+        if result["errors"] and error_rate(result) > error_rate(before) * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['errors']} errors in {result['requests']} requests, "
+                f"baseline {before['errors']} in {before['requests']}")
+        if before["p99_ms"] and result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['p99_ms']} ms, baseline {before['p99_ms']} ms")
+        if result["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['ops_per_sec']} ops/sec, baseline {before['ops_per_sec']} ops/sec")
+    return regressions
@@ -0,0 +1,164 @@
+"""
+    benchmarks.seed
+    ~~~~~~~~~~~~~~
+
+    Synthetic warehouses at fixed scales.
+
+    Bins, skus and batches are generated from a seeded random.Random, so a
+    scale always produces the same documents, with the field shapes of the
+    hypothesis strategies in tests/data_models_strategies.py (labels,
+    owned/associated codes, props with per case counts and costs). They are
+    bulk inserted and the derived collections (code and prefix index, stock
+    summary) rebuilt, then a chain of step instances, each consuming the
+    batch the previous one produced, is made through the api for the
+    traceability scenario.
+"""
+
+import random
+from decimal import Decimal
+
+from flask import g
+
+from inventorius import app
+from inventorius.autocomplete import rebuild_prefix_index
+from inventorius.code_index import rebuild_code_index
+from inventorius.data_models import Batch, Bin, Sku
+from inventorius.stock import rebuild_stock_summary
+
+# bins and skus of each scale, batches are half the skus
+SCALES = {
+    "1k": 1_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+}
+
+WORDS = ["resistor", "capacitor", "inductor", "diode", "relay", "fuse", "header",
+         "socket", "crystal", "sensor", "switch", "cable", "screw", "washer"]
+COLORS = ["red", "green", "blue", "black", "white", "amber"]
+
+CHUNK_SIZE = 10_000
+
+# ids of the step chain and load fixtures, seven digits so they never meet
+# the six digit ids of even the largest scale
+CHAIN = 2_000_000
+
+COLLECTIONS = ["admin", "batch", "bin", "code_index", "device_tokens", "jobs",
+               "login_failures", "mixture", "mixture_audit", "prefix_index",
+               "search_changes", "sku", "stock_summary", "step_instance",
+               "step_template", "user"]
+
+
+def label(prefix, number):
+    return f"{prefix}{number:06d}"
+
+
+def _code(rng):
+    return "".join(rng.choice("0123456789") for _ in range(12))
+
+
+def _props(rng):
+    props = {"count_per_case": rng.randint(1, 500)}
+    if rng.random() < 0.5:
+        props["cost_per_case"] = {"unit": "USD", "value": round(rng.uniform(1, 500), 2)}
+    if rng.random() < 0.3:
+        props["color"] = rng.choice(COLORS)
+    return props
+
+
+def _name(rng):
+    return f"{rng.choice(COLORS)} {rng.choice(WORDS)} {rng.randint(1, 999)}"
+
+
+def generate(count, seed=0):
+    """Yields (collection name, documents) chunks of a warehouse with
+    `count` bins and skus."""
+    rng = random.Random(seed)
+    batch_count = count // 2
+
+    for start in range(0, count, CHUNK_SIZE):
+        skus = [Sku(id=label("SKU", number), name=_name(rng),
+                    owned_codes=[_code(rng)],
+                    associated_codes=[_code(rng) for _ in range(rng.randint(0, 2))],
+                    props=_props(rng))
+                for number in range(start, min(start + CHUNK_SIZE, count))]
+        yield "sku", [sku.to_mongodb_doc() for sku in skus]
+
+    for start in range(0, batch_count, CHUNK_SIZE):
+        batches = []
+        for number in range(start, min(start + CHUNK_SIZE, batch_count)):
+            batches.append(Batch(
+                id=label("BAT", number), sku_id=label("SKU", rng.randrange(count)),
+                name=_name(rng), owned_codes=[], associated_codes=[_code(rng)],
+                props=_props(rng), qty_remaining=Decimal(rng.randint(1, 1000)),
+                codes=[{"code": f"LOT{number}", "metadata": {"kind": "supplier"}}]))
+        yield "batch", [batch.to_mongodb_doc() for batch in batches]
+
+    for start in range(0, count, CHUNK_SIZE):
+        bins = []
+        for number in range(start, min(start + CHUNK_SIZE, count)):
+            contents = {}
+            for _ in range(rng.randint(0, 3)):
+                if batch_count and rng.random() < 0.5:
+                    item_id = label("BAT", rng.randrange(batch_count))
+                else:
+                    item_id = label("SKU", rng.randrange(count))
+                contents[item_id] = rng.randint(1, 100)
+            bins.append(Bin(id=label("BIN", number), props=_props(rng), contents=contents))
+        yield "bin", [bin.to_mongodb_doc() for bin in bins]
+
+
+def _post(client, path, json):
+    resp = client.post(path, json=json)
+    if resp.status_code != 201:
+        raise RuntimeError(f"seeding {path} failed with {resp.status_code}: {resp.get_data(as_text=True)}")
+    return resp
+
+
+def seed_step_chain(client, depth):
+    """A chain of `depth` step instances, batch n + 1 is made from batch n.
+    Returns the id of the last batch."""
+    bin_id, sku_id = label("BIN", CHAIN), label("SKU", CHAIN)
+    _post(client, "/api/bins", {"id": bin_id, "props": {}})
+    _post(client, "/api/skus", {"id": sku_id, "name": "chain product"})
+    _post(client, "/api/step-templates", {
+        "template_id": "TPL000001", "name": "rework",
+        "inputs": [{"sku_id": sku_id}], "outputs": [{"sku_id": sku_id}]})
+    previous = label("BAT", CHAIN)
+    _post(client, "/api/batches", {"id": previous, "sku_id": sku_id,
+                                   "qty_remaining": depth + 1})
+    _post(client, f"/api/bin/{bin_id}/contents", {"id": previous, "quantity": depth + 1})
+    for step in range(1, depth + 1):
+        batch_id = label("BAT", CHAIN + step)
+        _post(client, "/api/step-instances", {
+            "instance_id": label("INS", CHAIN + step),
+            "template_id": "TPL000001",
+            "operator": {"id": "benchmark"},
+            "consumed": [{"resource_id": previous, "quantity": 1, "bin_id": bin_id}],
+            "produced": [{"batch_id": batch_id, "sku_id": sku_id,
+                          "quantity": depth + 1 - step, "bin_id": bin_id}],
+        })
+        previous = batch_id
+    return previous
+
+
+def seed(database, count, chain_depth=50, seed=0, log=print):
+    """Replace the contents of `database` with a warehouse of `count` bins
+    and skus, returns facts the load scenarios need."""
+    for name in COLLECTIONS:
+        database[name].delete_many({})
+    for collection, docs in generate(count, seed):
+        database[collection].insert_many(docs, ordered=False)
+        log(f"seeded {database[collection].estimated_document_count()} {collection}")
+
+    with app.app_context():
+        g.db = database
+        rebuild_code_index(database)
+        rebuild_prefix_index(database)
+        rebuild_stock_summary(database)
+    log("rebuilt code index, prefix index and stock summary")
+
+    with app.test_client() as client:
+        last_batch = seed_step_chain(client, chain_depth)
+    log(f"seeded a chain of {chain_depth} step instances")
+
+    return {"count": count, "batch_count": count // 2, "chain_last_batch": last_batch}
@@ -0,0 +1,191 @@
+"""
+    benchmarks.test_microbenchmarks
+    ~~~~~~~~~~~~~~
+
+    pytest-benchmark timings of the hot in-process paths: data model
+    conversion, the quantity converters of step instances, mixture draws and
+    one traceability propagation step. Document sizes follow the larger
+    documents of a working warehouse.
+
+        make microbench
+
+    saves each run under .benchmarks/ and compares it with the previous
+    one, failing when the fastest round of a benchmark got slower by more
+    than MICROBENCH_TOLERANCE (the minimum is less sensitive to other load
+    on the machine than the mean). Skipped when pytest-benchmark is not installed.
+"""
+
+import copy
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from inventorius.data_models import (  # noqa: E402
+    Batch,
+    Bin,
+    StepInstance,
+    consumed_items_from_bson,
+    consumed_items_to_bson,
+    produced_items_from_bson,
+    produced_items_to_bson,
+)
+from inventorius.mixture import _proportional_allocation  # noqa: E402
+from inventorius.traceability import TraceabilityService  # noqa: E402
+
+BIN_ITEMS = 500
+BATCH_CODES = 20
+CONSUMED_BATCHES = 40
+CONSUMED_MIXTURES = 10
+MIXTURE_COMPONENTS = 25
+PRODUCED_BATCHES = 10
+
+
+def _mixture_components(count, offset=0):
+    return [{"batch_id": f"BAT{offset + n:06d}",
+             "qty_initial": Decimal(100 + n),
+             "qty_remaining": Decimal("37.5") + n}
+            for n in range(count)]
+
+
+def _consumed_items():
+    items = [{"resource_id": f"BAT{n:06d}", "resource_type": "batch",
+              "bin_id": f"BIN{n:06d}", "quantity": Decimal("12.25")}
+             for n in range(CONSUMED_BATCHES)]
+    items += [{"resource_id": f"MIX{n:06d}", "resource_type": "mixture",
+               "bin_id": f"BIN{n:06d}", "quantity": Decimal("3.5"),
+               "remaining_qty": Decimal("1.75"),
+               "components": _mixture_components(MIXTURE_COMPONENTS,
+                                                 offset=1000 * (n + 1))}
+              for n in range(CONSUMED_MIXTURES)]
+    return items
+
+
+def _produced_items():
+    return [{"batch_id": f"BAT9{n:05d}", "sku_id": "SKU000001",
+             "bin_id": "BIN000001", "quantity": Decimal(50),
+             "name": f"output {n}", "props": {"lot": n},
+             "codes": [{"code": f"LOT-{n:08d}"}]}
+            for n in range(PRODUCED_BATCHES)]
+
+
+def _step_instance_doc():
+    return StepInstance(
+        instance_id="STEP000001", template_id="TMPL000001",
+        operator={"id": "alice"}, notes="line 2 run",
+        metadata={"shift": "night", "line": 2},
+        consumed=_consumed_items(), produced=_produced_items(),
+    ).to_mongodb_doc()
+
+
+def _batch_doc():
+    return Batch(
+        id="BAT000001", sku_id="SKU000001", name="reel of 10k resistors",
+        owned_codes=[f"OWN{n:09d}" for n in range(BATCH_CODES)],
+        associated_codes=[f"ASC{n:09d}" for n in range(BATCH_CODES)],
+        produced_by_instance="STEP000001", qty_remaining=Decimal("9876.5"),
+        codes=[{"code": f"CODE{n:08d}", "metadata": {"source": "scan"}}
+               for n in range(BATCH_CODES)],
+    ).to_mongodb_doc()
+
+
+def _bin_doc():
+    return {"_id": "BIN000001", "props": {"location": "aisle 4"},
+            "contents": {f"SKU{n:06d}": n for n in range(BIN_ITEMS)}}
+
+
+@pytest.mark.parametrize("model,doc", [
+    (Bin, _bin_doc()),
+    (Batch, _batch_doc()),
+    (StepInstance, _step_instance_doc()),
+], ids=["bin", "batch", "step_instance"])
+def test_from_mongodb_doc(benchmark, model, doc):
+    instance = benchmark(model.from_mongodb_doc, doc)
+    assert instance is not None
+
+
+@pytest.mark.parametrize("model,doc", [
+    (Bin, _bin_doc()),
+    (Batch, _batch_doc()),
+    (StepInstance, _step_instance_doc()),
+], ids=["bin", "batch", "step_instance"])
+def test_to_mongodb_doc(benchmark, model, doc):
+    instance = model.from_mongodb_doc(doc)
+    assert benchmark(instance.to_mongodb_doc)["_id"] == doc["_id"]
+
+
+@pytest.mark.parametrize("model,doc", [
+    (Bin, _bin_doc()),
+    (Batch, _batch_doc()),
+    (StepInstance, _step_instance_doc()),
+], ids=["bin", "batch", "step_instance"])
+def test_to_dict_mask_default(benchmark, model, doc):
+    instance = model.from_mongodb_doc(doc)
+    assert benchmark(instance.to_dict, mask_default=True)
+
+
+def test_consumed_items_to_bson(benchmark):
+    items = _consumed_items()
+    assert len(benchmark(consumed_items_to_bson, items)) == len(items)
+
+
+def test_consumed_items_from_bson(benchmark):
+    items = consumed_items_to_bson(_consumed_items())
+    assert len(benchmark(consumed_items_from_bson, items)) == len(items)
+
+
+def test_produced_items_to_bson(benchmark):
+    items = _produced_items()
+    assert len(benchmark(produced_items_to_bson, items)) == len(items)
+
+
+def test_produced_items_from_bson(benchmark):
+    items = produced_items_to_bson(_produced_items())
+    assert len(benchmark(produced_items_from_bson, items)) == len(items)
+
+
+@pytest.mark.parametrize("count", [5, 50, 500])
+def test_proportional_allocation(benchmark, count):
+    components = _mixture_components(count)
+    # a third of every component, so each share is rounded to QUANTUM
+    quantity = sum(c["qty_remaining"] for c in components) / 3
+    remaining, extracted = benchmark(_proportional_allocation, components, quantity)
+    assert sum(c["qty_remaining"] for c in extracted) == quantity
+
+
+def _traceability_service():
+    """A service with the step and its batches cached, usage recorded on
+    every output, ready for the step to propagate upstream."""
+    step = StepInstance.from_mongodb_doc(_step_instance_doc())
+    service = TraceabilityService(database=None)
+    service._step_cache[step.instance_id] = step
+    for item in step.consumed:
+        batch_ids = [item["resource_id"]] if item["resource_type"] == "batch" \
+            else [component["batch_id"] for component in item["components"]]
+        for batch_id in batch_ids:
+            service._batch_cache[batch_id] = Batch(id=batch_id, sku_id="SKU000001")
+    for item in step.produced:
+        service._batch_cache[item["batch_id"]] = Batch(
+            id=item["batch_id"], produced_by_instance=step.instance_id)
+        service._step_usage.setdefault(step.instance_id, {})[item["batch_id"]] = {
+            "min": 5.0, "max": 20.0, "annotations": {"query"}}
+    return service
+
+
+def test_traceability_process_step(benchmark):
+    prepared = _traceability_service()
+
+    def setup():
+        # _process_step narrows the usage entries and adds to the results
+        service = copy.copy(prepared)
+        service._step_usage = copy.deepcopy(prepared._step_usage)
+        service._results = {}
+        return (service,), {}
+
+    def process(service):
+        service._process_step("STEP000001")
+        return service
+
+    service = benchmark.pedantic(process, setup=setup, rounds=200)
+    assert len(service.results()) == CONSUMED_BATCHES + CONSUMED_MIXTURES * MIXTURE_COMPONENTS
@@ -11,6 +11,8 @@ from flask import g, request_started
 sys.path.insert(0, str(Path(__file__).resolve().parent / "src"))
 from inventorius import app as inventorius_flask_app
 from inventorius.db import get_mongo_client
+from inventorius.device_tokens import revocations
+from inventorius.user import user_cache
 
 
 # give tests longer to complete on ci server
@@ -38,13 +40,28 @@ def client():
 def clientContext():
     inventorius_flask_app.testing = True
     inventorius_flask_app.secret_key = "1234"
+    # the stateful tests do not model login throttling, test_passwords
+    # lowers the limits for its own test
+    inventorius_flask_app.config.update(
+        LOGIN_MAX_ACCOUNT_FAILURES=10**6, LOGIN_MAX_ADDRESS_FAILURES=10**6)
     test_db = get_mongo_client().testing
     test_db.admin.delete_many({})
     test_db.batch.delete_many({})
     test_db.bin.delete_many({})
+    test_db.code_index.delete_many({})
+    test_db.device_tokens.delete_many({})
     test_db.sku.delete_many({})
+    test_db.jobs.delete_many({})
+    test_db.login_failures.delete_many({})
     test_db.mixture.delete_many({})
+    test_db.mixture_audit.delete_many({})
+    test_db.prefix_index.delete_many({})
+    test_db.search_changes.delete_many({})
+    test_db.stock_summary.delete_many({})
+    test_db.stock_changes.delete_many({})
     test_db.step_template.delete_many({})
     test_db.step_instance.delete_many({})
     test_db.user.delete_many({})
+    user_cache.clear()
+    revocations.clear()
     yield inventorius_flask_app.test_client()
@@ -8,6 +8,7 @@
 """
 
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 # from flask import Flask, g, Response, url_for
 # from flask import request, redirect
 # import json
@@ -15,11 +16,16 @@ from flask import Flask
 # import pprint
 # from urllib.parse import urlencode
 
+from inventorius.async_db import async_database
+from inventorius.autocomplete import autocomplete
 from inventorius.bin import bin
 from inventorius.batch import batch
+from inventorius.code_index import code_index
 from inventorius.mixture import mixture
 from inventorius.inventorius import inventorius
+from inventorius.jobs import job_runner, jobs
 from inventorius.sku import sku
+from inventorius.stock import stock
 from inventorius.step_template import step_template
 from inventorius.step_instance import step_instance
 from inventorius.traceability import traceability
@@ -27,43 +33,70 @@ from inventorius.traceability import traceability
 # from inventorius.data_models import Bin, MyEncoder, Uniq, Batch, Sku
 from inventorius.user import user
 from inventorius.util import login_manager, no_cache, principals
+from inventorius.compression import compress
+from inventorius.device_tokens import device_tokens
+from inventorius.events import event_bus
+from inventorius.fanout import query_fanout
+from inventorius.passwords import login_throttle, password_hasher
+from inventorius.profiling import profiler, profiling
 from inventorius.resource_models import StatusEndpoint
+from inventorius.search_index import search_index
 
 import platform
 import os
 
-sentry_dsn = False
-try:
-    import sentry_sdk
-    from sentry_sdk.integrations.flask import FlaskIntegration
-    sentry_dsn = os.getenv("SENTRY_DSN")
 
-    if sentry_dsn:
-        print("setup sentry.io integration with configured sentry_dsn")
-        sentry_sdk.init(
-            dsn=sentry_dsn,
-            integrations=[FlaskIntegration()],
+def init_sentry():
+    """Set up sentry.io error reporting when SENTRY_DSN is configured.
+
+    sentry_sdk is only imported when a dsn is present so workers without
+    error reporting do not pay for loading it at startup.
+    """
+    sentry_dsn = os.getenv("SENTRY_DSN")
+    if not sentry_dsn:
+        return False
+    try:
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+    except ModuleNotFoundError:
+        print("error reporting disabled: 'python3-sentry-sdk' not installed")
+        return False
 
-            # Set traces_sample_rate to 1.0 to capture 100%
-            # of transactions for performance monitoring.
-            # We recommend adjusting this value in production.
-            traces_sample_rate=1.0
-        )
+    print("setup sentry.io integration with configured sentry_dsn")
+    sentry_sdk.init(
+        dsn=sentry_dsn,
+        integrations=[FlaskIntegration()],
 
-except ModuleNotFoundError:
-    print("error reporting disabled: 'python3-sentry-sdk' not installed")
+        # share of transactions traced for performance monitoring, 1.0
+        # traces every request, SENTRY_TRACES_SAMPLE_RATE lowers it in production
+        traces_sample_rate=float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "1.0"))
+    )
+    return True
 
 
+sentry_dsn = init_sentry()
 
 app = Flask('inventorius')
 BAD_REQUEST = ('Bad Request', 400)
 
+# behind a reverse proxy (nginx/inventorius.conf) remote_addr is the proxy's,
+# take the client address from the X-Forwarded-* headers the given number of
+# proxies add. Only set it when clients cannot reach the api directly.
+trusted_proxies = int(os.getenv("INVENTORIUS_TRUSTED_PROXIES", "0"))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
 
+app.register_blueprint(autocomplete)
 app.register_blueprint(bin)
 app.register_blueprint(batch)
+app.register_blueprint(code_index)
 app.register_blueprint(mixture)
+app.register_blueprint(profiling)
 app.register_blueprint(inventorius)
+app.register_blueprint(jobs)
 app.register_blueprint(sku)
+app.register_blueprint(stock)
 app.register_blueprint(step_template)
 app.register_blueprint(step_instance)
 app.register_blueprint(traceability)
@@ -89,8 +122,19 @@ def cors_allow_all(response):
 
 
 app.after_request(cors_allow_all)
+# first, so its timing covers the other extensions' request hooks
+profiler.init_app(app)
 login_manager.init_app(app)
 principals.init_app(app)
+device_tokens.init_app(app)
+compress.init_app(app)
+async_database.init_app(app)
+event_bus.init_app(app)
+job_runner.init_app(app)
+password_hasher.init_app(app)
+query_fanout.init_app(app)
+login_throttle.init_app(app)
+search_index.init_app(app)
 
 
 @app.route("/api/status", methods=["GET"])
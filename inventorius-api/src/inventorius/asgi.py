@@ -0,0 +1,26 @@
+"""
+    inventorius.asgi
+    ~~~~~~~~~~~~~~
+
+    ASGI entrypoint, the async serving mode:
+
+        uvicorn inventorius.asgi:app
+
+    The flask views run on a pool of INVENTORIUS_ASGI_THREADS threads
+    (default 10) of the a2wsgi adapter and independent lookups are gathered
+    on the async mongo client (see inventorius.async_db), which this
+    entrypoint turns on unless INVENTORIUS_ASYNC_DB=false. Needs a2wsgi and
+    an ASGI server such as uvicorn, which are not dependencies of the wsgi
+    deployment.
+"""
+
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from inventorius import app as flask_app
+
+if os.getenv("INVENTORIUS_ASYNC_DB") != "false":
+    flask_app.config["ASYNC_DB"] = True
+
+app = WSGIMiddleware(flask_app, workers=int(os.getenv("INVENTORIUS_ASGI_THREADS", "10")))
@@ -0,0 +1,91 @@
+"""
+    inventorius.async_db
+    ~~~~~~~~~~~~~~
+
+    Concurrent mongo lookups with PyMongo's async api.
+
+    Views stay synchronous, independent queries a view needs are handed to
+    an event loop run by a background thread of the worker and awaited
+    together:
+
+        source_bin, destination_exists = async_database.gather(
+            async_bins.load(id, fields=["contents"]),
+            async_bins.exists(destination))
+
+    The loop owns the worker's AsyncMongoClient. The coroutines query the
+    database of the calling request (so tests use the testing database),
+    see AsyncRepository. Lookups are only gathered with ASYNC_DB set (or
+    INVENTORIUS_ASYNC_DB=true, the asgi entrypoint turns it on), views keep
+    their sequential queries otherwise, and with the in-memory storage.
+"""
+
+import asyncio
+import os
+import threading
+from contextvars import ContextVar
+
+from flask import g
+
+from inventorius.db import database_name, mongo_pool_size, storage_backend, type_registry
+from inventorius.profiling import current_profile
+
+# the database the coroutines of the current gather query
+current_database = ContextVar("current_database")
+
+
+class AsyncDatabase:
+    """Flask extension running async lookups on a background event loop."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._client = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ASYNC_DB", os.getenv("INVENTORIUS_ASYNC_DB") == "true")
+        self.app = app
+        app.extensions["async_database"] = self
+
+    @property
+    def enabled(self):
+        # the async client always talks to a mongod
+        return self.app.config["ASYNC_DB"] and storage_backend() == "mongo"
+
+    def _ensure_loop(self):
+        # started on first use, and again in forked workers, which do not
+        # inherit the thread running the loop
+        with self._lock:
+            if self._pid != os.getpid():
+                from pymongo import AsyncMongoClient
+
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 name="async-db", daemon=True).start()
+                db_host = os.getenv("INVENTORIUS_MONGO_HOST", "localhost")
+                db_port = int(os.getenv("INVENTORIUS_MONGO_PORT", "27017"))
+                self._client = AsyncMongoClient(db_host, db_port, type_registry=type_registry,
+                                                maxPoolSize=mongo_pool_size())
+                self._pid = os.getpid()
+            return self._loop
+
+    def gather(self, *coroutines):
+        """Await coroutines concurrently, returns their results in order."""
+        loop = self._ensure_loop()
+        # same database as the request's `db`, resolved in the request thread
+        name = g.db.name if "db" in g else database_name()
+        database = self._client[name]
+
+        profile = current_profile.get()
+
+        async def run():
+            current_database.set(database)
+            current_profile.set(profile)
+            return await asyncio.gather(*coroutines)
+
+        return asyncio.run_coroutine_threadsafe(run(), loop).result()
+
+
+async_database = AsyncDatabase()
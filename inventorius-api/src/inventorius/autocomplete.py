@@ -0,0 +1,175 @@
+"""
+    inventorius.autocomplete
+    ~~~~~~~~~~~~~~
+
+    Typeahead over sku and batch names, ids and codes.
+
+    $text search only matches whole stemmed words, so partial input needs
+    its own index. Each sku and batch has one prefix_index document holding
+    the leading edge n-grams of every word in its name, of its id and of its
+    codes:
+
+        {"_id": "SKU000001", "type": "sku", "label": "Resistor 10k",
+         "terms": ["10k", "resistor", "sku000001"],
+         "prefixes": ["1", "10", "10k", "r", "re", "res", ...]}
+
+    The document is replaced by the same write hooks that keep the code
+    index up to date, existing data are indexed with `flask --app
+    inventorius autocomplete rebuild-index` (run by the debian postinst).
+    GET /api/autocomplete?query=resis answers with a single query on the
+    multikey (prefixes, _id) index.
+"""
+
+import re
+
+from flask import Blueprint, current_app, request, url_for
+from pymongo import ASCENDING
+from voluptuous.error import MultipleInvalid
+
+from inventorius.code_index import changed_resources, changes_watermark
+from inventorius.data_models import Batch, Sku
+from inventorius.db import db
+from inventorius.jobs import job
+from inventorius.resource_models import HypermediaEndpoint
+import inventorius.util_error_responses as problem
+from inventorius.validation import autocomplete_query_schema
+
+autocomplete = Blueprint("autocomplete", __name__)
+
+# longer words are only indexed up to this length, longer queries are
+# checked against the full terms
+MAX_PREFIX_LENGTH = 16
+
+_word = re.compile(r"\w+")
+
+
+def words(text):
+    """Casefolded words of a name, id or code."""
+    return _word.findall((text or "").casefold())
+
+
+def _prefixes(terms):
+    prefixes = set()
+    for term in terms:
+        for length in range(1, min(len(term), MAX_PREFIX_LENGTH) + 1):
+            prefixes.add(term[:length])
+    return sorted(prefixes)
+
+
+def resource_terms(model):
+    """Words of a sku or batch id, name and codes."""
+    terms = set(words(model.id))
+    terms.update(words(getattr(model, "name", None)))
+    for code in getattr(model, "owned_codes", None) or []:
+        terms.update(words(code))
+    for code in getattr(model, "associated_codes", None) or []:
+        terms.update(words(code))
+    for entry in getattr(model, "codes", None) or []:
+        terms.update(words(entry["code"]))
+    return terms
+
+
+def _prefix_doc(resource_type, model):
+    terms = resource_terms(model)
+    return {
+        "_id": model.id,
+        "type": resource_type,
+        "label": getattr(model, "name", None) or "",
+        "terms": sorted(terms),
+        "prefixes": _prefixes(terms),
+    }
+
+
+def index_prefixes(resource_type, model, database=None):
+    """Replace the prefix index document of a sku or batch."""
+    if database is None:
+        database = db
+    doc = _prefix_doc(resource_type, model)
+    database.prefix_index.replace_one({"_id": model.id}, doc, upsert=True)
+
+
+def unindex_prefixes(resource_id):
+    db.prefix_index.delete_one({"_id": resource_id})
+
+
+def complete(query, limit=10):
+    """Up to `limit` (id, type, label) dicts whose words start with every
+    word of query."""
+    query_words = words(query)
+    if not query_words:
+        return []
+    conditions = []
+    for word in query_words:
+        conditions.append({"prefixes": word[:MAX_PREFIX_LENGTH]})
+        if len(word) > MAX_PREFIX_LENGTH:
+            conditions.append({"terms": {"$regex": f"^{re.escape(word)}"}})
+    filter = conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    cursor = db.prefix_index.find(
+        filter, {"type": 1, "label": 1}).sort("_id", 1).limit(limit)
+    return [{"id": doc["_id"], "type": doc["type"], "label": doc["label"]}
+            for doc in cursor]
+
+
+def rebuild_prefix_index(database=None):
+    """Recompute the whole prefix_index collection from skus and batches.
+
+    Built in a scratch collection and renamed over the live one, like the
+    code index (see code_index.rebuild_code_index).
+    """
+    if database is None:
+        database = db
+    since = changes_watermark()
+    scratch = database.prefix_index_rebuild
+    scratch.drop()
+    # same index as db.get_mongo_client, renaming keeps it
+    scratch.create_index([("prefixes", ASCENDING), ("_id", ASCENDING)])
+    count = 0
+    projection = {"name": 1, "owned_codes": 1, "associated_codes": 1, "codes": 1}
+    for resource_type, collection, model_type in (("sku", database.sku, Sku),
+                                                  ("batch", database.batch, Batch)):
+        docs = [_prefix_doc(resource_type, model_type.from_mongodb_doc(doc))
+                for doc in collection.find({}, projection)]
+        if docs:
+            scratch.insert_many(docs)
+            count += len(docs)
+    scratch.rename("prefix_index", dropTarget=True)
+
+    for resource_type, resource_id, model in changed_resources(since, database):
+        if model is None:
+            database.prefix_index.delete_one({"_id": resource_id})
+        else:
+            index_prefixes(resource_type, model, database)
+    return count
+
+
+@job("rebuild-prefix-index")
+def rebuild_prefix_index_job(job):
+    return {"entries": rebuild_prefix_index()}
+
+
+@autocomplete.cli.command("rebuild-index")
+def rebuild_index_command():
+    """Recompute the typeahead prefix index from skus and batches."""
+    count = rebuild_prefix_index()
+    print(f"rebuilt prefix index with {count} entries")
+
+
+@autocomplete.route("/api/autocomplete", methods=["GET"])
+def autocomplete_get():
+    try:
+        args = autocomplete_query_schema(request.args.to_dict())
+    except MultipleInvalid as e:
+        return problem.invalid_params_response(e)
+
+    # served from the in-memory search index when a worker has one
+    search_index = current_app.extensions.get("search_index")
+    if search_index is not None and search_index.ready:
+        results = search_index.complete(args["query"], args.get("limit", 10))
+    else:
+        results = complete(args["query"], args.get("limit", 10))
+    state = {
+        "query": args["query"],
+        "returned_num_results": len(results),
+        "results": results,
+    }
+    return HypermediaEndpoint(url_for("autocomplete.autocomplete_get"), state).get_response()
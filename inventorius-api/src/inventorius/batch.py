@@ -2,6 +2,8 @@ from flask import Blueprint, request, Response, url_for, after_this_request
 from voluptuous.error import MultipleInvalid
 from inventorius.data_models import Batch, Bin, Sku, DataModelJSONEncoder as Encoder
 from inventorius.db import db
+from inventorius.events import ResourceDeleted, ResourceSaved, event_bus
+from inventorius.repository import batches, skus
 from inventorius.resource_models import BatchBinsEndpoint, BatchEndpoint
 import inventorius.resource_operations as operation
 from inventorius.util import admin_increment_code, check_code_list, no_cache
@@ -28,17 +30,16 @@ def batches_post():
 
     batch = Batch.from_json(json)
 
-    existing_batch = db.batch.find_one({"_id": batch.id})
-    if existing_batch:
+    if batches.exists(batch.id):
         return problem.duplicate_resource_response("id")
 
     if batch.sku_id:
-        existing_sku = db.sku.find_one({"_id": batch.sku_id})
-        if not existing_sku:
+        if not skus.exists(batch.sku_id):
             return problem.invalid_params_response(problem.missing_resource_param_error("sku_id", "must be an existing sku id"))
 
     admin_increment_code("BAT", batch.id)
     db.batch.insert_one(batch.to_mongodb_doc())
+    event_bus.publish(ResourceSaved("batch", batch.id))
 
     # Add text index if not yet created
     # TODO: This should probably be turned into a global flag
@@ -50,7 +51,7 @@ def batches_post():
 
 @batch.route("/api/batch/<id>", methods=["GET"])
 def batch_get(id):
-    existing = Batch.from_mongodb_doc(db.batch.find_one({"_id": id}))
+    existing = batches.load(id)
 
     if not existing:
         return problem.missing_batch_response(id)
@@ -65,86 +66,42 @@ def batch_patch(id):
         # must be batch patch, where json["id"] is prefixed and equals id
         json = batch_patch_schema.extend(
             {Required("id"): All(prefixed_id("BAT"), id)})(request.json)
-        forced = forced_schema(request.args).get("force")
+        forced = forced_schema(request.args.to_dict()).get("force")
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing_batch = Batch.from_mongodb_doc(db.batch.find_one({"_id": id}))
-    if not existing_batch:
-        return problem.missing_batch_response(id)
-
     if json.get("sku_id"):
-        existing_sku = db.sku.find_one({"_id": json['sku_id']})
-        if not existing_sku:
+        if not skus.exists(json['sku_id']):
             return problem.invalid_params_response(problem.missing_resource_param_error("sku_id", "must be an existing sku id"))
 
-    if (existing_batch.sku_id
-        and "sku_id" in json
-        and existing_batch.sku_id != json["sku_id"]
-            and not forced):
-        return problem.dangerous_operation_unforced_response("sku_id", "The sku of this batch has already been set. Can not change without force=true.")
+    # an already set sku can only be changed with force=true, checked as part
+    # of the update so the check and the write are atomic
+    filters = {}
+    if "sku_id" in json and not forced:
+        filters["sku_id"] = {"$in": [None, "", json["sku_id"]]}
 
-    new_batch_doc = Batch.from_json({"_id": id, **json}).to_mongodb_doc()
-
-    if "props" in json.keys():
-        db.batch.update_one({"_id": id},
-                            {"$set": {"props": new_batch_doc['props']}})
-    if "name" in json.keys():
-        db.batch.update_one({"_id": id},
-                            {"$set": {"name": new_batch_doc['name']}})
-
-    if "sku_id" in json.keys():
-        if not json["sku_id"]:
-            db.batch.update_one({"_id": id}, {"$unset": {"sku_id": ""}})
-        else:
-            db.batch.update_one({"_id": id},
-                                {"$set": {"sku_id": json['sku_id']}})
-
-    if "owned_codes" in json.keys():
-        db.batch.update_one({"_id": id},
-                            {"$set": {"owned_codes": json['owned_codes']}})
-    if "associated_codes" in json.keys():
-        db.batch.update_one({"_id": id},
-                            {"$set": {"associated_codes": json['associated_codes']}})
-    if "produced_by_instance" in json.keys():
-        if json["produced_by_instance"] is None:
-            db.batch.update_one({"_id": id}, {"$unset": {"produced_by_instance": ""}})
-        else:
-            db.batch.update_one({"_id": id},
-                                {"$set": {"produced_by_instance": json['produced_by_instance']}})
-    if "qty_remaining" in json.keys():
-        if json["qty_remaining"] is None:
-            db.batch.update_one({"_id": id}, {"$unset": {"qty_remaining": ""}})
-        else:
-            db.batch.update_one({"_id": id},
-                                {"$set": {"qty_remaining": json['qty_remaining']}})
-    if "codes" in json.keys():
-        if json["codes"] is None:
-            db.batch.update_one({"_id": id}, {"$unset": {"codes": ""}})
-        else:
-            db.batch.update_one({"_id": id},
-                                {"$set": {"codes": json['codes']}})
-
-    updated_batch = Batch.from_mongodb_doc(db.batch.find_one({"_id": id}))
+    updated_batch = batches.patch(id, json, fields=[], **filters)
+    if updated_batch is None:
+        if not batches.exists(id):
+            return problem.missing_batch_response(id)
+        return problem.dangerous_operation_unforced_response("sku_id", "The sku of this batch has already been set. Can not change without force=true.")
+    event_bus.publish(ResourceSaved("batch", id))
     return BatchEndpoint.from_batch(updated_batch).redirect_response(False)
 
 
 @batch.route("/api/batch/<id>", methods=["DELETE"])
 @no_cache
 def batch_delete(id):
-    existing = Batch.from_mongodb_doc(db.batch.find_one({"_id": id}))
-    if not existing:
+    if not batches.exists(id):
         return problem.missing_batch_response(id)
     else:
         db.batch.delete_one({"_id": id})
-        return BatchEndpoint.from_batch(existing).deleted_success_response()
+        event_bus.publish(ResourceDeleted("batch", id))
+        return BatchEndpoint.from_id(id).deleted_success_response()
 
 
 @batch.route("/api/batch/<id>/bins", methods=["GET"])
 def batch_bins_get(id):
-    resp = Response()
-    existing = Batch.from_mongodb_doc(db.batch.find_one({"_id": id}))
-
-    if not existing:
+    if not batches.exists(id):
         return problem.missing_batch_response(id)
     return BatchBinsEndpoint.from_id(id, retrieve=True).get_response()
@@ -1,14 +1,18 @@
 from flask import Blueprint, request, Response, url_for, after_this_request
-from voluptuous.error import MultipleInvalid
-from inventorius.data_models import Bin, DataModelJSONEncoder as Encoder
+from voluptuous.error import Invalid, MultipleInvalid
+from inventorius.data_models import Bin, DataModelJSONEncoder as Encoder, mark_nonfinite
 from inventorius.db import db
-from inventorius.resource_models import BinEndpoint
+from inventorius.repository import bins
+from inventorius.stock import remove_bin
+from inventorius.resource_models import BinEndpoint, HypermediaEndpoint
 from inventorius.util import get_body_type, admin_increment_code, no_cache
 import inventorius.util_error_responses as problem
 import inventorius.util_success_responses as success
-from inventorius.validation import bin_patch_schema, new_bin_schema
+from inventorius.validation import bin_patch_schema, bins_query_schema, new_bin_schema
 
+import base64
 import json
+import re
 
 bin = Blueprint("bin", __name__)
 
@@ -21,8 +25,7 @@ def bins_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
     
-    existing = db.bin.find_one({'_id': json['id']})
-    if existing:
+    if bins.exists(json['id']):
         return problem.duplicate_resource_response("id")
 
     bin = Bin.from_json(json)
@@ -31,9 +34,135 @@ def bins_post():
     return BinEndpoint.from_bin(bin).created_success_response()
 
 
+def _encode_cursor(sort_value, bin_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, bin_id]).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        sort_value, bin_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise MultipleInvalid([Invalid("invalid cursor", path=["after"])])
+    # both end up in the query, a dict would be read as an operator
+    if not isinstance(sort_value, (str, int, float, bool, type(None))) \
+            or not isinstance(bin_id, str):
+        raise MultipleInvalid([Invalid("invalid cursor", path=["after"])])
+    return sort_value, bin_id
+
+
+# keys of props filters, no "$" operators or "." paths into other fields
+_props_key = re.compile(r"props\.[\w -]+")
+
+
+def _props_filter(args):
+    """props.<key>=<value> args, a numeric value also matches the number.
+    Raises MultipleInvalid for keys other than word characters, spaces and
+    dashes."""
+    match = {}
+    for key, value in args.items():
+        if key.startswith("props."):
+            if not _props_key.fullmatch(key):
+                raise MultipleInvalid([Invalid("invalid props filter", path=[key])])
+            candidates = [value]
+            try:
+                candidates.append(float(value) if "." in value else int(value))
+            except ValueError:
+                pass
+            match[key] = {"$in": candidates}
+    return match
+
+
+_derived_fields = {
+    "item_count": {"$size": "$_contents"},
+    "unit_count": {"$sum": "$_contents.v"},
+}
+
+
+@bin.route('/api/bins', methods=['GET'])
+def bins_get():
+    """List bins, filtered, sorted and projected by the database.
+
+    Pages are chained with the `after` cursor returned as `next`, so deep
+    pages cost the same as the first one.
+    """
+    try:
+        args = bins_query_schema(request.args.to_dict())
+        after = _decode_cursor(args["after"]) if "after" in args else None
+        match = _props_filter(request.args)
+    except MultipleInvalid as e:
+        return problem.invalid_params_response(e)
+
+    fields = args.get("fields", ["id", "props", "item_count", "unit_count"])
+    sort = args.get("sort", "id")
+    limit = args.get("limit", 20)
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    sort_field = "_id" if sort_key == "id" else sort_key
+
+    if "prefix" in args:
+        match["_id"] = {"$regex": f"^{re.escape(args['prefix'])}"}
+    if args.get("nonEmpty") == "true":
+        match["contents"] = {"$exists": True, "$ne": {}}
+    if "contains" in args:
+        match[f"contents.{args['contains']}"] = {"$exists": True}
+
+    keyset = []
+    if after is not None:
+        after_value, after_id = after
+        compare = "$lt" if descending else "$gt"
+        if sort_field == "_id":
+            keyset.append({"$match": {"_id": {compare: after_id}}})
+        else:
+            keyset.append({"$match": {"$or": [
+                {sort_field: {compare: after_value}},
+                {sort_field: after_value, "_id": {compare: after_id}},
+            ]}})
+    direction = -1 if descending else 1
+    keyset.append({"$sort": {sort_field: direction, "_id": direction}
+                   if sort_field != "_id" else {"_id": direction}})
+    keyset.append({"$limit": limit + 1})
+
+    derived = {key: expression for key, expression in _derived_fields.items()
+               if key in fields or key == sort_key}
+    add_derived = []
+    if derived:
+        add_derived.append({"$addFields": {
+            "_contents": {"$objectToArray": {"$ifNull": ["$contents", {}]}}}})
+        add_derived.append({"$addFields": derived})
+    if sort_key in _derived_fields:
+        pipeline = [{"$match": match}, *add_derived, *keyset]
+    else:
+        # the page is cut on stored fields, derive counts for its bins only
+        pipeline = [{"$match": match}, *keyset, *add_derived]
+    projection = {"_id": 1, sort_field: 1}
+    projection.update({key: 1 for key in fields if key != "id"})
+    pipeline.append({"$project": projection})
+
+    docs = list(db.bin.aggregate(pipeline))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    results = []
+    for doc in docs:
+        result = {"id": doc["_id"]} if "id" in fields else {}
+        result.update({key: mark_nonfinite(doc.get(key)) for key in fields if key != "id"})
+        results.append(result)
+
+    state = {
+        "limit": limit,
+        "returned_num_results": len(results),
+        "results": results,
+    }
+    if has_more:
+        last = docs[-1]
+        state["next"] = _encode_cursor(last.get(sort_field), last["_id"])
+
+    return HypermediaEndpoint(url_for("bin.bins_get"), state).get_response()
+
+
 @bin.route('/api/bin/<id>', methods=['GET'])
 def bin_get(id):
-    existing = Bin.from_mongodb_doc(db.bin.find_one({"_id": id}))
+    existing = bins.load(id)
     if existing is None:
         return problem.missing_bin_response(id)
     else:
@@ -48,26 +177,23 @@ def bin_patch(id):
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing = Bin.from_mongodb_doc(db.bin.find_one({"_id": id}))
-    if existing is None:
-        problem.missing_bin_response(id)
-
-    if "props" in json.keys():
-        db.bin.update_one({"_id": id},
-                          {"$set": {"props": json['props']}})
+    updated = bins.patch(id, json, fields=[])
+    if updated is None:
+        return problem.missing_bin_response(id)
 
-    return BinEndpoint.from_bin(existing).updated_success_response()
+    return BinEndpoint.from_bin(updated).updated_success_response()
 
 
 @bin.route('/api/bin/<id>', methods=['DELETE'])
 @no_cache
 def bin_delete(id):
-    existing = Bin.from_mongodb_doc(db.bin.find_one({"_id": id}))
+    existing = bins.load(id, fields=["contents"])
     if existing is None:
         return problem.missing_bin_response(id)
-        
+
     if request.args.get('force', 'false') == 'true' or len(existing.contents.keys()) == 0:
         db.bin.delete_one({"_id": id})
+        remove_bin(id, existing.contents)
         return success.bin_deleted_response(id)
     else:
         return problem.dangerous_operation_unforced_response("id", "bin must be empty")
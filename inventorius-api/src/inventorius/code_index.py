@@ -0,0 +1,167 @@
+"""
+    inventorius.code_index
+    ~~~~~~~~~~~~~~
+
+    Label code lookups.
+
+    Every code on a sku or batch has an entry in the code_index collection:
+
+        {"code": "0123456789", "kind": "owned", "type": "sku",
+         "resource_id": "SKU000001"}
+        {"code": "LOT-42", "kind": "structured", "type": "batch",
+         "resource_id": "BAT000001", "metadata": {"kind": "supplier"}}
+
+    `kind` is one of owned, associated or structured (the Batch.codes
+    entries). Entries are replaced whenever a resource's codes change, so a
+    barcode scan resolves with one indexed query on `code`. Entries for
+    existing data are built with `flask --app inventorius code rebuild-index`,
+    which the debian postinst runs on every install and upgrade.
+
+    The unique index is on (code, kind, resource_id) rather than on owned
+    codes alone, the api has always accepted an owned code on more than one
+    resource and the lookup lists every owner.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from flask import Blueprint, url_for
+from pymongo import ASCENDING
+
+from inventorius.data_models import Batch, Sku
+from inventorius.db import db
+from inventorius.jobs import job
+from inventorius.resource_models import HypermediaEndpoint
+import inventorius.util_error_responses as problem
+
+code_index = Blueprint("code_index", __name__, cli_group="code")
+
+_kind_order = {"owned": 0, "associated": 1, "structured": 2}
+_type_order = {"sku": 0, "batch": 1}
+
+
+def code_entries(resource_type, model):
+    entries = []
+    seen = set()
+
+    def add(code, kind, **extra):
+        if (code, kind) in seen:
+            return
+        seen.add((code, kind))
+        entries.append({"code": code, "kind": kind, "type": resource_type,
+                        "resource_id": model.id, **extra})
+
+    for code in getattr(model, "owned_codes", None) or []:
+        add(code, "owned")
+    for code in getattr(model, "associated_codes", None) or []:
+        add(code, "associated")
+    for entry in getattr(model, "codes", None) or []:
+        add(entry["code"], "structured", metadata=entry.get("metadata") or {})
+    return entries
+
+
+def index_codes(resource_type, model, database=None):
+    """Replace the index entries of a sku or batch with its current codes."""
+    if database is None:
+        database = db
+    database.code_index.delete_many({"resource_id": model.id})
+    entries = code_entries(resource_type, model)
+    if entries:
+        database.code_index.insert_many(entries)
+
+
+def unindex_codes(resource_id):
+    db.code_index.delete_many({"resource_id": resource_id})
+
+
+def lookup_code(code):
+    """Index entries for a code, owners first then skus before batches."""
+    entries = list(db.code_index.find({"code": code}, {"_id": 0}))
+    entries.sort(key=lambda entry: (_kind_order[entry["kind"]],
+                                    _type_order[entry["type"]],
+                                    entry["resource_id"]))
+    return entries
+
+
+def changes_watermark():
+    """Where a rebuild starting now replays search_changes from. ObjectIds
+    from different workers are only ordered to the second, hence the overlap."""
+    return ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=2))
+
+
+def changed_resources(since, database=None):
+    """(resource type, id, model or None if deleted) of the skus and batches
+    recorded in search_changes since a watermark."""
+    if database is None:
+        database = db
+    ids = {change["resource_id"]
+           for change in database.search_changes.find({"_id": {"$gte": since}})}
+    for resource_id in sorted(ids):
+        resource_type, model_type = ("sku", Sku) if resource_id.startswith("SKU") \
+            else ("batch", Batch)
+        doc = database[resource_type].find_one({"_id": resource_id})
+        yield resource_type, resource_id, model_type.from_mongodb_doc(doc)
+
+
+def rebuild_code_index(database=None):
+    """Recompute the whole code_index collection from skus and batches.
+
+    The entries are written to a scratch collection and renamed over the
+    live one, so lookups keep answering meanwhile. Resources saved while it
+    runs are indexed again from search_changes once it is in place.
+    """
+    if database is None:
+        database = db
+    since = changes_watermark()
+    scratch = database.code_index_rebuild
+    scratch.drop()
+    # same indexes as db.get_mongo_client, renaming keeps them
+    scratch.create_index(
+        [("code", ASCENDING), ("kind", ASCENDING), ("resource_id", ASCENDING)], unique=True)
+    scratch.create_index("resource_id")
+    count = 0
+    projection = {"owned_codes": 1, "associated_codes": 1, "codes": 1}
+    for resource_type, collection, model_type in (("sku", database.sku, Sku),
+                                                  ("batch", database.batch, Batch)):
+        for doc in collection.find({}, projection):
+            entries = code_entries(resource_type, model_type.from_mongodb_doc(doc))
+            if entries:
+                scratch.insert_many(entries)
+                count += len(entries)
+    scratch.rename("code_index", dropTarget=True)
+
+    for resource_type, resource_id, model in changed_resources(since, database):
+        if model is None:
+            database.code_index.delete_many({"resource_id": resource_id})
+        else:
+            index_codes(resource_type, model, database)
+    return count
+
+
+@job("rebuild-code-index")
+def rebuild_code_index_job(job):
+    return {"entries": rebuild_code_index()}
+
+
+@code_index.cli.command("rebuild-index")
+def rebuild_index_command():
+    """Recompute the label code index from skus and batches."""
+    count = rebuild_code_index()
+    print(f"rebuilt code index with {count} entries")
+
+
+@code_index.route("/api/code/<code>", methods=["GET"])
+def code_get(code):
+    entries = lookup_code(code)
+    if not entries:
+        return problem.missing_resource_response(url_for("code_index.code_get", code=code))
+
+    owner = next((entry["resource_id"] for entry in entries
+                  if entry["kind"] == "owned"), None)
+    state = {
+        "code": code,
+        "owner": owner,
+        "matches": [{key: value for key, value in entry.items() if key != "code"}
+                    for entry in entries],
+    }
+    return HypermediaEndpoint(url_for("code_index.code_get", code=code), state).get_response()
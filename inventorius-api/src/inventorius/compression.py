@@ -0,0 +1,152 @@
+"""
+    inventorius.compression
+    ~~~~~~~~~~~~~~
+
+    Response compression negotiated with the Accept-Encoding header.
+
+    gzip is always available, brotli ("br") is preferred when the brotli
+    package is installed. Bodies smaller than COMPRESS_MIN_SIZE are sent as
+    is, streamed (generator) responses are compressed chunk by chunk.
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from threading import Lock
+
+from flask import request
+
+
+COMPRESSIBLE_MIMETYPES = [
+    "application/json",
+    "application/problem+json",
+    "application/msgpack",
+    "application/cbor",
+    "text/plain",
+    "text/csv",
+]
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, level):
+        import brotli
+        self._compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def _brotli_available():
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Compress:
+    """Flask extension compressing responses in an after_request hook.
+
+    Compressed bodies of regular responses are kept in a small LRU cache
+    keyed by a digest of the uncompressed body, so repeatedly served
+    payloads (eg. unchanged search results) are only compressed once.
+    """
+
+    def __init__(self, app=None):
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
+        self._encodings = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESS_LEVEL", 6)
+        app.config.setdefault("COMPRESS_MIMETYPES", COMPRESSIBLE_MIMETYPES)
+        app.config.setdefault("COMPRESS_CACHE_SIZE", 64)
+        self.app = app
+        app.after_request(self.after_request)
+
+    def encodings(self):
+        if self._encodings is None:
+            self._encodings = ["br", "gzip"] if _brotli_available() else ["gzip"]
+        return self._encodings
+
+    def _compressor(self, encoding):
+        level = self.app.config["COMPRESS_LEVEL"]
+        if encoding == "br":
+            return _BrotliCompressor(level)
+        return _GzipCompressor(level)
+
+    def compress(self, data, encoding):
+        cache_size = self.app.config["COMPRESS_CACHE_SIZE"]
+        if cache_size:
+            key = (encoding, hashlib.blake2b(data, digest_size=20).digest())
+            with self._cache_lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    return self._cache[key]
+
+        compressor = self._compressor(encoding)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        if cache_size:
+            with self._cache_lock:
+                self._cache[key] = compressed
+                while len(self._cache) > cache_size:
+                    self._cache.popitem(last=False)
+        return compressed
+
+    def compress_stream(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def after_request(self, response):
+        response.vary.add("Accept-Encoding")
+
+        if (request.method == "HEAD"
+                or response.status_code < 200
+                or response.status_code in (204, 304)
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in self.app.config["COMPRESS_MIMETYPES"]):
+            return response
+
+        encoding = request.accept_encodings.best_match(self.encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.app.config["COMPRESS_MIN_SIZE"]:
+                return response
+            response.set_data(self.compress(data, encoding))
+
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+compress = Compress()
@@ -1,12 +1,30 @@
 from email.policy import default
+import copy
 import json
+import math
+from decimal import Decimal
 from bson.decimal128 import Decimal128
 
 # -------- Helper functions
 
 
+# DataModel schemas are fixed once the class is defined, so the dir() scans
+# below are only done once per class.
+_class_variables_cache = {}
+_fields_cache = {}
+_subdoc_keys_cache = {}
+
+
 def get_class_variables(cls):
     """Returns a list of class variables of interest. Filters out callable and dunder variables."""
+    if isinstance(cls, type):
+        if cls not in _class_variables_cache:
+            _class_variables_cache[cls] = _scan_class_variables(cls)
+        return _class_variables_cache[cls]
+    return _scan_class_variables(cls)
+
+
+def _scan_class_variables(cls):
     class_variables = []
     for attr in dir(cls):
         attr_value = getattr(cls, attr)
@@ -19,9 +37,21 @@ def get_class_variables(cls):
 
 
 def get_fields(cls):
-    return [attr for attr in get_class_variables(cls)
+    if cls not in _fields_cache:
+        _fields_cache[cls] = [
+            attr for attr in get_class_variables(cls)
             if issubclass(getattr(cls, attr).__class__, DataField) or issubclass(getattr(cls, attr).__class__, Subdoc)
-            ]
+        ]
+    return _fields_cache[cls]
+
+
+def get_subdoc_keys(cls):
+    if cls not in _subdoc_keys_cache:
+        _subdoc_keys_cache[cls] = [
+            attr for attr in get_fields(cls)
+            if isinstance(getattr(cls, attr), Subdoc)
+        ]
+    return _subdoc_keys_cache[cls]
 
 # def get_subdocs(cls):
 #     return list(filter(lambda attr: issubclass(getattr(cls, attr).__class__, DataModel),
@@ -32,6 +62,8 @@ def get_fields(cls):
 
 class DataModelJSONEncoder(json.JSONEncoder):
     def default(self, o):
+        if isinstance(o, (Decimal, Decimal128)):
+            return quantity_to_number(o)
         return {k: v for k, v in o.__dict__.items() if k != None}
 
 
@@ -139,6 +171,17 @@ class DataModel():
                 return False
         return True
 
+    def to_json_dict(self):
+        """Plain dict of the instance variables, equivalent to what
+        DataModelJSONEncoder produces, without going through a per object
+        `default()` callback. Subdocs are converted recursively."""
+        prepared_dict = {key: mark_nonfinite(value) for key, value in self.__dict__.items()}
+        for key in get_subdoc_keys(type(self)):
+            value = prepared_dict.get(key)
+            if isinstance(value, DataModel):
+                prepared_dict[key] = value.to_json_dict()
+        return prepared_dict
+
     def to_json(self, mask_default=True):
         return json.dumps(self.to_dict(mask_default), cls=DataModelJSONEncoder)
 
@@ -193,6 +236,23 @@ class DataModel():
                 data_model_dict[model_key] = model_value
         return cls(**data_model_dict)
 
+    @classmethod
+    def from_partial_mongodb_doc(cls, mongo_dict, loaded):
+        """Like from_mongodb_doc, for a document fetched with a projection.
+
+        Only the model fields named in `loaded` are available on the returned
+        instance, reading any other field raises UnloadedFieldError.
+        """
+        if mongo_dict is None:
+            return None
+        unloaded = [key for key in get_fields(cls) if key not in loaded]
+        if not unloaded:
+            return cls.from_mongodb_doc(mongo_dict)
+        instance = partial_class(cls, unloaded).from_mongodb_doc(mongo_dict)
+        for key in unloaded:
+            delattr(instance, key)
+        return instance
+
     def to_mongodb_doc(self):
         model_keys = get_fields(type(self))
 
@@ -244,9 +304,61 @@ class DataModel():
                     continue
                 else:
                     # otherwise include the value in the output
-                    prepared_dict[key] = value
+                    prepared_dict[key] = mark_nonfinite(value)
         return prepared_dict
 
+# -------- Partially loaded data models
+
+
+class UnloadedFieldError(AttributeError):
+    """Raised when reading a field that was left out of a partial load."""
+
+
+class _UnloadedField():
+    """Stands in for a DataField/Subdoc on a partial model class.
+
+    Reads raise UnloadedFieldError unless the field was assigned on the
+    instance. Class level access returns a non-required copy of the field so
+    the schema helpers keep working.
+    """
+
+    def __init__(self, name, field, model_name):
+        self.name = name
+        self.model_name = model_name
+        self.field = copy.copy(field)
+        if isinstance(self.field, DataField):
+            self.field.required = False
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self.field
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            raise UnloadedFieldError(
+                f"'{self.name}' was not loaded for this {self.model_name}") from None
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def __delete__(self, instance):
+        instance.__dict__.pop(self.name, None)
+
+
+_partial_classes = {}
+
+
+def partial_class(cls, unloaded):
+    """Subclass of `cls` whose `unloaded` fields raise UnloadedFieldError."""
+    key = (cls, frozenset(unloaded))
+    if key not in _partial_classes:
+        _partial_classes[key] = type(
+            f"Partial{cls.__name__}", (cls,),
+            {name: _UnloadedField(name, getattr(cls, name), cls.__name__)
+             for name in unloaded})
+    return _partial_classes[key]
+
+
 # -------- Data model flags
 
 
@@ -261,6 +373,8 @@ class UserData(DataModel):
     shadow_id = DataField("shadow_id", required=True)
     password_hash = DataField("password_hash", required=True)
     password_salt = DataField("password_salt", required=True)
+    # see inventorius.passwords, users created before versioning are on 1
+    password_hash_version = DataField("password_hash_version", default=1)
     active = DataField("active", default=False)
     # role = DataField("role")
     name = DataField("name")
@@ -269,7 +383,7 @@ class UserData(DataModel):
 
 def currency_from_bson(units):
     assert units["unit"] == "USD"
-    return {"unit": "USD", "value": float(units['value'].to_decimal())}
+    return {"unit": "USD", "value": float(as_quantity(units['value']))}
 
 
 def currency_to_bson(units):
@@ -277,20 +391,72 @@ def currency_to_bson(units):
     return {"unit": "USD", "value": Decimal128(str(units['value']))}
 
 
+# Quantities are Decimal from the moment they are read from bson or a request
+# until they are written back (Decimal128) or rendered (a JSON number).
+
+def as_quantity(value):
+    """Coerce a quantity to Decimal.
+
+    Decimals pass through, Decimal128 and ints convert without parsing a
+    string. Floats (from request bodies) go through their shortest repr so
+    eg. 0.1 stays Decimal("0.1").
+    """
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, int):
+        return Decimal(value)
+    return Decimal(repr(value)) if isinstance(value, float) else Decimal(value)
+
+
+class NonFinite(float):
+    """An infinite or NaN float on its way to a response. orjson and msgspec
+    write those as null, they pass this subclass to their fallback instead
+    (see inventorius.serialization)."""
+
+
+def mark_nonfinite(value):
+    """value with its infinite and NaN floats made NonFinite. Free-form json
+    like props is the only source of them, it reaches responses through the
+    fields of models and the bin listing."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else NonFinite(value)
+    if isinstance(value, dict):
+        return {key: mark_nonfinite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mark_nonfinite(item) for item in value]
+    return value
+
+
+def quantity_to_number(quantity):
+    """int for whole quantities, float otherwise. Used for JSON output and the
+    plain numeric counts kept in bin contents."""
+    if quantity is None:
+        return None
+    quantity = as_quantity(quantity)
+    if not quantity.is_finite():
+        # stored before validation refused them, written as json does
+        return float("nan") if quantity.is_nan() else float(quantity)
+    if quantity == quantity.to_integral_value():
+        return int(quantity)
+    return float(quantity)
+
+
 def quantity_to_bson(quantity):
     if quantity is None:
         return None
     if isinstance(quantity, Decimal128):
         return quantity
-    return Decimal128(str(quantity))
+    return Decimal128(as_quantity(quantity))
 
 
 def quantity_from_bson(quantity):
     if quantity is None:
         return None
-    if isinstance(quantity, Decimal128):
-        return float(quantity.to_decimal())
-    return quantity
+    return as_quantity(quantity)
 
 
 def normalize_code_entry(entry):
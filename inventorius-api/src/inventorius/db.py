@@ -1,35 +1,126 @@
 import os
+from decimal import Decimal
 
+from bson.codec_options import TypeCodec, TypeRegistry
+from bson.decimal128 import Decimal128
 from flask import g
-from gridfs import GridFS
-from pymongo import TEXT, MongoClient
+from pymongo import ASCENDING, TEXT, MongoClient
+from pymongo.errors import CollectionInvalid
 from werkzeug.local import LocalProxy
 
 # memoize mongo_client
 _mongo_client = None
 
 
+class DecimalCodec(TypeCodec):
+    """Quantities are stored as Decimal128 and used as Decimal in the app."""
+    python_type = Decimal
+    bson_type = Decimal128
+
+    def transform_python(self, value):
+        return Decimal128(value)
+
+    def transform_bson(self, value):
+        return value.to_decimal()
+
+
+type_registry = TypeRegistry([DecimalCodec()])
+
+
+def mongo_pool_size():
+    """Connections per MongoClient, pymongo's default unless configured."""
+    return int(os.getenv("INVENTORIUS_MONGO_POOL_SIZE", "100"))
+
+
+def _mongo_backend():
+    db_host = os.getenv("INVENTORIUS_MONGO_HOST", "localhost")
+    db_port = int(os.getenv("INVENTORIUS_MONGO_PORT", "27017"))
+    return MongoClient(db_host, db_port, type_registry=type_registry,
+                       maxPoolSize=mongo_pool_size())
+
+
+def _memory_backend():
+    # only loaded when selected, see inventorius.memory_db
+    from inventorius.memory_db import MemoryClient
+    return MemoryClient()
+
+
+# INVENTORIUS_STORAGE -> factory of the client behind `db`
+storage_backends = {
+    "mongo": _mongo_backend,
+    "memory": _memory_backend,
+}
+
+
+def storage_backend():
+    """The configured storage backend, mongo unless INVENTORIUS_STORAGE says otherwise."""
+    name = os.getenv("INVENTORIUS_STORAGE", "mongo")
+    if name not in storage_backends:
+        raise RuntimeError(f"unknown INVENTORIUS_STORAGE {name!r}, "
+                           f"expected one of {', '.join(storage_backends)}")
+    return name
+
+
+def database_name():
+    """The database behind `db`, inventoriusdb unless INVENTORIUS_DATABASE is set."""
+    return os.getenv("INVENTORIUS_DATABASE", "inventoriusdb")
+
+
 def get_mongo_client():
     global _mongo_client
     if _mongo_client is None:
-        db_host = os.getenv("INVENTORIUS_MONGO_HOST", "localhost")
-        db_port = int(os.getenv("INVENTORIUS_MONGO_PORT", "27017"))
-        _mongo_client = MongoClient(db_host, db_port)
-        _mongo_client.inventoriusdb.sku.create_index([("name", TEXT)])
-        _mongo_client.inventoriusdb.batch.create_index([("name", TEXT)])
-        _mongo_client.inventoriusdb.user.create_index([("name", TEXT)])
+        _mongo_client = storage_backends[storage_backend()]()
+        database = _mongo_client[database_name()]
+        database.sku.create_index([("name", TEXT)])
+        database.batch.create_index([("name", TEXT)])
+        database.user.create_index([("name", TEXT)])
+        database.user.create_index("shadow_id")
+        database.login_failures.create_index(
+            [("key", ASCENDING), ("at", ASCENDING)])
+        # failures only matter for LOGIN_FAILURE_WINDOW, a day is plenty
+        database.login_failures.create_index(
+            "at", expireAfterSeconds=24 * 60 * 60)
+        database.device_tokens.create_index("user_id")
+        # records are only needed to revoke tokens that have not expired yet
+        database.device_tokens.create_index(
+            "expires_at", expireAfterSeconds=0)
+        database.mixture_audit.create_index(
+            [("mix_id", ASCENDING), ("timestamp", ASCENDING)])
+        database.code_index.create_index(
+            [("code", ASCENDING), ("kind", ASCENDING), ("resource_id", ASCENDING)],
+            unique=True)
+        database.code_index.create_index("resource_id")
+        database.prefix_index.create_index(
+            [("prefixes", ASCENDING), ("_id", ASCENDING)])
+        database.jobs.create_index("created_at")
+        database.jobs.create_index("status")
+        # polled by in-memory search indexes, only recent changes are needed
+        try:
+            database.create_collection(
+                "search_changes", capped=True, size=8 * 1024 * 1024)
+        except CollectionInvalid:
+            pass  # already created
+        # read by stock summary rebuilds, which only need the changes made
+        # while they run
+        try:
+            database.create_collection(
+                "stock_changes", capped=True, size=8 * 1024 * 1024)
+        except CollectionInvalid:
+            pass  # already created
 
     return _mongo_client
 
 
 def get_db():
     if "db" not in g:
-        g.db = get_mongo_client().inventoriusdb
+        g.db = get_mongo_client()[database_name()]
     return g.db
 
 
 def get_gridfs_db():
     if "fs" not in g:
+        # gridfs is only needed by the file upload blueprint, import on first use
+        from gridfs import GridFS
         g.fs = GridFS(get_mongo_client().gridfsdb)
     return g.fs
 
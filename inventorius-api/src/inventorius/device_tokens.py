@@ -0,0 +1,216 @@
+"""
+    inventorius.device_tokens
+    ~~~~~~~~~~~~~~
+
+    Signed api tokens for scanner devices.
+
+    A logged in user issues tokens for their devices with
+    POST /api/user/<id>/tokens and the device sends
+
+        Authorization: Bearer <token>
+
+    instead of keeping a cookie session. A token is a base64 json payload
+    and its HMAC-SHA256 signature (keyed with DEVICE_TOKEN_SECRET, or the
+    app secret key):
+
+        {"sub": user id, "jti": token id, "roles": [...], "exp": unix time}
+
+    Checking a token needs no database access, only the set of revoked
+    token ids, which each worker keeps in memory and refreshes from the
+    device_tokens collection every DEVICE_TOKEN_REVOCATION_REFRESH seconds.
+    A token revoked through another worker can be accepted for that long.
+
+    Roles are scopes, "read" tokens can only make safe (GET, HEAD, OPTIONS)
+    requests, "write" tokens can also change things.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from flask import current_app, g, request
+from flask_principal import Identity, RoleNeed, identity_loaded
+
+from inventorius.data_models import UserData
+from inventorius.db import db
+import inventorius.util_error_responses as problem
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _key():
+    secret = current_app.config.get("DEVICE_TOKEN_SECRET") or current_app.secret_key
+    if not secret:
+        raise RuntimeError("device tokens need DEVICE_TOKEN_SECRET or a secret key")
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    # a separate key, so a token can never pass for a signed session cookie
+    return hmac.new(secret, b"inventorius.device_tokens", hashlib.sha256).digest()
+
+
+def sign_token(claims):
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    signature = hmac.new(_key(), payload.encode("ascii"), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature)}"
+
+
+def verify_token(token):
+    """The claims of a valid, unexpired and unrevoked token, otherwise None."""
+    payload, _, signature = token.partition(".")
+    try:
+        expected = hmac.new(_key(), payload.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), int):
+        return None
+    if claims["exp"] <= time.time():
+        return None
+    if revocations.is_revoked(claims.get("jti")):
+        return None
+    return claims
+
+
+class RevocationCache:
+    """Ids of revoked, not yet expired tokens, refreshed periodically."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._revoked = frozenset()
+            self._refreshed_at = None
+
+    def _refresh(self):
+        now = datetime.now(timezone.utc)
+        revoked = frozenset(doc["_id"] for doc in db.device_tokens.find(
+            {"revoked_at": {"$exists": True}, "expires_at": {"$gt": now}}, {"_id": 1}))
+        with self._lock:
+            self._revoked = revoked
+            self._refreshed_at = time.monotonic()
+
+    def is_revoked(self, jti):
+        interval = current_app.config["DEVICE_TOKEN_REVOCATION_REFRESH"]
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > interval:
+            self._refresh()
+        return jti in self._revoked
+
+    def add(self, jtis):
+        with self._lock:
+            self._revoked = self._revoked | frozenset(jtis)
+
+
+revocations = RevocationCache()
+
+
+def issue_token(user_id, roles, expires_in, name=None):
+    """Store a token record and return (record, token)."""
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=expires_in)
+    record = {
+        "_id": str(ObjectId()),
+        "user_id": user_id,
+        "name": name,
+        "roles": sorted(set(roles)),
+        "created_at": now,
+        "expires_at": expires_at,
+    }
+    db.device_tokens.insert_one(record)
+    token = sign_token({
+        "sub": user_id,
+        "jti": record["_id"],
+        "roles": record["roles"],
+        "exp": int(expires_at.timestamp()),
+    })
+    return record, token
+
+
+def revoke_tokens(filter):
+    """Revoke the tokens matching filter, returns how many were revoked."""
+    jtis = [doc["_id"] for doc in db.device_tokens.find(
+        {**filter, "revoked_at": {"$exists": False}}, {"_id": 1})]
+    if jtis:
+        db.device_tokens.update_many({"_id": {"$in": jtis}}, {
+            "$set": {"revoked_at": datetime.now(timezone.utc)}})
+        revocations.add(jtis)
+    return len(jtis)
+
+
+def token_state(record):
+    state = {
+        "id": record["_id"],
+        "user_id": record["user_id"],
+        "name": record.get("name"),
+        "roles": record["roles"],
+        "created_at": record["created_at"].isoformat(),
+        "expires_at": record["expires_at"].isoformat(),
+    }
+    if record.get("revoked_at") is not None:
+        state["revoked_at"] = record["revoked_at"].isoformat()
+    return state
+
+
+def token_user_data(claims):
+    """Partial UserData of a token's user, without a session (shadow_id) or
+    password fields."""
+    return UserData.from_partial_mongodb_doc(
+        {"_id": claims["sub"], "shadow_id": "", "active": True},
+        {"fixed_id", "shadow_id", "active"})
+
+
+class DeviceTokens:
+    """Flask extension authenticating requests with a bearer device token."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("DEVICE_TOKEN_SECRET", None)
+        app.config.setdefault("DEVICE_TOKEN_REVOCATION_REFRESH", 30)
+        app.config.setdefault("DEVICE_TOKEN_DEFAULT_LIFETIME", 90 * 24 * 60 * 60)
+        app.config.setdefault("DEVICE_TOKEN_MAX_LIFETIME", 365 * 24 * 60 * 60)
+        self.app = app
+        app.extensions["device_tokens"] = self
+        # after principals' own before_request, which sets the session identity
+        app.before_request(self._authenticate)
+
+    def _authenticate(self):
+        authorization = request.headers.get("Authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        claims = verify_token(token.strip())
+        if claims is None:
+            return problem.invalid_token_response()
+        if request.method not in SAFE_METHODS and "write" not in claims.get("roles", ()):
+            return problem.insufficient_scope_response("write")
+
+        g.device_token = claims
+        # like Principal.set_identity, without saving the identity in a session
+        identity = Identity(claims["sub"], auth_type="device-token")
+        for role in claims.get("roles", ()):
+            identity.provides.add(RoleNeed(role))
+        g.identity = identity
+        identity_loaded.send(current_app._get_current_object(), identity=identity)
+        return None
+
+
+device_tokens = DeviceTokens()
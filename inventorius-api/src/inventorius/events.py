@@ -0,0 +1,189 @@
+"""
+    inventorius.events
+    ~~~~~~~~~~~~~~
+
+    Internal event bus for keeping derived data up to date.
+
+    Write helpers publish an event describing what changed and return, the
+    subscribers (stock summary, code, prefix and search indexes) catch up in
+    a background thread:
+
+        event_bus.publish(BinContentsChanged("BIN000001", "SKU000001", 5))
+
+        @event_bus.subscriber(BinContentsChanged)
+        def update_summary(event): ...
+
+    Subscribers run in an app context and must be idempotent or tolerate
+    running late, they never see the request. Testing apps, and apps with
+    EVENT_BUS_SYNC set, run subscribers before publish returns. Events still
+    queued when a worker exits are handled before it does, for up to
+    EVENT_BUS_DRAIN_TIMEOUT seconds (uwsgi needs enable-threads, see
+    config/pkg_inventorius-api.ini).
+
+    With EVENT_BUS_CHANGE_STREAM set, writes to skus and batches made outside
+    the api (eg. from the mongo shell) are published as ResourceSaved and
+    ResourceDeleted events read from a change stream.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+
+from pymongo.errors import PyMongoError
+
+from inventorius.db import db
+
+log = logging.getLogger(__name__)
+
+_stop = object()
+
+
+class Event:
+    """Base class of published events, fields are set from the arguments
+    named in `fields`."""
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        values = dict(zip(self.fields, args), **kwargs)
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, field) == getattr(other, field) for field in self.fields)
+
+    def __repr__(self):
+        args = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.fields)
+        return f"{type(self).__name__}({args})"
+
+
+class BinContentsChanged(Event):
+    """`quantity` of item_id was added to (or taken out of) a bin."""
+    fields = ("bin_id", "item_id", "quantity", "sku_id")
+
+
+class BinDeleted(Event):
+    fields = ("bin_id", "contents")
+
+
+class ResourceSaved(Event):
+    """A sku or batch was created or updated."""
+    fields = ("resource_type", "id")
+
+
+class ResourceDeleted(Event):
+    fields = ("resource_type", "id")
+
+
+class EventBus:
+    """Flask extension dispatching events to subscribers."""
+
+    def __init__(self, app=None):
+        self._subscribers = defaultdict(list)
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENT_BUS_SYNC", False)
+        app.config.setdefault("EVENT_BUS_CHANGE_STREAM", False)
+        app.config.setdefault("EVENT_BUS_DRAIN_TIMEOUT", 30)
+        self.app = app
+        app.extensions["event_bus"] = self
+        if app.config["EVENT_BUS_CHANGE_STREAM"]:
+            threading.Thread(target=self._consume_change_stream,
+                             name="event-bus-change-stream", daemon=True).start()
+
+    def subscribe(self, event_type, handler):
+        self._subscribers[event_type].append(handler)
+
+    def subscriber(self, event_type):
+        """Decorator form of subscribe."""
+        def register(handler):
+            self.subscribe(event_type, handler)
+            return handler
+        return register
+
+    @property
+    def synchronous(self):
+        return self.app.testing or self.app.config["EVENT_BUS_SYNC"]
+
+    def publish(self, event):
+        if self.synchronous:
+            self._dispatch(event)
+            return
+        self._ensure_worker()
+        self._queue.put(event)
+
+    def join(self):
+        """Wait until every published event has been handled."""
+        self._queue.join()
+
+    def _dispatch(self, event):
+        for handler in self._subscribers[type(event)]:
+            try:
+                handler(event)
+            except Exception:
+                if self.synchronous:
+                    raise
+                log.exception("%s failed handling %r", handler.__name__, event)
+
+    def _ensure_worker(self):
+        # started on first use so forked workers each get their own thread
+        with self._worker_lock:
+            if self._pid != os.getpid():
+                # anything queued before the fork is the parent's to handle
+                self._queue = queue.Queue()
+                self._worker = None
+                self._pid = os.getpid()
+                atexit.register(self.drain)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._work, name="event-bus", daemon=True)
+                self._worker.start()
+
+    def drain(self):
+        """Handle the queued events and stop the worker thread."""
+        worker = self._worker
+        if self._pid != os.getpid() or worker is None or not worker.is_alive():
+            return
+        self._queue.put(_stop)
+        worker.join(self.app.config["EVENT_BUS_DRAIN_TIMEOUT"])
+        if worker.is_alive():
+            log.warning("event bus exiting with %d events unhandled", self._queue.qsize())
+
+    def _work(self):
+        with self.app.app_context():
+            while True:
+                event = self._queue.get()
+                try:
+                    if event is _stop:
+                        return
+                    self._dispatch(event)
+                finally:
+                    self._queue.task_done()
+
+    def _consume_change_stream(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": ["sku", "batch"]},
+                                "operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        with self.app.app_context():
+            try:
+                with db.watch(pipeline) as stream:
+                    for change in stream:
+                        resource_type = change["ns"]["coll"]
+                        id = change["documentKey"]["_id"]
+                        if change["operationType"] == "delete":
+                            self.publish(ResourceDeleted(resource_type, id))
+                        else:
+                            self.publish(ResourceSaved(resource_type, id))
+            except PyMongoError as e:
+                log.warning("event bus change stream stopped: %s", e)
+
+
+event_bus = EventBus()
@@ -0,0 +1,77 @@
+"""
+    inventorius.fanout
+    ~~~~~~~~~~~~~~
+
+    Run a request's independent queries in parallel.
+
+    A view hands named callables to query_fanout.run and gets their results
+    back in the order given, however they finish, with the time each took:
+
+        (skus, batches), timings = query_fanout.run([
+            ("sku_text", lambda: list(db.sku.find(...))),
+            ("batch_text", lambda: list(db.batch.find(...))),
+        ])
+
+    The callables run on a thread pool shared by the worker's requests, in
+    an app context using the same database as the request, so `db` and the
+    repositories work as usual. The pool has QUERY_FANOUT_WORKERS threads,
+    by default 8 or the mongo connection pool size if smaller, so the
+    threads do not queue for connections. With QUERY_FANOUT_WORKERS set to 0
+    the callables run one after another in the request thread.
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+from inventorius.db import get_db, mongo_pool_size
+
+
+class QueryFanout:
+    """Flask extension running independent queries on a thread pool."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("QUERY_FANOUT_WORKERS", min(8, mongo_pool_size()))
+        self.app = app
+        app.extensions["query_fanout"] = self
+
+    def _timed(self, database, function):
+        with self.app.app_context():
+            g.db = database
+            start = time.perf_counter()
+            result = function()
+            return result, time.perf_counter() - start
+
+    def run(self, queries):
+        """Results of the (name, callable) queries in order and a dict of
+        the milliseconds each took."""
+        database = get_db()
+        workers = self.app.config["QUERY_FANOUT_WORKERS"]
+        if workers and len(queries) > 1:
+            with self._executor_lock:
+                # created on first use, so each forked worker has its own pool
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(workers, thread_name_prefix="query")
+            # in a copy of the request's context, so profiling sees the queries
+            futures = [self._executor.submit(contextvars.copy_context().run,
+                                             self._timed, database, function)
+                       for _, function in queries]
+            outcomes = [future.result() for future in futures]
+        else:
+            outcomes = [self._timed(database, function) for _, function in queries]
+        results = [result for result, _ in outcomes]
+        timings = {name: round(seconds * 1000, 3)
+                   for (name, _), (_, seconds) in zip(queries, outcomes)}
+        return results, timings
+
+
+query_fanout = QueryFanout()
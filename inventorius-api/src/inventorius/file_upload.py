@@ -1,7 +1,6 @@
 from flask import Blueprint, request, Response, url_for
 from inventorius.db import db, fs
 import json
-from wand.image import Image
 
 file_upload = Blueprint("file_upload", __name__)
  
@@ -23,6 +22,9 @@ def images_post():
     }]})
     return resp
 
+  # wand loads ImageMagick when imported, defer it until an image is posted
+  from wand.image import Image
+
   image = request.files['image']
 
   Image(blob=image.stream).save(filename='test.png')
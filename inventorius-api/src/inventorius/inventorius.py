@@ -1,22 +1,32 @@
-from inventorius.util import getIntArgs, admin_get_next
+from inventorius.util import getIntArgs, admin_get_next, admin_recount_next
 from flask import Blueprint, request, Response, url_for
 from voluptuous.error import MultipleInvalid, Invalid
 from inventorius.data_models import (
     Bin,
     Sku,
     Batch,
-    DataModelJSONEncoder as Encoder,
     mixture_components_to_bson,
     quantity_to_bson,
 )
+from inventorius.async_db import async_database
+from inventorius.code_index import lookup_code
 from inventorius.db import db
+from inventorius.fanout import query_fanout
+from inventorius.jobs import job
+from inventorius.repository import (
+    async_batches, async_bins, async_mixtures, async_skus, batches, bins, mixtures, skus)
+from inventorius.stock import adjust_bin_contents
 from inventorius.validation import item_move_schema, item_release_receive_schema
 import inventorius.util_error_responses as problem
 import inventorius.util_success_responses as success
 from inventorius.util import no_cache
-from inventorius.mixture import apply_draw, build_audit_event, get_mixture
+from inventorius.mixture import apply_draw, build_audit_event, record_audit
+from inventorius.resource_models import negotiated_response, wants_operations
+from inventorius.search_index import search_index
+from inventorius.serialization import data_model_default
 
 import json
+import time
 
 inventorius = Blueprint("inventorius", __name__)
 
@@ -63,6 +73,43 @@ inventorius = Blueprint("inventorius", __name__)
 #     return Response(status=200)
 
 
+async def _no_lookup():
+    return None
+
+
+def _move_lookups(id, destination, item_id):
+    """(source bin with only item_id's contents, whether destination exists,
+    the item) where the item is whether a sku or batch exists, the mixture
+    with its bin_id or None for other ids. Independent, so gathered when
+    ASYNC_DB is set."""
+    if async_database.enabled:
+        if item_id.startswith("SKU"):
+            item = async_skus.exists(item_id)
+        elif item_id.startswith("BAT"):
+            item = async_batches.exists(item_id)
+        elif item_id.startswith("MIX"):
+            item = async_mixtures.load(item_id, fields=["bin_id"])
+        else:
+            item = _no_lookup()
+        return tuple(async_database.gather(
+            async_bins.load(id, fields=[f"contents.{item_id}"]),
+            async_bins.exists(destination),
+            item))
+
+    source_bin = bins.load(id, fields=[f"contents.{item_id}"])
+    if source_bin is None:
+        return None, False, None
+    destination_exists = bins.exists(destination)
+    item = None
+    if item_id.startswith("SKU"):
+        item = skus.exists(item_id)
+    elif item_id.startswith("BAT"):
+        item = batches.exists(item_id)
+    elif item_id.startswith("MIX"):
+        item = mixtures.load(item_id, fields=["bin_id"])
+    return source_bin, destination_exists, item
+
+
 @inventorius.route('/api/bin/<id>/contents/move', methods=['PUT'])
 @no_cache
 def move_bin_contents_put(id):
@@ -75,21 +122,22 @@ def move_bin_contents_put(id):
     destination = json['destination']
     quantity = json['quantity']
 
-    if not db.bin.find_one({"_id": id}):
+    source_bin, destination_exists, item = _move_lookups(id, destination, item_id)
+    if source_bin is None:
         return problem.missing_bin_response(id)
-    if not db.bin.find_one({"_id": destination}):
+    if not destination_exists:
         return problem.missing_bin_response(destination)
 
     mixture_doc = None
 
     if item_id.startswith("SKU"):
-        if not db.sku.find_one({"_id": item_id}):
+        if not item:
             return problem.missing_sku_response(item_id)
     elif item_id.startswith("BAT"):
-        if not db.batch.find_one({"_id": item_id}):
+        if not item:
             return problem.missing_batch_response(item_id)
     elif item_id.startswith("MIX"):
-        mixture_doc = get_mixture(item_id)
+        mixture_doc = item
         if mixture_doc is None:
             return problem.missing_mixture_response(item_id)
         if mixture_doc.bin_id != id:
@@ -101,8 +149,7 @@ def move_bin_contents_put(id):
             ])
             return problem.invalid_params_response(error)
 
-    availible_quantity = Bin.from_mongodb_doc(
-        db.bin.find_one({"_id": id})).contents.get(item_id, 0)
+    availible_quantity = source_bin.contents.get(item_id, 0)
     if availible_quantity < quantity:
         return problem.move_insufficient_quantity(
             name="quantity", availible=availible_quantity, requested=quantity)
@@ -117,12 +164,8 @@ def move_bin_contents_put(id):
             ])
             return problem.invalid_params_response(error)
 
-    db.bin.update_one({"_id": id},
-                      {"$inc": {f"contents.{item_id}": - quantity}})
-    db.bin.update_one({"_id": destination},
-                      {"$inc": {f"contents.{item_id}": quantity}})
-    db.bin.update_one({"_id": id, f"contents.{item_id}": 0},
-                      {"$unset": {f"contents.{item_id}": ""}})
+    adjust_bin_contents(id, item_id, -quantity)
+    adjust_bin_contents(destination, item_id, quantity)
 
     if mixture_doc:
         audit_event = build_audit_event(
@@ -136,12 +179,23 @@ def move_bin_contents_put(id):
         )
         db.mixture.update_one(
             {"_id": item_id},
-            {"$set": {"bin_id": destination}, "$push": {"audit": audit_event}},
+            {"$set": {"bin_id": destination}},
         )
+        record_audit(item_id, audit_event)
 
     return success.moved_response()
 
 
+@job("recount-next-codes")
+def recount_next_codes_job(job):
+    """Recompute the next unused sku, batch and bin codes from a full scan."""
+    next_codes = {}
+    for done, prefix in enumerate(("SKU", "BAT", "BIN"), start=1):
+        next_codes[prefix] = admin_recount_next(prefix)
+        job.progress(done / 3)
+    return next_codes
+
+
 @inventorius.route('/api/next/sku', methods=['GET'])
 def next_sku():
     resp = Response()
@@ -227,19 +281,21 @@ def bin_contents_post(bin_id):
     item_id = json["id"]
     quantity = json["quantity"]
 
-    if not db.bin.find_one({"_id": bin_id}):
+    existing_bin = bins.load(bin_id, fields=[f"contents.{item_id}"])
+    if existing_bin is None:
         return problem.missing_bin_response(bin_id)
 
     mixture_doc = None
 
     if item_id.startswith("SKU"):
-        if not db.sku.find_one({"_id": item_id}):
+        if not skus.exists(item_id):
             return problem.missing_sku_response(item_id)
     elif item_id.startswith("BAT"):
-        if not db.batch.find_one({"_id": item_id}):
+        if not batches.exists(item_id):
             return problem.missing_batch_response(item_id)
     elif item_id.startswith("MIX"):
-        mixture_doc = get_mixture(item_id)
+        mixture_doc = mixtures.load(
+            item_id, fields=["bin_id", "components", "qty_total"])
         if mixture_doc is None:
             return problem.missing_mixture_response(item_id)
         if mixture_doc.bin_id != bin_id:
@@ -251,8 +307,7 @@ def bin_contents_post(bin_id):
             ])
             return problem.invalid_params_response(error)
 
-    old_quantity = db.bin.find_one(
-        {"_id": bin_id}, {f"contents.{item_id}": 1})["contents"].get(item_id, 0)
+    old_quantity = existing_bin.contents.get(item_id, 0)
     if quantity + old_quantity < 0:
         return problem.release_insufficient_quantity()
 
@@ -284,102 +339,133 @@ def bin_contents_post(bin_id):
                         ),
                         "qty_total": quantity_to_bson(updated_mixture.qty_total),
                     },
-                    "$push": {"audit": event},
                 },
             )
+            record_audit(item_id, event)
 
-    db.bin.update_one({"_id": bin_id},
-                        {"$inc": {f"contents.{item_id}": quantity}})
-
-    db.bin.update_one({"_id": bin_id, f"contents.{item_id}": 0},
-                        {"$unset": {f"contents.{item_id}": ""}})
+    adjust_bin_contents(bin_id, item_id, quantity)
     return success.bin_contents_post_response(quantity)
 
 
 
-@inventorius.route('/api/search', methods=['GET'])
-def search():
-    query = request.args['query']
-    limit = getIntArgs(request.args, "limit", 20)
-    startingFrom = getIntArgs(request.args, "startingFrom", 0)
-    resp = Response()
-
+def _search_memory(query):
+    """Like _search_database, with skus and batches from the in-memory
+    search index. Name matches differ: $text stems words (resistors finds
+    resistor) and orders by its own rules, text_matches only finds whole
+    casefolded words, skus before batches."""
     results = []
 
     # debug flags
-    if query == '!ALL':
-        results.extend([Sku.from_mongodb_doc(e) for e in db.sku.find()])
-        results.extend([Batch.from_mongodb_doc(e) for e in db.batch.find()])
-        results.extend([Bin.from_mongodb_doc(e) for e in db.bin.find()])
-    if query == '!BINS':
+    if query in ('!ALL', '!SKUS'):
+        results.extend(search_index.all("sku"))
+    if query in ('!ALL', '!BATCHES'):
+        results.extend(search_index.all("batch"))
+    if query in ('!ALL', '!BINS'):
         results.extend([Bin.from_mongodb_doc(e) for e in db.bin.find()])
-    if query == '!SKUS':
-        results.extend([Sku.from_mongodb_doc(e) for e in db.sku.find()])
-    if query == '!BATCHES':
-        results.extend([Batch.from_mongodb_doc(e) for e in db.batch.find()])
 
     # search by label
-    if query.startswith('SKU'):
-        results.append(Sku.from_mongodb_doc(db.sku.find_one({'_id': query})))
+    if query.startswith('SKU') or query.startswith('BAT'):
+        results.append(search_index.get(query))
     if query.startswith('BIN'):
-        results.append(Bin.from_mongodb_doc(db.bin.find_one({'_id': query})))
-    if query.startswith('BAT'):
-        results.append(Batch.from_mongodb_doc(
-            db.batch.find_one({'_id': query})))
+        results.append(bins.load(query))
     results = [result for result in results if result != None]
 
-    # search for skus with owned_codes
-    cursor = db.sku.find({"owned_codes": query})
-    for sku_doc in cursor:
-        results.append(Sku.from_mongodb_doc(sku_doc))
-
-    # search for skus with associated codes
-    cursor = db.sku.find({"associated_codes": query})
-    for sku_doc in cursor:
-        results.append(Sku.from_mongodb_doc(sku_doc))
-
-    # search for skus with owned_codes
-    cursor = db.batch.find({"owned_codes": query})
-    for batch_doc in cursor:
-        results.append(Batch.from_mongodb_doc(batch_doc))
-
-    # search for batchs with associated codes
-    cursor = db.batch.find({"associated_codes": query})
-    for batch_doc in cursor:
-        results.append(Batch.from_mongodb_doc(batch_doc))
-
-    # if not DEV_ENV: # maybe use global flag + env variable instead. Shouldn't need to check this every time in production/
-    if "name_text" in db.sku.index_information().keys():
-        cursor = db.sku.find({"$text": {"$search": query}})
-        for sku_doc in cursor:
-            results.append(Sku.from_mongodb_doc(sku_doc))
-    if "name_text" in db.batch.index_information().keys():
-        cursor = db.batch.find({"$text": {"$search": query}})
-        for batch_doc in cursor:
-            results.append(Batch.from_mongodb_doc(batch_doc))
-
-    if results != []:
-        paged = results[startingFrom:(startingFrom + limit)]
-        resp.status_code = 200
-        resp.mimetype = "application/json"
-        # TODO: Add next page / prev page operations
-        resp.data = json.dumps({'state': {
-            "total_num_results": len(results),
-            "starting_from": startingFrom,
-            "limit": limit,
-            "returned_num_results": len(paged),
-            "results": paged
-        },
-            "operations": []}, cls=Encoder)
-        return resp
-
-    resp.status_code = 200
-    resp.mimetype = "application/json"
-    resp.data = json.dumps({'state': {
+    results.extend(search_index.code_matches(query))
+    results.extend(search_index.text_matches(query))
+    return results
+
+
+def _find_all(model_type, collection_name):
+    return lambda: [model_type.from_mongodb_doc(e) for e in db[collection_name].find()]
+
+
+def _find_by_label(query):
+    repository = {"SKU": skus, "BIN": bins, "BAT": batches}[query[:3]]
+    return [result for result in [repository.load(query)] if result != None]
+
+
+def _find_by_code(query):
+    """Skus and batches with an owned, associated or structured code, in
+    one index lookup."""
+    entries = lookup_code(query)
+    repositories = {"sku": skus, "batch": batches}
+    found = {}
+    for resource_type, repository in repositories.items():
+        ids = [entry["resource_id"] for entry in entries if entry["type"] == resource_type]
+        if ids:
+            found.update((model.id, model) for model in
+                         repository.find({"_id": {"$in": ids}}))
+    return [found[entry["resource_id"]] for entry in entries
+            if entry["resource_id"] in found]
+
+
+def _find_by_text(model_type, collection_name, query):
+    def find():
+        collection = db[collection_name]
+        # if not DEV_ENV: # maybe use global flag + env variable instead. Shouldn't need to check this every time in production/
+        if "name_text" not in collection.index_information().keys():
+            return []
+        return [model_type.from_mongodb_doc(doc)
+                for doc in collection.find({"$text": {"$search": query}})]
+    return find
+
+
+def _search_database(query):
+    """Results and the milliseconds each sub-query took. The sub-queries
+    are independent and run in parallel (see inventorius.fanout), results
+    are merged in the order they are listed."""
+    queries = []
+
+    # debug flags
+    if query in ('!ALL', '!SKUS'):
+        queries.append(("all_skus", _find_all(Sku, "sku")))
+    if query in ('!ALL', '!BATCHES'):
+        queries.append(("all_batches", _find_all(Batch, "batch")))
+    if query in ('!ALL', '!BINS'):
+        queries.append(("all_bins", _find_all(Bin, "bin")))
+
+    # search by label
+    if query[:3] in ("SKU", "BIN", "BAT"):
+        queries.append(("label", lambda: _find_by_label(query)))
+
+    queries.append(("codes", lambda: _find_by_code(query)))
+    queries.append(("sku_text", _find_by_text(Sku, "sku", query)))
+    queries.append(("batch_text", _find_by_text(Batch, "batch", query)))
+
+    results, timings = query_fanout.run(queries)
+    return [result for found in results for result in found], timings
+
+
+@inventorius.route('/api/search', methods=['GET'])
+def search():
+    query = request.args['query']
+    limit = getIntArgs(request.args, "limit", 20)
+    startingFrom = getIntArgs(request.args, "startingFrom", 0)
+
+    start = time.perf_counter()
+    if search_index.ready:
+        source = "memory"
+        results, timings = _search_memory(query), {}
+    else:
+        source = "database"
+        results, timings = _search_database(query)
+    total = time.perf_counter() - start
+
+    paged = results[startingFrom:(startingFrom + limit)]
+    data = {'state': {
         "total_num_results": len(results),
         "starting_from": startingFrom,
         "limit": limit,
-        "returned_num_results": 0,
-        "results": []
-    }, "operations": []}, cls=Encoder)
-    return resp
+        "returned_num_results": len(paged),
+        "results": [result.to_json_dict() for result in paged]
+    }}
+    if request.args.get("debug") == "true":
+        data["debug"] = {
+            "source": source,
+            "total_ms": round(total * 1000, 3),
+            "queries_ms": timings,
+        }
+    # TODO: Add next page / prev page operations
+    if wants_operations():
+        data["operations"] = []
+    return negotiated_response(data, default=data_model_default)
@@ -0,0 +1,276 @@
+"""
+    inventorius.jobs
+    ~~~~~~~~~~~~~~
+
+    Background jobs for operations too slow for a request.
+
+    Blueprints register job kinds with the `job` decorator. The function gets
+    the running Job and the job params, reports progress and returns a json
+    serializable result:
+
+        @job("rebuild-stock-summary")
+        def rebuild_stock_summary_job(job):
+            job.progress(0.5)
+            return {"entries": 12}
+
+    POST /api/jobs {"kind": ..., "params": {...}} enqueues a job and answers
+    202 with its url, GET /api/job/<id> reports status (queued, running,
+    succeeded or failed), progress, result and error. Job documents live in
+    the jobs collection and run on a thread pool of JOBS_WORKERS threads in
+    the worker that enqueued them, so nothing but mongo is needed. Testing
+    apps, and apps with JOBS_SYNC set, run a job before enqueue returns.
+
+    A running job holds a lease of JOBS_LEASE seconds, renewed by its worker.
+    Every JOBS_POLL_INTERVAL seconds (and when it starts) each worker also
+    picks up queued jobs, and jobs whose lease ran out because their worker
+    died, until a job has been tried JOBS_MAX_ATTEMPTS times.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, request, url_for
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from voluptuous import Schema
+from voluptuous.error import Invalid, MultipleInvalid
+
+from inventorius.db import db
+from inventorius.resource_models import HypermediaEndpoint
+from inventorius.util import no_cache
+import inventorius.util_error_responses as problem
+from inventorius.validation import new_job_schema
+
+log = logging.getLogger(__name__)
+
+jobs = Blueprint("jobs", __name__)
+
+_job_kinds = {}
+
+
+def job(kind, params_schema=None):
+    """Register a function as the job of `kind`, params posted for it are
+    validated with params_schema (by default no params are allowed)."""
+    def register(function):
+        _job_kinds[kind] = (function, params_schema or Schema({}))
+        return function
+    return register
+
+
+def validate_job(json):
+    """Validate a job request, raises MultipleInvalid."""
+    json = new_job_schema(json)
+    if json["kind"] not in _job_kinds:
+        raise MultipleInvalid([Invalid(
+            f"must be one of {', '.join(sorted(_job_kinds))}", path=["kind"])])
+    _, params_schema = _job_kinds[json["kind"]]
+    try:
+        json["params"] = params_schema(json["params"])
+    except MultipleInvalid as e:
+        for error in e.errors:
+            error.path[:0] = ["params"]
+        raise
+    return json
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class Job:
+    """Handle a job function uses to report on itself."""
+
+    def __init__(self, id, kind, params):
+        self.id = id
+        self.kind = kind
+        self.params = params
+
+    def progress(self, fraction):
+        db.jobs.update_one({"_id": self.id},
+                           {"$set": {"progress": max(0.0, min(1.0, fraction))}})
+
+
+class JobRunner:
+    """Flask extension running jobs on a thread pool."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pid = None
+        # ids submitted to this process's pool and not finished yet
+        self._pending = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JOBS_WORKERS", 2)
+        app.config.setdefault("JOBS_SYNC", False)
+        app.config.setdefault("JOBS_LEASE", 120)
+        app.config.setdefault("JOBS_POLL_INTERVAL", 30)
+        app.config.setdefault("JOBS_MAX_ATTEMPTS", 3)
+        self.app = app
+        app.extensions["job_runner"] = self
+        app.before_request(self._ensure_started)
+
+    @property
+    def synchronous(self):
+        return self.app.testing or self.app.config["JOBS_SYNC"]
+
+    def _ensure_started(self):
+        # the pool and poller belong to one process, forked workers start their own
+        if self.synchronous or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    self.app.config["JOBS_WORKERS"], thread_name_prefix="job")
+                self._pending = set()
+                threading.Thread(target=self._poll, name="job-poller", daemon=True).start()
+                self._pid = os.getpid()
+
+    def enqueue(self, kind, params=None):
+        """Store a queued job and start it, returns the job id."""
+        if kind not in _job_kinds:
+            raise KeyError(kind)
+        id = ObjectId()
+        db.jobs.insert_one({
+            "_id": id,
+            "kind": kind,
+            "params": params or {},
+            "status": "queued",
+            "progress": 0.0,
+            "created_at": _now(),
+        })
+        self._start(id)
+        return str(id)
+
+    def _start(self, id):
+        if self.synchronous:
+            self._run(id)
+            return
+        self._ensure_started()
+        if id not in self._pending:
+            self._pending.add(id)
+            self._executor.submit(self._run_in_app_context, id)
+
+    def recover(self):
+        """Renew the leases of the jobs running here, then start queued jobs
+        and the jobs whose lease ran out."""
+        now = _now()
+        pending = list(self._pending)
+        if pending:
+            db.jobs.update_many(
+                {"_id": {"$in": pending}, "status": "running"},
+                {"$set": {"lease_until": now + timedelta(seconds=self.app.config["JOBS_LEASE"])}})
+        db.jobs.update_many(
+            {"status": "running", "$or": [{"lease_until": {"$lt": now}},
+                                          {"lease_until": {"$exists": False}}]},
+            {"$set": {"status": "queued"}})
+        for doc in db.jobs.find({"status": "queued"}, {"_id": 1}).sort("_id", 1):
+            self._start(doc["_id"])
+
+    def _poll(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    self.recover()
+                except PyMongoError:
+                    log.exception("could not recover jobs")
+                time.sleep(self.app.config["JOBS_POLL_INTERVAL"])
+
+    def _run_in_app_context(self, id):
+        try:
+            with self.app.app_context():
+                self._run(id)
+        finally:
+            self._pending.discard(id)
+
+    def _run(self, id):
+        # claiming the job makes running it twice harmless
+        now = _now()
+        doc = db.jobs.find_one_and_update(
+            {"_id": id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": now,
+                      "lease_until": now + timedelta(seconds=self.app.config["JOBS_LEASE"])},
+             "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER)
+        if doc is None:
+            return
+        # a run whose lease ran out must not overwrite the outcome of a retry
+        claimed = {"_id": id, "status": "running", "attempts": doc["attempts"]}
+        if doc["attempts"] > self.app.config["JOBS_MAX_ATTEMPTS"]:
+            db.jobs.update_one(claimed, {"$set": {
+                "status": "failed", "error": f"gave up after {doc['attempts'] - 1} attempts",
+                "finished_at": _now()}})
+            return
+        handle = Job(id, doc["kind"], doc["params"])
+        try:
+            function, _ = _job_kinds[doc["kind"]]
+            result = function(handle, **doc["params"])
+        except Exception as e:
+            log.exception("job %s (%s) failed", id, doc["kind"])
+            db.jobs.update_one(claimed, {"$set": {
+                "status": "failed", "error": str(e), "finished_at": _now()}})
+        else:
+            db.jobs.update_one(claimed, {"$set": {
+                "status": "succeeded", "progress": 1.0, "result": result,
+                "finished_at": _now()}})
+
+
+job_runner = JobRunner()
+
+
+def job_state(doc):
+    state = {
+        "id": str(doc["_id"]),
+        "kind": doc["kind"],
+        "params": doc["params"],
+        "status": doc["status"],
+        "progress": doc.get("progress", 0.0),
+    }
+    for key in ("created_at", "started_at", "finished_at"):
+        if doc.get(key) is not None:
+            state[key] = doc[key].isoformat()
+    if "result" in doc:
+        state["result"] = doc["result"]
+    if "error" in doc:
+        state["error"] = doc["error"]
+    return state
+
+
+def accepted_response(job_id):
+    """202 pointing to a newly enqueued job."""
+    resource_uri = url_for("jobs.job_get", id=job_id)
+    resp = HypermediaEndpoint(resource_uri, {"id": job_id, "status": "queued"}).get_response(202)
+    resp.headers["Location"] = resource_uri
+    return resp
+
+
+@jobs.route("/api/jobs", methods=["POST"])
+@no_cache
+def jobs_post():
+    try:
+        json = validate_job(request.json)
+    except MultipleInvalid as e:
+        return problem.invalid_params_response(e)
+
+    job_id = job_runner.enqueue(json["kind"], json["params"])
+    return accepted_response(job_id)
+
+
+@jobs.route("/api/job/<id>", methods=["GET"])
+@no_cache
+def job_get(id):
+    try:
+        doc = db.jobs.find_one({"_id": ObjectId(id)})
+    except InvalidId:
+        doc = None
+    if doc is None:
+        return problem.missing_resource_response(url_for("jobs.job_get", id=id))
+    return HypermediaEndpoint(url_for("jobs.job_get", id=id), job_state(doc)).get_response()
@@ -0,0 +1,1250 @@
+"""
+    inventorius.memory_db
+    ~~~~~~~~~~~~~~
+
+    An in-process stand-in for MongoClient, for tests and benchmarks that
+    should not need a mongod:
+
+        INVENTORIUS_STORAGE=memory python -m pytest -n auto
+        INVENTORIUS_STORAGE=memory python -m benchmarks --scale 1k
+
+    db.get_mongo_client then returns a MemoryClient, everything behind the
+    `db` proxy keeps using the pymongo collection api. Each process holds
+    its own data, so pytest-xdist workers do not share the testing database.
+
+    Only what inventorius sends to mongo is implemented:
+
+        queries     equality, $eq $ne $gt $gte $lt $lte $in $nin $exists
+                    $regex $not $elemMatch $size $and $or $nor, and $text
+                    (whole words, without stemming) on text indexed fields
+        updates     $set $unset $inc $push $pull $addToSet $setOnInsert,
+                    upserts and replacements
+        pipelines   $match $project $addFields $unwind $group $lookup $sort
+                    $skip $limit $count
+        indexes     unique indexes are enforced, others are only listed
+
+    Values round trip as they would through bson: Decimal128 comes back as
+    Decimal (like db.DecimalCodec), datetimes as naive UTC with millisecond
+    precision. Anything else raises NotImplementedError. Change streams raise
+    OperationFailure like a standalone mongod does, so watchers fall back to
+    polling. TTL and capped collections do not expire anything and GridFS
+    (file uploads) needs a real mongo.
+"""
+
+import copy
+import functools
+import re
+import threading
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from bson import ObjectId
+from bson.binary import Binary
+from bson.decimal128 import Decimal128
+from bson.errors import InvalidDocument
+from bson.int64 import Int64
+from bson.regex import Regex
+from pymongo import ReturnDocument
+from pymongo.errors import (
+    BulkWriteError,
+    CollectionInvalid,
+    DuplicateKeyError,
+    InvalidOperation,
+    OperationFailure,
+    WriteError,
+)
+from pymongo.operations import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    ReplaceOne,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+_scalar_types = (str, int, float, bool, type(None), Decimal, ObjectId, bytes,
+                 Binary, Int64, uuid.UUID, re.Pattern, Regex)
+
+
+def _unsupported(what):
+    return NotImplementedError(f"{what} is not supported by the in-memory storage")
+
+
+# -------- bson round trip
+
+
+def _to_bson(value):
+    """A copy of value as mongo would store it."""
+    if isinstance(value, dict):
+        for key in value:
+            if not isinstance(key, str):
+                raise InvalidDocument(f"documents must have only string keys, key was {key!r}")
+        return {key: _to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_bson(item) for item in value]
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, _scalar_types):
+        return value
+    raise InvalidDocument(f"cannot encode object: {value!r}, of type: {type(value)!r}")
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+# -------- comparison, in mongo's order of types
+
+
+def _type_rank(value):
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float, Decimal)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, (bytes, Binary, uuid.UUID)):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _compare(a, b):
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return -1 if rank_a < rank_b else 1
+    if isinstance(a, dict):
+        return _compare_sequences(list(a.items()), list(b.items()))
+    if isinstance(a, list):
+        return _compare_sequences(a, b)
+    if rank_a == 1:
+        return 0
+    if rank_a == 10:
+        return 0 if a == b else -1
+    return (a > b) - (a < b)
+
+
+def _compare_sequences(a, b):
+    for item_a, item_b in zip(a, b):
+        if isinstance(item_a, tuple):  # dict items, compare keys then values
+            result = (item_a[0] > item_b[0]) - (item_a[0] < item_b[0]) \
+                or _compare(item_a[1], item_b[1])
+        else:
+            result = _compare(item_a, item_b)
+        if result:
+            return result
+    return (len(a) > len(b)) - (len(a) < len(b))
+
+
+def _equal(a, b):
+    if type(a) is type(b) and isinstance(a, (str, int, ObjectId)):
+        return a == b
+    return _type_rank(a) == _type_rank(b) and _compare(a, b) == 0
+
+
+def _add(a, b):
+    if isinstance(a, Decimal) or isinstance(b, Decimal):
+        return Decimal(str(a)) + Decimal(str(b))
+    return a + b
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+# -------- paths
+
+
+def _resolve(value, parts):
+    """Values at a dotted path for queries, arrays on the way are searched
+    element wise."""
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return _resolve(value[head], rest) if head in value else []
+    if isinstance(value, list):
+        if head.isdigit():
+            index = int(head)
+            return _resolve(value[index], rest) if index < len(value) else []
+        found = []
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(_resolve(item, parts))
+        return found
+    return []
+
+
+def _get(doc, path, default=None):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+
+_missing = object()
+
+
+def _parent(doc, path, create):
+    """The container holding the last part of path, and that part."""
+    parts = path.split(".")
+    container = doc
+    for part in parts[:-1]:
+        if isinstance(container, list) and part.isdigit():
+            index = int(part)
+            if index >= len(container):
+                return None, parts[-1]
+            container = container[index]
+            continue
+        if not isinstance(container, dict):
+            raise WriteError(f"Cannot create field '{part}' in element {container!r}")
+        if part not in container:
+            if not create:
+                return None, parts[-1]
+            container[part] = {}
+        container = container[part]
+    return container, parts[-1]
+
+
+def _set_path(doc, path, value):
+    container, last = _parent(doc, path, create=True)
+    if isinstance(container, list) and last.isdigit():
+        index = int(last)
+        container.extend([None] * (index + 1 - len(container)))
+        container[index] = value
+    elif isinstance(container, dict):
+        container[last] = value
+    else:
+        raise WriteError(f"Cannot create field '{last}' in element {container!r}")
+
+
+def _unset_path(doc, path):
+    container, last = _parent(doc, path, create=False)
+    if isinstance(container, dict):
+        container.pop(last, None)
+    elif isinstance(container, list) and last.isdigit() and int(last) < len(container):
+        container[int(last)] = None
+
+
+# -------- queries
+
+
+def _candidates(doc, path):
+    found = _resolve(doc, path.split("."))
+    candidates = []
+    for value in found:
+        candidates.append(value)
+        if isinstance(value, list):
+            candidates.extend(value)
+    return found, candidates
+
+
+def _regex(pattern, options=""):
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option in options:
+        flags |= {"i": re.I, "m": re.M, "s": re.S, "x": re.X}.get(option, 0)
+    return re.compile(pattern, flags)
+
+
+def _operator_matches(operator, argument, found, candidates, condition):
+    if operator == "$eq":
+        return any(_equal(value, argument) for value in candidates) \
+            or (argument is None and not found)
+    if operator == "$ne":
+        return not _operator_matches("$eq", argument, found, candidates, condition)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        wanted = {"$gt": (1,), "$gte": (0, 1), "$lt": (-1,), "$lte": (-1, 0)}[operator]
+        return any(_type_rank(value) == _type_rank(argument)
+                   and _compare(value, argument) in wanted for value in candidates)
+    if operator == "$in":
+        return any(_operator_matches("$eq", item, found, candidates, condition)
+                   if not isinstance(item, (re.Pattern, Regex))
+                   else _operator_matches("$regex", item, found, candidates, condition)
+                   for item in argument)
+    if operator == "$nin":
+        return not _operator_matches("$in", argument, found, candidates, condition)
+    if operator == "$exists":
+        return bool(found) == bool(argument)
+    if operator == "$regex":
+        pattern = _regex(argument, condition.get("$options", ""))
+        return any(isinstance(value, str) and pattern.search(value) for value in candidates)
+    if operator == "$options":
+        return True
+    if operator == "$not":
+        if isinstance(argument, (re.Pattern, Regex)):
+            return not _operator_matches("$regex", argument, found, candidates, {})
+        return not all(_operator_matches(op, arg, found, candidates, argument)
+                       for op, arg in argument.items())
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == argument for value in found)
+    if operator == "$elemMatch":
+        operators = all(key.startswith("$") for key in argument)
+        for value in found:
+            for item in value if isinstance(value, list) else ():
+                if operators:
+                    if all(_operator_matches(op, arg, [item], [item], argument)
+                           for op, arg in argument.items()):
+                        return True
+                elif isinstance(item, dict) and matches(item, argument):
+                    return True
+        return False
+    raise _unsupported(f"query operator {operator}")
+
+
+def _field_matches(doc, path, condition):
+    found, candidates = _candidates(doc, path)
+    if isinstance(condition, dict) and condition \
+            and all(key.startswith("$") for key in condition):
+        return all(_operator_matches(operator, argument, found, candidates, condition)
+                   for operator, argument in condition.items())
+    if isinstance(condition, (re.Pattern, Regex)):
+        return _operator_matches("$regex", condition, found, candidates, {})
+    return _operator_matches("$eq", condition, found, candidates, {})
+
+
+_word = re.compile(r"\w+")
+
+
+def _words(text):
+    return set(_word.findall(text.lower())) if isinstance(text, str) else set()
+
+
+def matches(doc, filter, text_fields=()):
+    """Whether doc matches a query filter."""
+    for key, condition in (filter or {}).items():
+        if key == "$and":
+            if not all(matches(doc, part, text_fields) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, part, text_fields) for part in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, part, text_fields) for part in condition):
+                return False
+        elif key == "$text":
+            if not text_fields:
+                raise OperationFailure("text index required for $text query", 27)
+            wanted = _words(condition["$search"])
+            present = set()
+            for field in text_fields:
+                for value in _candidates(doc, field)[1]:
+                    present |= _words(value)
+            if not wanted & present:
+                return False
+        elif key.startswith("$"):
+            raise _unsupported(f"query operator {key}")
+        elif not _field_matches(doc, key, condition):
+            return False
+    return True
+
+
+# -------- projections and sorting
+
+
+def _include(source, target, parts):
+    """Copy the value at a path of source into target."""
+    head, rest = parts[0], parts[1:]
+    if head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = _copy(value)
+    elif isinstance(value, dict):
+        _include(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        # a path into an array of documents projects each document
+        projected = []
+        for item in value:
+            if isinstance(item, dict):
+                projected.append({})
+                _include(item, projected[-1], rest)
+        target[head] = projected
+
+
+def project(doc, projection):
+    if not projection:
+        return _copy(doc)
+    if not isinstance(projection, dict):
+        projection = dict.fromkeys(projection, 1)
+    include_id = bool(projection.get("_id", 1))
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if any(fields.values()):
+        result = {"_id": _copy(doc["_id"])} if include_id and "_id" in doc else {}
+        for path, wanted in fields.items():
+            if wanted:
+                _include(doc, result, path.split("."))
+        return result
+    result = _copy(doc)
+    for path in fields:
+        _unset_path(result, path)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _sort_spec(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def sort_documents(docs, spec):
+    def compare(a, b):
+        for path, direction in spec:
+            result = _compare(_get(a, path), _get(b, path))
+            if result:
+                return result if direction >= 0 else -result
+        return 0
+    return sorted(docs, key=functools.cmp_to_key(compare))
+
+
+# -------- updates
+
+
+def _updated_value(operator, current, argument):
+    if operator == "$inc":
+        if current is _missing:
+            return argument
+        if not _is_number(current):
+            raise WriteError(f"Cannot apply $inc to a value of non-numeric type {type(current).__name__}")
+        return _add(current, argument)
+    if operator in ("$max", "$min"):
+        if current is _missing:
+            return argument
+        order = _compare(argument, current)
+        return argument if (order > 0 if operator == "$max" else order < 0) else current
+    if operator in ("$push", "$addToSet"):
+        items = argument["$each"] if isinstance(argument, dict) and "$each" in argument \
+            else [argument]
+        if current is _missing:
+            current = []
+        if not isinstance(current, list):
+            raise WriteError(f"The field must be an array for {operator}")
+        current = list(current)
+        for item in items:
+            if operator == "$push" or not any(_equal(item, value) for value in current):
+                current.append(item)
+        return current
+    if operator == "$pull":
+        if not isinstance(current, list):
+            return current
+        if isinstance(argument, dict) and all(key.startswith("$") for key in argument):
+            return [item for item in current
+                    if not _field_matches({"v": item}, "v", argument)]
+        if isinstance(argument, dict):
+            return [item for item in current
+                    if not (isinstance(item, dict) and matches(item, argument))]
+        return [item for item in current if not _equal(item, argument)]
+    raise _unsupported(f"update operator {operator}")
+
+
+def apply_update(doc, update, inserting=False):
+    """Apply an update document (or replacement) to doc, in place."""
+    if not any(key.startswith("$") for key in update):
+        _id = doc.get("_id")
+        doc.clear()
+        if _id is not None:
+            doc["_id"] = _id
+        doc.update(_to_bson(update))
+        return
+    for operator, fields in update.items():
+        fields = _to_bson(fields)
+        for path, argument in fields.items():
+            if path == "_id" and operator != "$setOnInsert" and not inserting:
+                if _equal(doc.get("_id"), argument):
+                    continue
+                raise WriteError("Performing an update on the path '_id' would modify the immutable field '_id'", 66)
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                _set_path(doc, path, argument)
+            elif operator == "$setOnInsert":
+                continue
+            elif operator == "$unset":
+                _unset_path(doc, path)
+            else:
+                container, last = _parent(doc, path, create=False)
+                current = _missing
+                if isinstance(container, dict):
+                    current = container.get(last, _missing)
+                elif isinstance(container, list) and last.isdigit() and int(last) < len(container):
+                    current = container[int(last)]
+                value = _updated_value(operator, current, argument)
+                if value is not _missing:
+                    _set_path(doc, path, value)
+
+
+def _upsert_document(filter, update):
+    doc = {}
+    for key, condition in (filter or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            if "$eq" in condition:
+                _set_path(doc, key, _to_bson(condition["$eq"]))
+            continue
+        _set_path(doc, key, _to_bson(condition))
+    apply_update(doc, update, inserting=True)
+    if "_id" not in doc:
+        doc["_id"] = ObjectId()
+    return doc
+
+
+# -------- aggregation expressions
+
+
+def _field_values(value, parts):
+    if not parts:
+        return value
+    if isinstance(value, dict):
+        return _field_values(value[parts[0]], parts[1:]) if parts[0] in value else _missing
+    if isinstance(value, list):
+        values = []
+        for item in value:
+            if isinstance(item, dict):
+                found = _field_values(item, parts)
+                if found is not _missing:
+                    values.append(found)
+        return values
+    return _missing
+
+
+def _sum(values):
+    total = 0
+    for value in values:
+        if _is_number(value):
+            total = _add(total, value)
+    return total
+
+
+def evaluate(expression, doc):
+    """The value of an aggregation expression for doc, _missing if it
+    names a missing field."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression.startswith("$$"):
+            raise _unsupported(f"variable {expression}")
+        return _field_values(doc, expression[1:].split("."))
+    if isinstance(expression, list):
+        return [_value(evaluate(item, doc)) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    operators = [key for key in expression if key.startswith("$")]
+    if not operators:
+        return {key: _value(evaluate(item, doc)) for key, item in expression.items()}
+    if len(expression) != 1:
+        raise OperationFailure(f"an expression specification must contain exactly one field, found {list(expression)}")
+    operator, argument = operators[0], expression[operators[0]]
+    if operator == "$literal":
+        return argument
+    args = argument if isinstance(argument, list) else [argument]
+    values = [evaluate(arg, doc) for arg in args]
+    if operator == "$ifNull":
+        for value in values:
+            if value is not _missing and value is not None:
+                return value
+        return None
+    values = [_value(value) for value in values]
+    if operator == "$objectToArray":
+        value = values[0]
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            raise OperationFailure(f"$objectToArray requires a document input, found: {type(value).__name__}")
+        return [{"k": key, "v": item} for key, item in value.items()]
+    if operator == "$size":
+        if not isinstance(values[0], list):
+            raise OperationFailure("The argument to $size must be an array")
+        return len(values[0])
+    if operator == "$sum":
+        if len(values) == 1 and isinstance(values[0], list):
+            return _sum(values[0])
+        return _sum(values)
+    if operator == "$arrayElemAt":
+        array, index = values
+        if array is None:
+            return None
+        if -len(array) <= index < len(array):
+            return array[index]
+        return _missing
+    raise _unsupported(f"expression operator {operator}")
+
+
+def _value(value):
+    return None if value is _missing else value
+
+
+# -------- aggregation stages
+
+
+class _Accumulator:
+
+    def __init__(self, operator):
+        if operator not in ("$sum", "$push", "$addToSet", "$first", "$last", "$min", "$max"):
+            raise _unsupported(f"accumulator {operator}")
+        self.operator = operator
+        self.values = []
+
+    def add(self, value):
+        self.values.append(value)
+
+    def result(self):
+        values = [value for value in self.values if value is not _missing]
+        if self.operator == "$sum":
+            return _sum(values)
+        if self.operator == "$push":
+            return values
+        if self.operator == "$addToSet":
+            unique = []
+            for value in values:
+                if not any(_equal(value, seen) for seen in unique):
+                    unique.append(value)
+            return unique
+        if self.operator in ("$first", "$last"):
+            if not self.values:
+                return None
+            return _value(self.values[0 if self.operator == "$first" else -1])
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        ordered = sorted(present, key=functools.cmp_to_key(_compare))
+        return ordered[0] if self.operator == "$min" else ordered[-1]
+
+
+def _project_stage(docs, specification):
+    include_id = specification.get("_id", 1)
+    fields = {key: value for key, value in specification.items() if key != "_id"}
+    if fields and all(value in (0, False) for value in fields.values()):
+        return [project(doc, specification) for doc in docs]
+    projected = []
+    for doc in docs:
+        result = {}
+        if include_id not in (0, False) and "_id" in doc:
+            result["_id"] = _copy(doc["_id"]) if include_id in (1, True) \
+                else _value(evaluate(include_id, doc))
+        for path, value in fields.items():
+            if value in (1, True):
+                _include(doc, result, path.split("."))
+            else:
+                computed = evaluate(value, doc)
+                if computed is not _missing:
+                    _set_path(result, path, computed)
+        projected.append(result)
+    return projected
+
+
+def _group_stage(docs, specification):
+    groups = {}
+    for doc in docs:
+        key = _value(evaluate(specification["_id"], doc))
+        marker = repr(key)
+        if marker not in groups:
+            groups[marker] = (key, {
+                field: _Accumulator(next(iter(accumulator)))
+                for field, accumulator in specification.items() if field != "_id"})
+        for field, accumulator in groups[marker][1].items():
+            accumulator.add(evaluate(specification[field][accumulator.operator], doc))
+    return [{"_id": key, **{field: accumulator.result()
+                            for field, accumulator in accumulators.items()}}
+            for key, accumulators in groups.values()]
+
+
+def _unwind_stage(docs, specification):
+    if isinstance(specification, str):
+        specification = {"path": specification}
+    path = specification["path"][1:]
+    preserve = specification.get("preserveNullAndEmptyArrays", False)
+    unwound = []
+    for doc in docs:
+        value = _get(doc, path, _missing)
+        if isinstance(value, list) and value:
+            for item in value:
+                copied = _copy(doc)
+                _set_path(copied, path, _copy(item))
+                unwound.append(copied)
+        elif value is not _missing and value is not None and not isinstance(value, list):
+            unwound.append(doc)
+        elif preserve:
+            unwound.append(doc)
+    return unwound
+
+
+def _lookup_stage(docs, specification, database):
+    if "pipeline" in specification:
+        raise _unsupported("$lookup with a pipeline")
+    foreign = database[specification["from"]]._documents_snapshot()
+    joined = []
+    for doc in docs:
+        local = _value(_field_values(doc, specification["localField"].split(".")))
+        locals_ = local if isinstance(local, list) else [local]
+        matched = [_copy(other) for other in foreign
+                   if any(_operator_matches("$eq", value,
+                                            *_candidates(other, specification["foreignField"]), {})
+                          for value in locals_)]
+        joined.append({**doc, specification["as"]: matched})
+    return joined
+
+
+def run_pipeline(docs, pipeline, database):
+    for stage in pipeline:
+        if len(stage) != 1:
+            raise OperationFailure(f"A pipeline stage specification object must contain exactly one field, found {list(stage)}")
+        name, specification = next(iter(stage.items()))
+        specification = _to_bson(specification)
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, specification)]
+        elif name == "$project":
+            docs = _project_stage(docs, specification)
+        elif name in ("$addFields", "$set"):
+            added = []
+            for doc in docs:
+                copied = _copy(doc)
+                for path, expression in specification.items():
+                    value = evaluate(expression, doc)
+                    if value is not _missing:
+                        _set_path(copied, path, value)
+                added.append(copied)
+            docs = added
+        elif name == "$unwind":
+            docs = _unwind_stage(docs, specification)
+        elif name == "$group":
+            docs = _group_stage(docs, specification)
+        elif name == "$lookup":
+            docs = _lookup_stage(docs, specification, database)
+        elif name == "$sort":
+            docs = sort_documents(docs, list(specification.items()))
+        elif name == "$skip":
+            docs = docs[specification:]
+        elif name == "$limit":
+            docs = docs[:specification]
+        elif name == "$count":
+            docs = [{specification: len(docs)}] if docs else []
+        else:
+            raise _unsupported(f"pipeline stage {name}")
+    return docs
+
+
+# -------- client, databases, collections and cursors
+
+
+def _key(_id):
+    # documents are keyed by _id, unhashable ids by their repr
+    try:
+        hash(_id)
+        return (type(_id).__name__, _id)
+    except TypeError:
+        return (type(_id).__name__, repr(_id))
+
+
+
+class MemoryCursor:
+    """Lazy like a pymongo Cursor, the query runs on first iteration."""
+
+    def __init__(self, collection, filter=None, projection=None, sort=None,
+                 skip=0, limit=0, documents=None):
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._sort = _sort_spec(sort) if sort else None
+        self._skip = skip
+        self._limit = limit
+        self._results = iter(documents) if documents is not None else None
+
+    def _check_not_started(self):
+        if self._results is not None:
+            raise InvalidOperation("cannot set options after executing query")
+
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._results is None:
+            self._results = iter(self._collection._query(
+                self._filter, self._projection, self._sort, self._skip, self._limit))
+        return next(self._results)
+
+    next = __next__
+
+    def close(self):
+        self._results = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _CollectionData:
+    """Documents keyed by _id, in insertion order, and index definitions."""
+
+    def __init__(self, options=None):
+        self.documents = {}
+        self.indexes = {"_id_": {"key": [("_id", 1)], "v": 2}}
+        self.options = options or {}
+
+
+class MemoryCollection:
+    """The subset of pymongo's Collection inventorius uses.
+
+    Like pymongo's, a collection is only a name, its data belongs to the
+    database and is created by the first write.
+    """
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._lock = database.client._lock
+
+    @property
+    def full_name(self):
+        return f"{self.database.name}.{self.name}"
+
+    def __repr__(self):
+        return f"MemoryCollection({self.database!r}, {self.name!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryCollection) and \
+            (self.database, self.name) == (other.database, other.name)
+
+    def __hash__(self):
+        return hash((self.database.name, self.name))
+
+    def with_options(self, **kwargs):
+        return self
+
+    # internals, called with the lock held
+
+    def _data(self, create=False):
+        data = self.database._collections.get(self.name)
+        if data is None:
+            data = _CollectionData()
+            if create:
+                self.database._collections[self.name] = data
+        return data
+
+    def _documents_snapshot(self):
+        with self._lock:
+            return list(self._data().documents.values())
+
+    def _matching(self, data, filter):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        filter = _to_bson(filter or {})
+        docs = data.documents.values()
+        # like the _id index, equality and $in on _id only look at those ids
+        ids = filter.get("_id")
+        if isinstance(ids, dict) and set(ids) == {"$in"} \
+                and not any(isinstance(id, (dict, list, re.Pattern, Regex)) for id in ids["$in"]):
+            ids = ids["$in"]
+        elif ids is not None and not isinstance(ids, (dict, list, re.Pattern, Regex)):
+            ids = [ids]
+        else:
+            ids = None
+        if ids is not None:
+            docs = [doc for doc in map(data.documents.get, dict.fromkeys(map(_key, ids)))
+                    if doc is not None]
+            filter = {key: value for key, value in filter.items() if key != "_id"}
+        text_fields = ()
+        if "$text" in filter:
+            text_fields = [field for index in data.indexes.values()
+                           for field, kind in index["key"] if kind == "text"]
+        return [doc for doc in docs if matches(doc, filter, text_fields)]
+
+    def _query(self, filter, projection, sort, skip, limit):
+        with self._lock:
+            docs = self._matching(self._data(), filter)
+            if sort:
+                docs = sort_documents(docs, sort)
+            if skip:
+                docs = docs[skip:]
+            if limit:
+                docs = docs[:abs(limit)]
+            return [project(doc, projection) for doc in docs]
+
+    def _check_unique(self, data, doc, replacing=None):
+        for name, index in data.indexes.items():
+            if name == "_id_" or not index.get("unique"):
+                continue
+            fields = [field for field, _ in index["key"]]
+            key = [_get(doc, field) for field in fields]
+            for other in data.documents.values():
+                if other is replacing:
+                    continue
+                if all(_equal(value, _get(other, field)) for value, field in zip(key, fields)):
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} "
+                        f"index: {name} dup key: {dict(zip(fields, key))}", 11000)
+
+    def _insert(self, doc):
+        data = self._data(create=True)
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        stored = _to_bson(doc)
+        key = _key(stored["_id"])
+        if key in data.documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} "
+                f"index: _id_ dup key: {{ _id: {stored['_id']!r} }}", 11000)
+        self._check_unique(data, stored)
+        data.documents[key] = stored
+        return stored
+
+    def _update(self, filter, update, upsert=False, many=False, sort=None):
+        """Returns (matched, modified, upserted_id, (before, after) of the
+        last document)."""
+        if not update:
+            raise ValueError("update cannot be empty")
+        data = self._data(create=True)
+        docs = self._matching(data, filter)
+        if sort:
+            docs = sort_documents(docs, _sort_spec(sort))
+        if not many:
+            docs = docs[:1]
+        if not docs:
+            if not upsert:
+                return 0, 0, None, (None, None)
+            stored = self._insert(_upsert_document(_to_bson(filter or {}), update))
+            return 0, 0, stored["_id"], (None, stored)
+        modified = 0
+        before = after = None
+        for doc in docs:
+            before = _copy(doc)
+            updated = _copy(doc)
+            apply_update(updated, update)
+            self._check_unique(data, updated, replacing=doc)
+            if not _equal(before, updated):
+                modified += 1
+                doc.clear()
+                doc.update(updated)
+            after = doc
+        return len(docs), modified, None, (before, after)
+
+    def _delete(self, filter, many=False):
+        data = self._data()
+        docs = self._matching(data, filter)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            del data.documents[_key(doc["_id"])]
+        return len(docs)
+
+    # reads
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None,
+             batch_size=0, hint=None, **kwargs):
+        if kwargs:
+            raise _unsupported(f"find options {sorted(kwargs)}")
+        return MemoryCursor(self, filter, projection, sort, skip, limit)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        for doc in self.find(filter, *args, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter, skip=0, limit=0, **kwargs):
+        with self._lock:
+            count = max(0, len(self._matching(self._data(), filter)) - skip)
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self, **kwargs):
+        with self._lock:
+            return len(self._data().documents)
+
+    def distinct(self, key, filter=None, **kwargs):
+        values = []
+        with self._lock:
+            for doc in self._matching(self._data(), filter):
+                for value in _candidates(doc, key)[1]:
+                    if not isinstance(value, list) \
+                            and not any(_equal(value, seen) for seen in values):
+                        values.append(_copy(value))
+        return values
+
+    def aggregate(self, pipeline, **kwargs):
+        docs = [_copy(doc) for doc in self._documents_snapshot()]
+        return MemoryCursor(self, documents=run_pipeline(docs, pipeline, self.database))
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+    # writes
+
+    def insert_one(self, document, **kwargs):
+        with self._lock:
+            return InsertOneResult(self._insert(document)["_id"], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        ids = []
+        errors = []
+        with self._lock:
+            for index, document in enumerate(documents):
+                try:
+                    ids.append(self._insert(document)["_id"])
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": 11000, "errmsg": str(e),
+                                   "op": document})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [],
+                                  "nInserted": len(ids), "nUpserted": 0, "nMatched": 0,
+                                  "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(ids, True)
+
+    def _update_result(self, matched, modified, upserted_id):
+        raw = {"n": matched + (1 if upserted_id is not None else 0), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            matched, modified, upserted_id, _ = self._update(filter, update, upsert)
+        return self._update_result(matched, modified, upserted_id)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            matched, modified, upserted_id, _ = self._update(filter, update, upsert, many=True)
+        return self._update_result(matched, modified, upserted_id)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        if any(key.startswith("$") for key in replacement):
+            raise ValueError("replacement can not include $ operators")
+        with self._lock:
+            matched, modified, upserted_id, _ = self._update(filter, replacement, upsert)
+        return self._update_result(matched, modified, upserted_id)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        with self._lock:
+            _, _, _, (before, after) = self._update(filter, update, upsert, sort=sort)
+            doc = after if return_document == ReturnDocument.AFTER else before
+            return project(doc, projection) if doc is not None else None
+
+    def delete_one(self, filter, **kwargs):
+        with self._lock:
+            return DeleteResult({"n": self._delete(filter)}, True)
+
+    def delete_many(self, filter, **kwargs):
+        with self._lock:
+            return DeleteResult({"n": self._delete(filter, many=True)}, True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0,
+                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+                  "upserted": []}
+        with self._lock:
+            for index, operation in enumerate(requests):
+                try:
+                    self._bulk_operation(operation, index, result)
+                except DuplicateKeyError as e:
+                    result["writeErrors"].append({"index": index, "code": 11000,
+                                                  "errmsg": str(e), "op": operation})
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _bulk_operation(self, operation, index, result):
+        if isinstance(operation, InsertOne):
+            self._insert(operation._doc)
+            result["nInserted"] += 1
+        elif isinstance(operation, (UpdateOne, UpdateMany, ReplaceOne)):
+            matched, modified, upserted_id, _ = self._update(
+                operation._filter, operation._doc, operation._upsert,
+                many=isinstance(operation, UpdateMany))
+            result["nMatched"] += matched
+            result["nModified"] += modified
+            if upserted_id is not None:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": index, "_id": upserted_id})
+        elif isinstance(operation, (DeleteOne, DeleteMany)):
+            result["nRemoved"] += self._delete(
+                operation._filter, many=isinstance(operation, DeleteMany))
+        else:
+            raise _unsupported(f"bulk operation {type(operation).__name__}")
+
+    # indexes and collection management
+
+    def create_index(self, keys, name=None, unique=False, **kwargs):
+        key = _sort_spec(keys)
+        if name is None:
+            name = "_".join(f"{field}_{kind}" for field, kind in key)
+        index = {"key": key, "v": 2}
+        if unique:
+            index["unique"] = True
+        index.update({option: value for option, value in kwargs.items()
+                      if option in ("expireAfterSeconds", "sparse", "partialFilterExpression")})
+        with self._lock:
+            data = self._data(create=True)
+            if unique:
+                seen = []
+                fields = [field for field, _ in key]
+                for doc in data.documents.values():
+                    values = [_get(doc, field) for field in fields]
+                    if any(all(_equal(a, b) for a, b in zip(values, other)) for other in seen):
+                        raise DuplicateKeyError(
+                            f"E11000 duplicate key error collection: {self.full_name} "
+                            f"index: {name} dup key: {dict(zip(fields, values))}", 11000)
+                    seen.append(values)
+            data.indexes[name] = index
+        return name
+
+    def index_information(self):
+        with self._lock:
+            data = self.database._collections.get(self.name)
+            return copy.deepcopy(data.indexes) if data is not None else {}
+
+    def drop(self, **kwargs):
+        self.database.drop_collection(self.name)
+
+    def rename(self, new_name, dropTarget=False, **kwargs):
+        with self._lock:
+            collections = self.database._collections
+            if self.name not in collections:
+                raise OperationFailure("source namespace does not exist", 26)
+            if new_name in collections and not dropTarget:
+                raise OperationFailure("target namespace exists", 48)
+            collections[new_name] = collections.pop(self.name)
+
+
+class MemoryDatabase:
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        # collection name -> _CollectionData
+        self._collections = {}
+
+    def __repr__(self):
+        return f"MemoryDatabase({self.name!r})"
+
+    def __getitem__(self, name):
+        return MemoryCollection(self, name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    def create_collection(self, name, **kwargs):
+        with self.client._lock:
+            if name in self._collections:
+                raise CollectionInvalid(f"collection {name} already exists")
+            self._collections[name] = _CollectionData(kwargs)
+        return self[name]
+
+    def drop_collection(self, name, **kwargs):
+        if isinstance(name, MemoryCollection):
+            name = name.name
+        with self.client._lock:
+            self._collections.pop(name, None)
+
+    def list_collection_names(self, **kwargs):
+        with self.client._lock:
+            return list(self._collections)
+
+    def command(self, command, *args, **kwargs):
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", 59)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+
+class MemoryClient:
+    """Databases kept in this process, see the module docstring."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._databases = {}
+
+    def __repr__(self):
+        return "MemoryClient()"
+
+    def __getitem__(self, name):
+        with self._lock:
+            database = self._databases.get(name)
+            if database is None:
+                database = self._databases[name] = MemoryDatabase(self, name)
+            return database
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    def drop_database(self, name):
+        if isinstance(name, MemoryDatabase):
+            name = name.name
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def list_database_names(self):
+        with self._lock:
+            return [name for name, database in self._databases.items()
+                    if database._collections]
+
+    def close(self):
+        pass
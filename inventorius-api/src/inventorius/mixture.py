@@ -1,37 +1,44 @@
 from datetime import datetime, timezone
-from decimal import Decimal, getcontext
+from decimal import ROUND_DOWN, Decimal, getcontext
 
-from flask import Blueprint, request
+from flask import Blueprint, request, url_for
+from pymongo import ASCENDING, DESCENDING
 from voluptuous.error import Invalid, MultipleInvalid
 
 from inventorius.data_models import (
     Batch,
     Bin,
     Mixture,
+    as_quantity,
     mixture_components_to_bson,
     quantity_to_bson,
 )
 from inventorius.db import db
+from inventorius.repository import batches, bins, mixtures, skus
+from inventorius.stock import adjust_bin_contents
 from inventorius.validation import (
     mixture_create_schema,
     mixture_draw_schema,
     mixture_split_schema,
 )
-from inventorius.util import no_cache
+from inventorius.util import getIntArgs, no_cache
 import inventorius.util_error_responses as problem
-from inventorius.resource_models import MixtureEndpoint
+from inventorius.resource_models import HypermediaEndpoint, MixtureEndpoint
+import inventorius.resource_operations as operations
 
 getcontext().prec = 28
 
 mixture = Blueprint("mixture", __name__)
 
 
-def _as_decimal(value):
-    return Decimal(str(value))
+ZERO = Decimal("0")
+# allocation granularity for proportional draws
+QUANTUM = Decimal("0.0000001")
 
 
 def _timestamp():
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    # fixed width, so audit events sort by their timestamp strings
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
 
 
 def build_audit_event(event_type, created_by, details=None, note=None):
@@ -47,85 +54,99 @@ def build_audit_event(event_type, created_by, details=None, note=None):
     return event
 
 
+AUDIT_PREVIEW_LIMIT = 50
+
+
+def record_audit(mix_id, *events):
+    """Append audit events to the mixture_audit collection.
+
+    Audit history is kept out of the mixture document so it can not grow the
+    mixture toward the document size limit, and so loading a mixture does not
+    drag its whole history along.
+    """
+    if events:
+        db.mixture_audit.insert_many(
+            [{**event, "mix_id": mix_id} for event in events])
+
+
+def get_audit_page(mix_id, starting_from=0, limit=20):
+    """Returns (total, events) for one page of a mixture's audit history, oldest first.
+
+    Events still embedded in older mixture documents come before the ones in
+    the mixture_audit collection.
+    """
+    legacy_doc = db.mixture.find_one({"_id": mix_id}, {"audit": 1}) or {}
+    legacy = legacy_doc.get("audit") or []
+    total = len(legacy) + db.mixture_audit.count_documents({"mix_id": mix_id})
+
+    events = legacy[starting_from:starting_from + limit]
+    skip = max(0, starting_from - len(legacy))
+    wanted = limit - len(events)
+    if wanted > 0:
+        cursor = db.mixture_audit.find(
+            {"mix_id": mix_id}, {"_id": 0, "mix_id": 0}
+        ).sort([("timestamp", ASCENDING), ("_id", ASCENDING)]).skip(skip).limit(wanted)
+        events.extend(cursor)
+    return total, events
+
+
 def _proportional_allocation(components, quantity):
-    total = sum(
-        _as_decimal(component.get("qty_remaining", 0)) for component in components
-    )
-    requested = _as_decimal(quantity)
+    """Split `quantity` across components in proportion to what remains of each.
+
+    All math is done on Decimal lists in a few passes: every component but
+    the last gets its share rounded down to QUANTUM, the last absorbs the
+    rounding, and any amount the last component can not cover is taken from
+    the others' spare capacity. The extracted quantities always sum to
+    exactly `quantity` and never exceed what a component holds.
+    """
+    remaining = [as_quantity(component.get("qty_remaining", 0)) for component in components]
+    initial = [
+        as_quantity(component.get("qty_initial", component.get("qty_remaining", 0)))
+        for component in components
+    ]
+    total = sum(remaining, ZERO)
+    requested = as_quantity(quantity)
     if requested > total:
         raise ValueError(f"insufficient quantity in mixture: requested {requested}, available {total}")
 
-    allocated = Decimal("0")
-    remaining_components = []
-    extracted_components = []
+    if total == ZERO or not components:
+        takes = [ZERO for _ in components]
+    else:
+        takes = [
+            min((requested * held / total).quantize(QUANTUM, rounding=ROUND_DOWN), held)
+            for held in remaining[:-1]
+        ]
+        takes.append(min(requested - sum(takes, ZERO), remaining[-1]))
 
-    for index, component in enumerate(components):
-        current_remaining = _as_decimal(component.get("qty_remaining", 0))
-        qty_initial_value = component.get(
-            "qty_initial", component.get("qty_remaining", 0)
-        )
-        if total == 0:
-            share = Decimal("0")
-        else:
-            share = current_remaining / total
-
-        if index == len(components) - 1:
-            take = requested - allocated
-        else:
-            take = (requested * share).quantize(Decimal("0.0000001"))
-        if take > current_remaining:
-            take = current_remaining
-        if take < Decimal("0"):
-            take = Decimal("0")
-
-        allocated += take
-        remaining_value = current_remaining - take
-        if remaining_value < Decimal("0"):
-            take += remaining_value
-            remaining_value = Decimal("0")
+        shortfall = requested - sum(takes, ZERO)
+        for index in range(len(takes)):
+            if shortfall <= ZERO:
+                break
+            extra = min(remaining[index] - takes[index], shortfall)
+            takes[index] += extra
+            shortfall -= extra
 
+    remaining_components = []
+    extracted_components = []
+    for component, held, initial_qty, take in zip(components, remaining, initial, takes):
         remaining_components.append(
             {
                 "batch_id": component["batch_id"],
-                "qty_initial": float(qty_initial_value),
-                "qty_remaining": float(remaining_value),
+                "qty_initial": initial_qty,
+                "qty_remaining": held - take,
             }
         )
         extracted_components.append(
             {
                 "batch_id": component["batch_id"],
-                "qty_initial": float(take),
-                "qty_remaining": float(take),
+                "qty_initial": take,
+                "qty_remaining": take,
             }
         )
 
-    difference = requested - allocated
-    if difference != Decimal("0") and extracted_components:
-        last_remaining = _as_decimal(remaining_components[-1]["qty_remaining"]) - difference
-        last_extracted = _as_decimal(extracted_components[-1]["qty_initial"]) + difference
-        if last_remaining < Decimal("0"):
-            last_extracted += last_remaining
-            last_remaining = Decimal("0")
-        remaining_components[-1]["qty_remaining"] = float(last_remaining)
-        extracted_components[-1]["qty_initial"] = float(last_extracted)
-        extracted_components[-1]["qty_remaining"] = float(last_extracted)
-
     return remaining_components, extracted_components
 
 
-def _normalize_components(components):
-    normalized = []
-    for component in components:
-        normalized.append(
-            {
-                "batch_id": component["batch_id"],
-                "qty_initial": float(component["qty_initial"]),
-                "qty_remaining": float(component["qty_remaining"]),
-            }
-        )
-    return normalized
-
-
 def _insufficient_quantity_error(index, available, requested):
     return MultipleInvalid(
         [
@@ -138,7 +159,25 @@ def _insufficient_quantity_error(index, available, requested):
 
 
 def get_mixture(mix_id):
-    return Mixture.from_mongodb_doc(db.mixture.find_one({"_id": mix_id}))
+    return mixtures.load(mix_id, exclude=["audit"])
+
+
+def insert_mixture(mixture_state):
+    """Insert a new mixture, its audit events go to the mixture_audit collection."""
+    doc = mixture_state.to_mongodb_doc()
+    doc.pop("audit", None)
+    db.mixture.insert_one(doc)
+    record_audit(mixture_state.mix_id, *mixture_state.audit)
+
+
+def get_recent_audit(mix_id, limit):
+    """Returns the newest `limit` audit events of a mixture, oldest first."""
+    legacy_doc = db.mixture.find_one({"_id": mix_id}, {"audit": 1}) or {}
+    recent = list(db.mixture_audit.find(
+        {"mix_id": mix_id}, {"_id": 0, "mix_id": 0}
+    ).sort([("timestamp", DESCENDING), ("_id", DESCENDING)]).limit(limit))
+    recent.reverse()
+    return ((legacy_doc.get("audit") or []) + recent)[-limit:]
 
 
 @mixture.route("/api/mixtures", methods=["POST"])
@@ -149,20 +188,22 @@ def mixtures_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    if Mixture.from_mongodb_doc(db.mixture.find_one({"_id": payload["mix_id"]})):
+    if mixtures.exists(payload["mix_id"]):
         return problem.duplicate_resource_response("mix_id")
 
-    bin_doc = Bin.from_mongodb_doc(db.bin.find_one({"_id": payload["bin_id"]}))
+    batch_ids = [component["batch_id"] for component in payload["components"]]
+    bin_doc = bins.load(
+        payload["bin_id"], fields=[f"contents.{batch_id}" for batch_id in batch_ids])
     if bin_doc is None:
         return problem.missing_bin_response(payload["bin_id"])
 
-    if not db.sku.find_one({"_id": payload["sku_id"]}):
+    if not skus.exists(payload["sku_id"]):
         return problem.missing_sku_response(payload["sku_id"])
 
     component_batches = []
-    total_requested = Decimal("0")
+    total_requested = ZERO
     for index, component in enumerate(payload["components"]):
-        batch = Batch.from_mongodb_doc(db.batch.find_one({"_id": component["batch_id"]}))
+        batch = batches.load(component["batch_id"], fields=["sku_id", "qty_remaining"])
         if batch is None:
             return problem.missing_batch_response(component["batch_id"])
         if batch.sku_id != payload["sku_id"]:
@@ -176,9 +217,9 @@ def mixtures_post():
             )
             return problem.invalid_params_response(error)
 
-        quantity = _as_decimal(component["quantity"])
-        available_in_bin = Decimal(str(bin_doc.contents.get(batch.id, 0)))
-        batch_remaining = Decimal(str(batch.qty_remaining or 0))
+        quantity = as_quantity(component["quantity"])
+        available_in_bin = as_quantity(bin_doc.contents.get(batch.id, 0))
+        batch_remaining = as_quantity(batch.qty_remaining or 0)
 
         if available_in_bin < quantity:
             error = _insufficient_quantity_error(
@@ -198,7 +239,7 @@ def mixtures_post():
         component_batches.append((batch, quantity))
         total_requested += quantity
 
-    if total_requested <= Decimal("0"):
+    if total_requested <= ZERO:
         error = MultipleInvalid(
             [Invalid("mixtures must contain a positive quantity", path=["components"])]
         )
@@ -206,27 +247,20 @@ def mixtures_post():
 
     components_state = []
     for batch, quantity in component_batches:
-        new_qty = Decimal(str(batch.qty_remaining or 0)) - quantity
+        new_qty = as_quantity(batch.qty_remaining or 0) - quantity
         db.batch.update_one(
             {"_id": batch.id},
-            {"$set": {"qty_remaining": quantity_to_bson(float(new_qty))}},
+            {"$set": {"qty_remaining": quantity_to_bson(new_qty)}},
         )
 
-        db.bin.update_one(
-            {"_id": payload["bin_id"]},
-            {"$inc": {f"contents.{batch.id}": -float(quantity)}}
-        )
-        db.bin.update_one(
-            {"_id": payload["bin_id"], f"contents.{batch.id}": 0},
-            {"$unset": {f"contents.{batch.id}": ""}},
-        )
+        adjust_bin_contents(payload["bin_id"], batch.id, -quantity,
+                            sku_id=payload["sku_id"])
 
-        quantity_float = float(quantity)
         components_state.append(
             {
                 "batch_id": batch.id,
-                "qty_initial": quantity_float,
-                "qty_remaining": quantity_float,
+                "qty_initial": quantity,
+                "qty_remaining": quantity,
             }
         )
 
@@ -235,25 +269,23 @@ def mixtures_post():
         sku_id=payload["sku_id"],
         bin_id=payload["bin_id"],
         components=components_state,
-        qty_total=float(total_requested),
+        qty_total=total_requested,
         created_by=payload["created_by"],
     )
 
     audit_entry = build_audit_event(
         "created",
         payload["created_by"],
-        details={"components": _normalize_components(components_state)},
+        details={"components": mixture_components_to_bson(components_state)},
     )
     initial_audit = [audit_entry]
     if payload.get("audit"):
         initial_audit.extend(payload["audit"])
     mixture_state.audit = initial_audit
 
-    db.mixture.insert_one(mixture_state.to_mongodb_doc())
-    db.bin.update_one(
-        {"_id": payload["bin_id"]},
-        {"$inc": {f"contents.{payload['mix_id']}": float(total_requested)}},
-    )
+    insert_mixture(mixture_state)
+    adjust_bin_contents(payload["bin_id"], payload["mix_id"], total_requested,
+                        sku_id=payload["sku_id"])
 
     return MixtureEndpoint.from_mixture(mixture_state).get_response(status_code=201)
 
@@ -265,6 +297,10 @@ def mixture_get(mix_id):
     if existing is None:
         return problem.missing_mixture_response(mix_id)
 
+    # only the most recent events are embedded, the rest is paged from
+    # /api/mixture/<mix_id>/audit
+    existing.audit = get_recent_audit(mix_id, AUDIT_PREVIEW_LIMIT)
+
     return MixtureEndpoint.from_mixture(existing).get_response()
 
 
@@ -275,13 +311,16 @@ def apply_draw(mixture_state, quantity, created_by, note=None):
 
     mixture_state.components = remaining_components
     mixture_state.qty_total = sum(
-        component["qty_remaining"] for component in remaining_components
+        (component["qty_remaining"] for component in remaining_components), ZERO
     )
 
     event = build_audit_event(
         "draw",
         created_by,
-        details={"quantity": quantity, "components": extracted_components},
+        details={
+            "quantity": quantity_to_bson(quantity),
+            "components": mixture_components_to_bson(extracted_components),
+        },
         note=note,
     )
     return mixture_state, event, extracted_components
@@ -299,7 +338,7 @@ def mixture_draw(mix_id):
     if existing is None:
         return problem.missing_mixture_response(mix_id)
 
-    quantity = float(payload["quantity"])
+    quantity = as_quantity(payload["quantity"])
     if quantity > existing.qty_total:
         error = MultipleInvalid(
             [Invalid("requested quantity exceeds mixture total", path=["quantity"])]
@@ -319,19 +358,14 @@ def mixture_draw(mix_id):
                 "components": mixture_components_to_bson(updated_mixture.components),
                 "qty_total": quantity_to_bson(updated_mixture.qty_total),
             },
-            "$push": {"audit": event},
         },
     )
-    db.bin.update_one(
-        {"_id": updated_mixture.bin_id},
-        {"$inc": {f"contents.{mix_id}": -quantity}},
-    )
-    db.bin.update_one(
-        {"_id": updated_mixture.bin_id, f"contents.{mix_id}": 0},
-        {"$unset": {f"contents.{mix_id}": ""}},
-    )
+    record_audit(mix_id, event)
+    adjust_bin_contents(updated_mixture.bin_id, mix_id, -quantity,
+                        sku_id=updated_mixture.sku_id)
 
     refreshed = get_mixture(mix_id)
+    refreshed.audit = get_recent_audit(mix_id, AUDIT_PREVIEW_LIMIT)
     return MixtureEndpoint.from_mixture(refreshed).get_response()
 
 
@@ -347,14 +381,13 @@ def mixture_split(mix_id):
     if existing is None:
         return problem.missing_mixture_response(mix_id)
 
-    if Mixture.from_mongodb_doc(db.mixture.find_one({"_id": payload["new_mix_id"]})):
+    if mixtures.exists(payload["new_mix_id"]):
         return problem.duplicate_resource_response("new_mix_id")
 
-    destination_bin = Bin.from_mongodb_doc(db.bin.find_one({"_id": payload["destination_bin"]}))
-    if destination_bin is None:
+    if not bins.exists(payload["destination_bin"]):
         return problem.missing_bin_response(payload["destination_bin"])
 
-    quantity = float(payload["quantity"])
+    quantity = as_quantity(payload["quantity"])
     if quantity > existing.qty_total:
         error = MultipleInvalid(
             [Invalid("requested quantity exceeds mixture total", path=["quantity"])]
@@ -368,16 +401,18 @@ def mixture_split(mix_id):
     )
 
     existing.components = remaining_components
-    existing.qty_total = sum(component["qty_remaining"] for component in remaining_components)
+    existing.qty_total = sum(
+        (component["qty_remaining"] for component in remaining_components), ZERO
+    )
 
     split_event = build_audit_event(
         "split",
         payload["created_by"],
         details={
-            "quantity": quantity,
+            "quantity": quantity_to_bson(quantity),
             "new_mix_id": payload["new_mix_id"],
             "destination_bin": payload["destination_bin"],
-            "components": extracted_components,
+            "components": mixture_components_to_bson(extracted_components),
         },
         note=payload.get("note"),
     )
@@ -390,16 +425,16 @@ def mixture_split(mix_id):
                 "qty_total": quantity_to_bson(existing.qty_total),
                 "bin_id": existing.bin_id,
             },
-            "$push": {"audit": split_event},
         },
     )
+    record_audit(mix_id, split_event)
 
     new_mixture = Mixture(
         mix_id=payload["new_mix_id"],
         sku_id=existing.sku_id,
         bin_id=payload["destination_bin"],
         components=extracted_components,
-        qty_total=float(quantity),
+        qty_total=quantity,
         created_by=payload["created_by"],
         audit=[
             build_audit_event(
@@ -407,29 +442,20 @@ def mixture_split(mix_id):
                 payload["created_by"],
                 details={
                     "source_mix_id": mix_id,
-                    "components": extracted_components,
-                    "quantity": quantity,
+                    "components": mixture_components_to_bson(extracted_components),
+                    "quantity": quantity_to_bson(quantity),
                 },
                 note=payload.get("note"),
             )
         ],
     )
 
-    db.mixture.insert_one(new_mixture.to_mongodb_doc())
+    insert_mixture(new_mixture)
 
-    db.bin.update_one(
-        {"_id": existing.bin_id},
-        {"$inc": {f"contents.{mix_id}": -quantity}},
-    )
-    db.bin.update_one(
-        {"_id": existing.bin_id, f"contents.{mix_id}": 0},
-        {"$unset": {f"contents.{mix_id}": ""}},
-    )
-
-    db.bin.update_one(
-        {"_id": new_mixture.bin_id},
-        {"$inc": {f"contents.{new_mixture.mix_id}": quantity}},
-    )
+    adjust_bin_contents(existing.bin_id, mix_id, -quantity,
+                        sku_id=existing.sku_id)
+    adjust_bin_contents(new_mixture.bin_id, new_mixture.mix_id, quantity,
+                        sku_id=new_mixture.sku_id)
 
     refreshed_new = get_mixture(new_mixture.mix_id)
     return MixtureEndpoint.from_mixture(refreshed_new).get_response(status_code=201)
@@ -449,14 +475,37 @@ def mixture_append_audit(mix_id):
         )
         return problem.invalid_params_response(error)
 
-    existing = get_mixture(mix_id)
-    if existing is None:
+    if not mixtures.exists(mix_id):
         return problem.missing_mixture_response(mix_id)
 
     audit_event = build_audit_event(
         event, created_by, details=payload.get("details"), note=payload.get("note")
     )
-    db.mixture.update_one({"_id": mix_id}, {"$push": {"audit": audit_event}})
+    record_audit(mix_id, audit_event)
 
     refreshed = get_mixture(mix_id)
+    refreshed.audit = get_recent_audit(mix_id, AUDIT_PREVIEW_LIMIT)
     return MixtureEndpoint.from_mixture(refreshed).get_response()
+
+
+@mixture.route("/api/mixture/<mix_id>/audit", methods=["GET"])
+@no_cache
+def mixture_audit_get(mix_id):
+    limit = getIntArgs(request.args, "limit", 20)
+    starting_from = getIntArgs(request.args, "startingFrom", 0)
+
+    if not mixtures.exists(mix_id):
+        return problem.missing_mixture_response(mix_id)
+
+    total, events = get_audit_page(mix_id, starting_from, limit)
+    return HypermediaEndpoint(
+        url_for("mixture.mixture_audit_get", mix_id=mix_id),
+        {
+            "total_num_results": total,
+            "starting_from": starting_from,
+            "limit": limit,
+            "returned_num_results": len(events),
+            "results": events,
+        },
+        [operations.mixture_append_audit(mix_id)],
+    ).get_response()
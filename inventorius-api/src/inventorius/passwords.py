@@ -0,0 +1,167 @@
+"""
+    inventorius.passwords
+    ~~~~~~~~~~~~~~
+
+    Password hashing and login throttling.
+
+    Hashing is slow on purpose, so it runs in a small process pool instead of
+    blocking the request thread (PASSWORD_HASH_WORKERS processes, at most
+    PASSWORD_HASH_MAX_PENDING hashes queued, beyond that PasswordHasherBusy
+    is raised). The pool starts its processes from a forkserver, forking a
+    worker that already runs threads could copy a held lock into the child.
+    Testing apps hash inline.
+
+    Users store the version of the scheme their hash was made with, users
+    on an older version are rehashed with CURRENT_HASH_VERSION the next time
+    they log in:
+
+        1   pbkdf2-sha256, 100000 iterations (users without a version)
+        2   scrypt, n=2**14, r=8, p=1
+
+    Failed logins are recorded in the login_failures collection, shared by
+    all workers. An account or client address with too many recent failures
+    is refused until the oldest of them leaves the LOGIN_FAILURE_WINDOW.
+    Behind a reverse proxy the client address is only right with
+    INVENTORIUS_TRUSTED_PROXIES set (see inventorius/__init__.py).
+"""
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from inventorius.db import db
+
+HASH_SCHEMES = {
+    1: {"name": "pbkdf2-sha256", "iterations": 100000},
+    2: {"name": "scrypt", "n": 2**14, "r": 8, "p": 1},
+}
+CURRENT_HASH_VERSION = 2
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already waiting for the pool."""
+
+
+def derive(password, salt, version):
+    """Hash a password with the scheme of `version`, runs in the pool."""
+    scheme = HASH_SCHEMES[version]
+    if scheme["name"] == "pbkdf2-sha256":
+        return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt,
+                                   scheme["iterations"])
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=scheme["n"],
+                          r=scheme["r"], p=scheme["p"])
+
+
+def _process_context():
+    context = multiprocessing.get_context("forkserver")
+    if "uwsgi" in sys.modules:
+        # sys.executable is the uwsgi binary there, not an interpreter
+        context.set_executable(os.path.join(sys.exec_prefix, "bin", "python3"))
+    return context
+
+
+class PasswordHasher:
+    """Flask extension hashing passwords in a process pool."""
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._pending = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PASSWORD_HASH_WORKERS", 2)
+        app.config.setdefault("PASSWORD_HASH_MAX_PENDING", 16)
+        self.app = app
+        self._pending = threading.BoundedSemaphore(app.config["PASSWORD_HASH_MAX_PENDING"])
+        app.extensions["password_hasher"] = self
+
+    def _derive(self, password, salt, version):
+        if self.app.testing:
+            return derive(password, salt, version)
+        if not self._pending.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            with self._executor_lock:
+                # created on first use, so each forked worker has its own pool
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        self.app.config["PASSWORD_HASH_WORKERS"], mp_context=_process_context())
+            return self._executor.submit(derive, password, salt, version).result()
+        finally:
+            self._pending.release()
+
+    def hash(self, password, version=CURRENT_HASH_VERSION):
+        """The password fields of a UserData for a new password."""
+        salt = os.urandom(64)
+        return {
+            "password_hash": self._derive(password, salt, version),
+            "password_salt": salt,
+            "password_hash_version": version,
+        }
+
+    def verify(self, user_data, password):
+        expected = self._derive(password, user_data.password_salt,
+                                user_data.password_hash_version)
+        return hmac.compare_digest(expected, user_data.password_hash)
+
+
+password_hasher = PasswordHasher()
+
+
+def needs_rehash(user_data):
+    return user_data.password_hash_version != CURRENT_HASH_VERSION
+
+
+class LoginThrottle:
+    """Flask extension refusing logins after repeated failures."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("LOGIN_FAILURE_WINDOW", 15 * 60)
+        app.config.setdefault("LOGIN_MAX_ACCOUNT_FAILURES", 5)
+        app.config.setdefault("LOGIN_MAX_ADDRESS_FAILURES", 50)
+        self.app = app
+        app.extensions["login_throttle"] = self
+
+    def _limits(self, account_id, address):
+        config = self.app.config
+        return [(f"account:{account_id}", config["LOGIN_MAX_ACCOUNT_FAILURES"]),
+                (f"address:{address}", config["LOGIN_MAX_ADDRESS_FAILURES"])]
+
+    def retry_after(self, account_id, address):
+        """Seconds until a login may be tried again, or None if allowed now."""
+        window = timedelta(seconds=self.app.config["LOGIN_FAILURE_WINDOW"])
+        now = datetime.now(timezone.utc)
+        wait = None
+        for key, limit in self._limits(account_id, address):
+            recent = list(db.login_failures.find(
+                {"key": key, "at": {"$gt": now - window}}, {"at": 1})
+                .sort("at", -1).limit(limit))
+            if len(recent) >= limit:
+                oldest = recent[-1]["at"]
+                if oldest.tzinfo is None:
+                    oldest = oldest.replace(tzinfo=timezone.utc)
+                seconds = max(1, int((oldest + window - now).total_seconds()) + 1)
+                wait = max(wait or 0, seconds)
+        return wait
+
+    def record_failure(self, account_id, address):
+        now = datetime.now(timezone.utc)
+        db.login_failures.insert_many([{"key": key, "at": now}
+                                       for key, _ in self._limits(account_id, address)])
+
+    def record_success(self, account_id):
+        db.login_failures.delete_many({"key": f"account:{account_id}"})
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,368 @@
+"""
+    inventorius.profiling
+    ~~~~~~~~~~~~~~
+
+    Database round trips and latency per request and per route.
+
+    A pymongo CommandListener counts the commands each request sends, how
+    long they took and how many bytes of bson went each way. Commands sent
+    by the query fan-out threads and the async lookup loop count for the
+    request that started them. Responses carry the numbers in a
+    Server-Timing header (SERVER_TIMING, on by default):
+
+        Server-Timing: db;dur=3.2;desc="4 commands", app;dur=7.9
+
+    and GET /api/metrics reports totals per route in the prometheus text
+    format. Totals are kept by each worker process and labelled with its
+    pid, a scrape sees the worker that answered it and sum() without the
+    pid label adds up the workers seen so far. The metrics need a logged in
+    user or device token unless METRICS_PUBLIC is set. Measuring bytes
+    encodes each command and reply again, DB_PROFILE_BYTES=False skips that.
+
+    With QUERY_LOG (on in debug mode, or INVENTORIUS_QUERY_LOG=true) a
+    warning is logged for each request that sends more than
+    QUERY_LOG_REPEATS commands of the same shape, usually a lookup per item
+    of a loop (N+1), and for each command slower than QUERY_LOG_SLOW_MS:
+
+        GET /api/traceability sent 40 x find batch {"filter": {"_id": "?"}} (12.1 ms) plan: IDHACK
+
+    A shape is the command, collection and filter with the values left
+    out. Reads are explained (queryPlanner verbosity) once per shape and
+    worker, QUERY_LOG_EXPLAIN=False turns that off.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+import bson
+from flask import Blueprint, Response, request
+from flask_login import current_user
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+import inventorius.util_error_responses as problem
+
+log = logging.getLogger(__name__)
+
+# the RequestProfile of the request issuing a command, if any
+current_profile = ContextVar("current_profile", default=None)
+
+profiling = Blueprint("profiling", __name__)
+
+
+# the parts of a command that make its shape, besides name and collection
+_shape_fields = ("filter", "query", "pipeline", "sort", "projection", "key", "updates", "deletes")
+_explained_commands = ("find", "aggregate", "count", "distinct")
+_explain_fields = ("filter", "query", "pipeline", "sort", "projection", "key", "limit", "skip", "hint")
+
+
+def _blank_key(key):
+    # bin contents are keyed by item id, contents.SKU000001 is a value too
+    return re.sub(r"^contents\.[^.]+", "contents.?", key)
+
+
+def _blank_values(value):
+    if isinstance(value, dict):
+        return {_blank_key(key): _blank_values(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_blank_values(item) for item in value]
+        # an $in list or documents of an insert are the same shape at any length
+        return "?" if all(item == "?" for item in items) else items
+    return "?"
+
+
+def command_shape(command):
+    """"find sku {"filter": {"_id": "?"}}" for a find of one sku by id."""
+    name = next(iter(command))
+    fields = {field: _blank_values(command[field]) for field in _shape_fields
+              if field in command}
+    if name in ("update", "delete"):
+        # one statement is enough, the rest of a bulk write looks alike
+        key, inner = ("updates", "q") if name == "update" else ("deletes", "q")
+        fields.pop(key, None)
+        if command.get(key):
+            fields[inner] = _blank_values(command[key][0].get(inner, {}))
+    # getMore names its cursor first, the collection comes later
+    collection = command.get("collection") if name == "getMore" else command[name]
+    shape = f"{name} {collection}"
+    if fields:
+        shape += " " + json.dumps(fields, sort_keys=True, default=str)
+    return shape
+
+
+class RequestProfile:
+    """Database commands of one request, by shape when track_shapes is set."""
+
+    def __init__(self, track_shapes=False):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.db_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.track_shapes = track_shapes
+        self._pending = {}
+        # shape -> {"count", "seconds", "slowest", "command", "database"}
+        self.shapes = {}
+
+    def command_started(self, size, event=None):
+        with self._lock:
+            self.commands += 1
+            self.bytes_sent += size
+            if self.track_shapes and event is not None:
+                self._pending[event.request_id] = (event.command, event.database_name)
+
+    def command_finished(self, seconds, size, request_id=None):
+        with self._lock:
+            self.db_seconds += seconds
+            self.bytes_received += size
+            pending = self._pending.pop(request_id, None)
+            if pending is None:
+                return
+            command, database = pending
+            shape = self.shapes.setdefault(command_shape(command), {
+                "count": 0, "seconds": 0.0, "slowest": 0.0,
+                "command": command, "database": database})
+            shape["count"] += 1
+            shape["seconds"] += seconds
+            if seconds > shape["slowest"]:
+                shape["slowest"] = seconds
+                shape["command"] = command
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """Adds the commands of every mongo client to the current profile."""
+
+    measure_bytes = True
+
+    def _size(self, document):
+        return len(bson.encode(document)) if self.measure_bytes and document else 0
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_started(self._size(event.command), event)
+
+    def succeeded(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event.duration_micros / 1e6, self._size(event.reply),
+                                     event.request_id)
+
+    def failed(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event.duration_micros / 1e6, 0, event.request_id)
+
+
+def _plan_stages(plan):
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " > ".join(reversed(stages))
+
+
+def explain_summary(explain):
+    """The winning plan's stages, innermost first, of an explain reply."""
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        # aggregations explain the cursor stage that reads the collection
+        for stage in explain.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    if not planner:
+        return "unknown"
+    winning = planner.get("winningPlan", {})
+    return _plan_stages(winning.get("queryPlan", winning))
+
+
+class QueryLog:
+    """Logs repeated and slow command shapes of a request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans = {}
+
+    def _plan(self, shape, details, explain):
+        if not explain or next(iter(details["command"])) not in _explained_commands:
+            return None
+        with self._lock:
+            if shape in self._plans:
+                return self._plans[shape]
+        from inventorius.db import get_mongo_client
+
+        command = details["command"]
+        name = next(iter(command))
+        to_explain = {name: command[name],
+                      **{field: command[field] for field in _explain_fields if field in command}}
+        if name == "aggregate":
+            to_explain["cursor"] = {}
+        token = current_profile.set(None)
+        try:
+            summary = explain_summary(get_mongo_client()[details["database"]].command(
+                {"explain": to_explain, "verbosity": "queryPlanner"}))
+        except PyMongoError as e:
+            summary = f"explain failed: {e}"
+        finally:
+            current_profile.reset(token)
+        with self._lock:
+            self._plans[shape] = summary
+        return summary
+
+    def report(self, route, profile, repeats, slow_ms, explain=True):
+        """Log the request's repeated and slow shapes, returns the messages."""
+        messages = []
+        for shape, details in profile.shapes.items():
+            repeated = details["count"] > repeats
+            slow = details["slowest"] * 1000 > slow_ms
+            if not repeated and not slow:
+                continue
+            if repeated:
+                message = (f"{route} sent {details['count']} x {shape} "
+                           f"({details['seconds'] * 1000:.1f} ms)")
+            else:
+                message = (f"{route} sent a slow {shape} "
+                           f"({details['slowest'] * 1000:.1f} ms)")
+            plan = self._plan(shape, details, explain)
+            if plan:
+                message += f" plan: {plan}"
+            log.warning(message)
+            messages.append(message)
+        return messages
+
+
+query_log = QueryLog()
+
+
+class RouteMetrics:
+    """Totals per (route, method) since the worker started."""
+
+    fields = ("requests", "seconds", "db_commands", "db_seconds",
+              "db_bytes_sent", "db_bytes_received")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: dict.fromkeys(self.fields, 0))
+
+    def add(self, route, method, profile, seconds):
+        with self._lock:
+            totals = self._totals[(route, method)]
+            totals["requests"] += 1
+            totals["seconds"] += seconds
+            totals["db_commands"] += profile.commands
+            totals["db_seconds"] += profile.db_seconds
+            totals["db_bytes_sent"] += profile.bytes_sent
+            totals["db_bytes_received"] += profile.bytes_received
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(totals) for key, totals in self._totals.items()}
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+
+_metric_types = [
+    ("requests", "inventorius_requests_total", "Requests handled."),
+    ("seconds", "inventorius_request_seconds_total", "Time spent handling requests."),
+    ("db_commands", "inventorius_db_commands_total", "Mongo commands sent."),
+    ("db_seconds", "inventorius_db_seconds_total", "Time spent waiting on mongo commands."),
+    ("db_bytes_sent", "inventorius_db_sent_bytes_total", "Bson bytes of mongo commands."),
+    ("db_bytes_received", "inventorius_db_received_bytes_total", "Bson bytes of mongo replies."),
+]
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(snapshot, pid=None):
+    if pid is None:
+        pid = os.getpid()
+    lines = []
+    for field, name, help in _metric_types:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for (route, method), totals in sorted(snapshot.items()):
+            lines.append(f'{name}{{route="{_label(route)}",method="{method}",pid="{pid}"}} '
+                         f"{totals[field]}")
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Flask extension profiling requests."""
+
+    def __init__(self, app=None):
+        self.listener = CommandProfiler()
+        self.metrics = RouteMetrics()
+        self._registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SERVER_TIMING", True)
+        app.config.setdefault("DB_PROFILE_BYTES", True)
+        app.config.setdefault("QUERY_LOG", app.debug or os.getenv("INVENTORIUS_QUERY_LOG") == "true")
+        app.config.setdefault("QUERY_LOG_REPEATS", 10)
+        app.config.setdefault("QUERY_LOG_SLOW_MS", 100)
+        app.config.setdefault("QUERY_LOG_EXPLAIN", True)
+        app.config.setdefault("METRICS_PUBLIC", False)
+        self.app = app
+        app.extensions["profiler"] = self
+        self.listener.measure_bytes = app.config["DB_PROFILE_BYTES"]
+        if not self._registered:
+            # only clients created from now on report to the listener
+            monitoring.register(self.listener)
+            self._registered = True
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    def _start(self):
+        profile = RequestProfile(track_shapes=self.app.config["QUERY_LOG"])
+        request.environ["inventorius.profile_token"] = current_profile.set(profile)
+
+    def _finish(self, response):
+        profile = current_profile.get()
+        if profile is None:
+            return response
+        seconds = time.perf_counter() - profile.started
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        self.metrics.add(route, request.method, profile, seconds)
+        if profile.track_shapes:
+            config = self.app.config
+            query_log.report(f"{request.method} {route}", profile, config["QUERY_LOG_REPEATS"],
+                             config["QUERY_LOG_SLOW_MS"], config["QUERY_LOG_EXPLAIN"])
+        if self.app.config["SERVER_TIMING"]:
+            response.headers.add("Server-Timing", (
+                f'db;dur={profile.db_seconds * 1000:.1f};desc="{profile.commands} commands", '
+                f"app;dur={seconds * 1000:.1f}"))
+        return response
+
+    def _teardown(self, exc):
+        token = request.environ.pop("inventorius.profile_token", None)
+        if token is not None:
+            current_profile.reset(token)
+
+
+profiler = Profiler()
+
+
+@profiling.route("/api/metrics", methods=["GET"])
+def metrics_get():
+    if not (profiler.app.config["METRICS_PUBLIC"] or current_user.is_authenticated):
+        return problem.permission_denied_response()
+    return Response(prometheus_text(profiler.metrics.snapshot()),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,208 @@
+"""
+    inventorius.repository
+    ~~~~~~~~~~~~~~
+
+    Projection aware loading of data models.
+
+    Routes that only need to know a resource exists, or only read one or two
+    of its fields, should not fetch and convert the whole document:
+
+        if not bins.exists(id): ...
+        bin = bins.load(id, fields=[f"contents.{item_id}"])
+        bin.contents        # only holds item_id
+        bin.props           # raises UnloadedFieldError
+
+    PATCH handlers compile their validated payload into a single update:
+
+        batch = batches.patch(id, {"name": "resistors", "sku_id": None})
+
+    The async_ repositories load the same way with PyMongo's async api, for
+    lookups awaited together with async_db.async_database.gather.
+"""
+
+from pymongo import ReturnDocument
+
+from inventorius.data_models import (
+    Batch,
+    Bin,
+    DataField,
+    Mixture,
+    Sku,
+    StepInstance,
+    StepTemplate,
+    Subdoc,
+    UserData,
+    get_fields,
+)
+from inventorius.async_db import current_database
+from inventorius.db import db
+
+
+def compile_patch(model_type, payload):
+    """Turn a validated patch payload keyed by model field names into one
+    mongo update document.
+
+    None unsets a field, other values are converted with the field's
+    value_to_bson (or the subdoc model). The id field and keys that are not
+    stored fields are ignored.
+    """
+    sets = {}
+    unsets = {}
+    for key, value in payload.items():
+        field = getattr(model_type, key, None)
+        if not isinstance(field, (DataField, Subdoc)) or field.db_key in (None, "_id"):
+            continue
+        if value is None:
+            unsets[field.db_key] = ""
+        elif isinstance(field, Subdoc):
+            if isinstance(value, dict):
+                value = field.data_model_type(**value)
+            sets[field.db_key] = value.to_mongodb_doc()
+        else:
+            sets[field.db_key] = field.value_to_bson(value)
+
+    update = {}
+    if sets:
+        update["$set"] = sets
+    if unsets:
+        update["$unset"] = unsets
+    return update
+
+
+class Repository:
+    """Loads one DataModel type from one mongo collection.
+
+    `fields` are model field names, a dotted path ("contents.BIN1") loads
+    only part of that field. Excluding fields works the same way with
+    `exclude`. The id field is always loaded.
+    """
+
+    def __init__(self, collection_name, model_type):
+        self.collection_name = collection_name
+        self.model_type = model_type
+
+    @property
+    def collection(self):
+        return db[self.collection_name]
+
+    def db_key(self, field):
+        model_key, _, rest = field.partition(".")
+        db_key = getattr(self.model_type, model_key).db_key
+        return f"{db_key}.{rest}" if rest else db_key
+
+    def projection(self, fields=None, exclude=None):
+        if fields is not None:
+            return {"_id": 1, **{self.db_key(field): 1 for field in fields}}
+        if exclude:
+            return {self.db_key(field): 0 for field in exclude}
+        return None
+
+    def loaded_fields(self, fields=None, exclude=None):
+        model_fields = get_fields(self.model_type)
+        if fields is not None:
+            loaded = {field.partition(".")[0] for field in fields}
+            loaded.update(key for key in model_fields
+                          if getattr(self.model_type, key).db_key == "_id")
+            return loaded
+        # only whole fields are excluded, a dotted path leaves the field loaded
+        excluded = {field for field in exclude or [] if "." not in field}
+        return {key for key in model_fields if key not in excluded}
+
+    def exists(self, id, **filters):
+        return self.collection.find_one({"_id": id, **filters}, {"_id": 1}) is not None
+
+    def load(self, id, fields=None, exclude=None):
+        """Returns the model or None. Partial if fields or exclude are given."""
+        doc = self.collection.find_one(
+            {"_id": id}, self.projection(fields, exclude))
+        if fields is None and not exclude:
+            return self.model_type.from_mongodb_doc(doc)
+        return self.model_type.from_partial_mongodb_doc(
+            doc, self.loaded_fields(fields, exclude))
+
+    def patch(self, id, payload, fields=None, exclude=None, **filters):
+        """Apply a patch payload in one find_one_and_update.
+
+        Returns the updated model (partial if fields or exclude are given),
+        or None if there is no such document or it does not match `filters`.
+        """
+        update = compile_patch(self.model_type, payload)
+        projection = self.projection(fields, exclude)
+        if update:
+            doc = self.collection.find_one_and_update(
+                {"_id": id, **filters}, update, projection,
+                return_document=ReturnDocument.AFTER)
+        else:
+            doc = self.collection.find_one({"_id": id, **filters}, projection)
+        if fields is None and not exclude:
+            return self.model_type.from_mongodb_doc(doc)
+        return self.model_type.from_partial_mongodb_doc(
+            doc, self.loaded_fields(fields, exclude))
+
+    def find(self, filter, fields=None, exclude=None, **kwargs):
+        """Iterates over matching models, extra kwargs go to Collection.find."""
+        cursor = self.collection.find(
+            filter, self.projection(fields, exclude), **kwargs)
+        if fields is None and not exclude:
+            return (self.model_type.from_mongodb_doc(doc) for doc in cursor)
+        loaded = self.loaded_fields(fields, exclude)
+        return (self.model_type.from_partial_mongodb_doc(doc, loaded)
+                for doc in cursor)
+
+
+class AsyncRepository(Repository):
+    """Repository with coroutine lookups and patches, run by
+    AsyncDatabase.gather."""
+
+    @property
+    def collection(self):
+        return current_database.get()[self.collection_name]
+
+    async def exists(self, id, **filters):
+        return await self.collection.find_one({"_id": id, **filters}, {"_id": 1}) is not None
+
+    async def load(self, id, fields=None, exclude=None):
+        doc = await self.collection.find_one(
+            {"_id": id}, self.projection(fields, exclude))
+        if fields is None and not exclude:
+            return self.model_type.from_mongodb_doc(doc)
+        return self.model_type.from_partial_mongodb_doc(
+            doc, self.loaded_fields(fields, exclude))
+
+    async def find(self, filter, fields=None, exclude=None, **kwargs):
+        """List of matching models, extra kwargs go to Collection.find."""
+        docs = await self.collection.find(
+            filter, self.projection(fields, exclude), **kwargs).to_list()
+        if fields is None and not exclude:
+            return [self.model_type.from_mongodb_doc(doc) for doc in docs]
+        loaded = self.loaded_fields(fields, exclude)
+        return [self.model_type.from_partial_mongodb_doc(doc, loaded) for doc in docs]
+
+    async def patch(self, id, payload, fields=None, exclude=None, **filters):
+        """Same as Repository.patch."""
+        update = compile_patch(self.model_type, payload)
+        projection = self.projection(fields, exclude)
+        if update:
+            doc = await self.collection.find_one_and_update(
+                {"_id": id, **filters}, update, projection,
+                return_document=ReturnDocument.AFTER)
+        else:
+            doc = await self.collection.find_one({"_id": id, **filters}, projection)
+        if fields is None and not exclude:
+            return self.model_type.from_mongodb_doc(doc)
+        return self.model_type.from_partial_mongodb_doc(
+            doc, self.loaded_fields(fields, exclude))
+
+
+bins = Repository("bin", Bin)
+skus = Repository("sku", Sku)
+batches = Repository("batch", Batch)
+mixtures = Repository("mixture", Mixture)
+step_templates = Repository("step_template", StepTemplate)
+step_instances = Repository("step_instance", StepInstance)
+users = Repository("user", UserData)
+
+async_bins = AsyncRepository("bin", Bin)
+async_skus = AsyncRepository("sku", Sku)
+async_batches = AsyncRepository("batch", Batch)
+async_mixtures = AsyncRepository("mixture", Mixture)
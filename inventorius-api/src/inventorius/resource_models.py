@@ -1,4 +1,4 @@
-from flask import Response, url_for
+from flask import Response, has_request_context, request, url_for
 import json
 from flask_login import current_user
 from flask_login.utils import encode_cookie
@@ -15,6 +15,13 @@ from inventorius.data_models import (
     StepTemplate,
 )
 import inventorius.resource_operations as operations
+from inventorius.serialization import (
+    JSON_MIMETYPE,
+    blank_default,
+    dumps,
+    encode,
+    negotiate_mimetype,
+)
 
 # operation = {
 #   "rel": operation name (resource method),
@@ -30,6 +37,25 @@ class BlankEncoder(json.JSONEncoder):
         return {}
 
 
+def wants_operations():
+    """Bandwidth bound clients can leave out the operations with ?operations=false."""
+    return not (has_request_context() and request.args.get("operations") == "false")
+
+
+def negotiated_response(data, status_code=200, default=blank_default):
+    """Response encoded in the format picked from the Accept header (JSON by default)."""
+    mimetype = JSON_MIMETYPE
+    if has_request_context():
+        mimetype = negotiate_mimetype(request.accept_mimetypes)
+
+    resp = Response()
+    resp.status_code = status_code
+    resp.mimetype = mimetype
+    resp.data = encode(data, mimetype, default)
+    resp.vary.add("Accept")
+    return resp
+
+
 class HypermediaEndpoint:
     def __init__(self, resource_uri=None, state=None, operations=None):
         self.resource_uri = resource_uri
@@ -37,10 +63,6 @@ class HypermediaEndpoint:
         self.operations = operations
 
     def get_response(self, status_code=200, mimetype="application/json"):
-        resp = Response()
-        resp.status_code = status_code
-        resp.mimetype = mimetype
-
         data = {}
         if self.resource_uri is not None:
             data["Id"] = self.resource_uri
@@ -49,10 +71,16 @@ class HypermediaEndpoint:
                 data["state"] = self.state.to_dict(mask_default=True)
             else:
                 data["state"] = self.state
-        if self.operations is not None:
+        if self.operations is not None and wants_operations():
             data["operations"] = self.operations
 
-        resp.data = json.dumps(data, cls=BlankEncoder)
+        if mimetype == JSON_MIMETYPE:
+            return negotiated_response(data, status_code)
+
+        resp = Response()
+        resp.status_code = status_code
+        resp.mimetype = mimetype
+        resp.data = dumps(data)
         return resp
 
     def redirect_response(self, redirect=True):
@@ -61,14 +89,14 @@ class HypermediaEndpoint:
         resp = Response()
         resp.status_code = 200
         resp.mimetype = "application/json"
-        resp.data = json.dumps({"Id": self.resource_uri})
+        resp.data = dumps({"Id": self.resource_uri})
         return resp
 
     def status_response(self, status_message="ok", status_code=200):
         resp = Response()
         resp.status_code = status_code
         resp.mimetype = "application/json"
-        resp.data = json.dumps(
+        resp.data = dumps(
             {"Id": self.resource_uri, "status": status_message})
         return resp
 
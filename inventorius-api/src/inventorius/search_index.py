@@ -0,0 +1,303 @@
+"""
+    inventorius.search_index
+    ~~~~~~~~~~~~~~
+
+    Optional in-process search over skus and batches.
+
+    Catalogs that fit in memory can be searched without a round trip to
+    mongo. With SEARCH_INDEX_ENABLED (or INVENTORIUS_MEMORY_SEARCH=true) each
+    worker loads every sku and batch on its first request and keeps
+
+        - the models by id, for label lookups and results
+        - a code map, code -> code_index style entries
+        - a token map, word -> ids, standing in for the $text index (without
+          its stemming)
+        - a trie of words, ids and codes for prefix completion
+
+    It is refreshed from a change stream on the sku and batch collections.
+    A standalone mongod has no change streams, so then the search_changes
+    collection, written by the ResourceSaved and ResourceDeleted
+    subscribers below, is polled past the last seen ObjectId every
+    SEARCH_INDEX_POLL_INTERVAL seconds (search_changes is capped, see
+    db.get_mongo_client). The same subscribers maintain the code and prefix
+    index collections.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from inventorius.autocomplete import index_prefixes, resource_terms, unindex_prefixes, words
+from inventorius.code_index import code_entries, index_codes, unindex_codes
+from inventorius.data_models import Batch, Sku
+from inventorius.db import db
+from inventorius.events import ResourceDeleted, ResourceSaved, event_bus
+
+log = logging.getLogger(__name__)
+
+_model_types = {"sku": Sku, "batch": Batch}
+_kind_order = {"owned": 0, "associated": 1, "structured": 2}
+
+
+def _resource_type(resource_id):
+    return "sku" if resource_id.startswith("SKU") else "batch"
+
+
+# search_changes is written first, an index rebuild that renames its
+# collection over the one written here replays the change afterwards
+
+
+@event_bus.subscriber(ResourceSaved)
+def _index_saved_resource(event):
+    doc = db[event.resource_type].find_one({"_id": event.id})
+    if doc is None:
+        return _unindex_deleted_resource(ResourceDeleted(event.resource_type, event.id))
+    db.search_changes.insert_one({"resource_id": event.id})
+    model = _model_types[event.resource_type].from_mongodb_doc(doc)
+    index_codes(event.resource_type, model)
+    index_prefixes(event.resource_type, model)
+    if search_index.ready:
+        search_index.reload([event.id])
+
+
+@event_bus.subscriber(ResourceDeleted)
+def _unindex_deleted_resource(event):
+    db.search_changes.insert_one({"resource_id": event.id})
+    unindex_codes(event.id)
+    unindex_prefixes(event.id)
+    if search_index.ready:
+        search_index.discard(event.id)
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()
+
+
+class SearchIndex:
+    """Flask extension holding the in-memory index of one worker."""
+
+    def __init__(self, app=None):
+        self._lock = threading.RLock()
+        self.reset()
+        self._watermark = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SEARCH_INDEX_ENABLED",
+                              os.getenv("INVENTORIUS_MEMORY_SEARCH") == "true")
+        app.config.setdefault("SEARCH_INDEX_POLL_INTERVAL", 5)
+        self.app = app
+        app.extensions["search_index"] = self
+        if app.config["SEARCH_INDEX_ENABLED"]:
+            app.before_request(self._ensure_thread)
+
+    def _ensure_thread(self):
+        # started from the first request of each process, a thread started
+        # at import would only run in the uwsgi master, not its forked workers
+        if self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._pid != os.getpid():
+                self.reset()
+                self._watermark = None
+                self._thread = threading.Thread(
+                    target=self._run, name="search-index", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def reset(self):
+        """Empty the index, searches go to the database until the next build."""
+        with self._lock:
+            self._clear()
+            self.ready = False
+
+    def _clear(self):
+        self._models = {}
+        self._terms = {}
+        self._codes = defaultdict(list)
+        self._tokens = defaultdict(set)
+        self._trie = _TrieNode()
+
+    # building
+
+    def _add(self, resource_type, model):
+        self._models[model.id] = model
+        terms = resource_terms(model)
+        self._terms[model.id] = terms
+        for entry in code_entries(resource_type, model):
+            self._codes[entry["code"]].append(entry)
+        for token in words(getattr(model, "name", None)):
+            self._tokens[token].add(model.id)
+        for term in terms:
+            node = self._trie
+            for char in term:
+                node = node.children.setdefault(char, _TrieNode())
+            node.ids.add(model.id)
+
+    def _remove(self, resource_id):
+        model = self._models.pop(resource_id, None)
+        if model is None:
+            return
+        for entry in code_entries(_resource_type(resource_id), model):
+            remaining = [e for e in self._codes[entry["code"]]
+                         if e["resource_id"] != resource_id]
+            if remaining:
+                self._codes[entry["code"]] = remaining
+            else:
+                self._codes.pop(entry["code"], None)
+        for token in words(getattr(model, "name", None)):
+            self._tokens[token].discard(resource_id)
+            if not self._tokens[token]:
+                del self._tokens[token]
+        for term in self._terms.pop(resource_id, ()):
+            node = self._trie
+            for char in term:
+                node = node.children.get(char)
+                if node is None:
+                    break
+            else:
+                node.ids.discard(resource_id)
+
+    def build(self, database=None):
+        """Load every sku and batch, replacing the current contents."""
+        if database is None:
+            database = db
+        with self._lock:
+            self._clear()
+            for resource_type, model_type in _model_types.items():
+                for doc in database[resource_type].find():
+                    self._add(resource_type, model_type.from_mongodb_doc(doc))
+            self.ready = True
+
+    def reload(self, resource_ids, database=None):
+        """Refresh some resources from the database, dropping deleted ones."""
+        if database is None:
+            database = db
+        for resource_id in resource_ids:
+            resource_type = _resource_type(resource_id)
+            doc = database[resource_type].find_one({"_id": resource_id})
+            with self._lock:
+                self._remove(resource_id)
+                if doc is not None:
+                    self._add(resource_type, _model_types[resource_type].from_mongodb_doc(doc))
+
+    def discard(self, resource_id):
+        with self._lock:
+            self._remove(resource_id)
+
+    # refreshing
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                last = db.search_changes.find_one(sort=[("_id", -1)])
+                self._watermark = last and last["_id"]
+                self.build()
+            except PyMongoError:
+                log.exception("could not build the in-memory search index")
+                return
+            try:
+                self._watch()
+            except PyMongoError as e:
+                log.info("change streams unavailable (%s), polling search_changes", e)
+            self._poll()
+
+    def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(_model_types)}}}]
+        with db.watch(pipeline) as stream:
+            for change in stream:
+                self.reload([change["documentKey"]["_id"]])
+
+    def _poll(self):
+        interval = self.app.config["SEARCH_INDEX_POLL_INTERVAL"]
+        while True:
+            time.sleep(interval)
+            try:
+                self.poll_changes()
+            except PyMongoError:
+                log.exception("could not refresh the in-memory search index")
+
+    def poll_changes(self, database=None):
+        """Reload resources changed since the last poll."""
+        if database is None:
+            database = db
+        filter = {}
+        if self._watermark is not None:
+            # ObjectIds from different workers are only ordered to the second,
+            # re-reading a little overlap is cheap since reloading is idempotent
+            since = self._watermark.generation_time - timedelta(seconds=2)
+            filter = {"_id": {"$gt": ObjectId.from_datetime(since)}}
+        changes = list(database.search_changes.find(filter).sort("_id", 1))
+        if changes:
+            self._watermark = changes[-1]["_id"]
+            self.reload({change["resource_id"] for change in changes}, database)
+
+    # querying
+
+    def get(self, resource_id):
+        with self._lock:
+            return self._models.get(resource_id)
+
+    def all(self, resource_type):
+        model_type = _model_types[resource_type]
+        with self._lock:
+            return [model for model in self._models.values()
+                    if isinstance(model, model_type)]
+
+    def code_matches(self, code):
+        """Models with code, in the order of code_index.lookup_code."""
+        with self._lock:
+            entries = sorted(self._codes.get(code, ()), key=lambda entry: (
+                _kind_order[entry["kind"]], entry["type"] != "sku", entry["resource_id"]))
+            return [self._models[entry["resource_id"]] for entry in entries]
+
+    def text_matches(self, query):
+        """Skus then batches with a name word equal to any word of query.
+        Unlike $text, words are not stemmed."""
+        with self._lock:
+            ids = set()
+            for word in words(query):
+                ids.update(self._tokens.get(word, ()))
+            return sorted((self._models[id] for id in ids),
+                          key=lambda model: (not isinstance(model, Sku), model.id))
+
+    def complete(self, query, limit=10):
+        """Same results as autocomplete.complete, from the trie."""
+        query_words = words(query)
+        if not query_words:
+            return []
+        with self._lock:
+            matching = None
+            for word in query_words:
+                node = self._trie
+                for char in word:
+                    node = node.children.get(char)
+                    if node is None:
+                        return []
+                ids = set()
+                stack = [node]
+                while stack:
+                    node = stack.pop()
+                    ids.update(node.ids)
+                    stack.extend(node.children.values())
+                matching = ids if matching is None else matching & ids
+            return [{"id": id, "type": _resource_type(id),
+                     "label": getattr(self._models[id], "name", None) or ""}
+                    for id in sorted(matching)[:limit]]
+
+
+search_index = SearchIndex()
@@ -0,0 +1,227 @@
+"""
+    inventorius.serialization
+    ~~~~~~~~~~~~~~
+
+    Pluggable JSON encoding for api responses.
+
+    orjson or msgspec is used when installed, otherwise the stdlib json
+    module. Set INVENTORIUS_JSON_BACKEND to force a backend by name.
+
+    Clients may also ask for a compact binary encoding of the same data with
+    `Accept: application/msgpack` or `Accept: application/cbor` when the
+    msgpack or cbor2 packages are installed. Every format and backend writes
+    datetimes as ISO 8601 strings and quantities as numbers.
+"""
+
+import json
+import os
+from datetime import date
+from decimal import Decimal
+
+from bson.decimal128 import Decimal128
+
+from inventorius.data_models import DataModel, NonFinite, mark_nonfinite, quantity_to_number
+
+
+# written the same way by every format, see _plain_value
+_plain_types = (date, Decimal, Decimal128)
+
+
+def _plain_value(o):
+    """A datetime (or date) as its ISO 8601 string, a quantity as a number."""
+    if isinstance(o, date):
+        return o.isoformat()
+    return mark_nonfinite(quantity_to_number(o))
+
+
+def blank_default(o):
+    """Fallback used for hypermedia and problem responses.
+
+    Same output as BlankEncoder: unserializable values become an empty
+    object, except datetimes and quantities which every format writes as in
+    _plain_value.
+    """
+    if isinstance(o, _plain_types):
+        return _plain_value(o)
+    return {}
+
+
+def data_model_default(o):
+    """Fallback used for search and listing results.
+
+    Same output as DataModelJSONEncoder.
+    """
+    if isinstance(o, DataModel):
+        return o.to_json_dict()
+    if isinstance(o, _plain_types):
+        return _plain_value(o)
+    return {k: v for k, v in o.__dict__.items() if k != None}
+
+
+def _refusing_nonfinite(default):
+    """default, raising for the NonFinite floats orjson and msgspec hand to
+    it, their dumps then fall back to the stdlib, which writes Infinity and
+    NaN like it did before."""
+    def refuse(o):
+        if isinstance(o, NonFinite):
+            raise TypeError("non-finite float")
+        return default(o)
+    return refuse
+
+
+def _stdlib_backend():
+    def dumps(obj, default):
+        return json.dumps(obj, default=default)
+    return dumps
+
+
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj, default):
+        try:
+            data = orjson.dumps(obj, default=_refusing_nonfinite(default),
+                                option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # eg. integers wider than 64 bits or non-finite floats, let the
+            # stdlib deal with it
+            return json.dumps(obj, default=default)
+        return data
+    return dumps
+
+
+def _msgspec_backend():
+    import msgspec
+
+    # one encoder per fallback function, quantities are written as numbers
+    encoders = {}
+
+    def dumps(obj, default):
+        if default not in encoders:
+            encoders[default] = msgspec.json.Encoder(
+                enc_hook=_refusing_nonfinite(default), decimal_format="number")
+        try:
+            data = encoders[default].encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            return json.dumps(obj, default=default)
+        return data
+    return dumps
+
+
+# name -> factory returning dumps(obj, default). Factories raise ImportError
+# when their library is not installed. Order is the order of preference.
+backends = {
+    "orjson": _orjson_backend,
+    "msgspec": _msgspec_backend,
+    "json": _stdlib_backend,
+}
+
+_dumps = None
+
+
+def register_backend(name, factory, preferred=False):
+    """Add a serializer backend. A preferred backend is tried first."""
+    global _dumps
+    if preferred:
+        rest = {k: v for k, v in backends.items() if k != name}
+        backends.clear()
+        backends[name] = factory
+        backends.update(rest)
+    else:
+        backends[name] = factory
+    _dumps = None
+
+
+def get_backend():
+    """Returns the dumps function of the configured or first available backend."""
+    global _dumps
+    if _dumps is None:
+        requested = os.getenv("INVENTORIUS_JSON_BACKEND")
+        if requested:
+            _dumps = backends[requested]()
+        else:
+            for factory in backends.values():
+                try:
+                    _dumps = factory()
+                    break
+                except ImportError:
+                    continue
+    return _dumps
+
+
+def dumps(obj, default=blank_default):
+    """Serialize obj to JSON (str or bytes, both are valid Response.data)."""
+    return get_backend()(obj, default)
+
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+CBOR_MIMETYPE = "application/cbor"
+
+
+def _json_format():
+    return dumps
+
+
+def _msgpack_format():
+    import msgpack
+
+    def packb(obj, default):
+        return msgpack.packb(obj, default=default, use_bin_type=True)
+    return packb
+
+
+def _plain(obj):
+    """obj with datetimes and quantities replaced by _plain_value, cbor2
+    would write them with its own tags instead of calling default."""
+    if isinstance(obj, dict):
+        return {key: _plain(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(value) for value in obj]
+    if isinstance(obj, _plain_types):
+        return _plain_value(obj)
+    return obj
+
+
+def _cbor_format():
+    import cbor2
+
+    def cbor_dumps(obj, default):
+        def encode_default(encoder, value):
+            encoder.encode(_plain(default(value)))
+        return cbor2.dumps(_plain(obj), default=encode_default)
+    return cbor_dumps
+
+
+# mimetype -> factory returning encode(obj, default), raising ImportError
+# when the format's library is not installed. JSON must stay first, it is
+# the fallback when the Accept header does not match anything else.
+formats = {
+    JSON_MIMETYPE: _json_format,
+    MSGPACK_MIMETYPE: _msgpack_format,
+    CBOR_MIMETYPE: _cbor_format,
+}
+
+_encoders = {}
+
+
+def _encoder(mimetype):
+    if mimetype not in _encoders:
+        try:
+            _encoders[mimetype] = formats[mimetype]()
+        except ImportError:
+            _encoders[mimetype] = None
+    return _encoders[mimetype]
+
+
+def available_mimetypes():
+    return [mimetype for mimetype in formats if _encoder(mimetype) is not None]
+
+
+def negotiate_mimetype(accept_mimetypes):
+    """Pick a response mimetype from a werkzeug MIMEAccept, defaulting to JSON."""
+    return accept_mimetypes.best_match(available_mimetypes()) or JSON_MIMETYPE
+
+
+def encode(obj, mimetype=JSON_MIMETYPE, default=blank_default):
+    return _encoder(mimetype)(obj, default)
@@ -3,10 +3,12 @@ from voluptuous.error import MultipleInvalid
 from voluptuous.schema_builder import Required
 from inventorius.data_models import Sku, Bin, Batch, DataModelJSONEncoder as Encoder
 from inventorius.db import db
+from inventorius.events import ResourceDeleted, ResourceSaved, event_bus
+from inventorius.repository import batches, bins, skus
 from inventorius.util import admin_increment_code, check_code_list, no_cache
 from inventorius.validation import new_sku_schema, prefixed_id, sku_patch_schema
 import inventorius.util_error_responses as problem
-from inventorius.resource_models import SkuEndpoint
+from inventorius.resource_models import SkuEndpoint, negotiated_response
 
 from pymongo import TEXT
 
@@ -23,12 +25,13 @@ def skus_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    if db.sku.find_one({'_id': json['id']}):
+    if skus.exists(json['id']):
         return problem.duplicate_resource_response("id")
 
     sku = Sku.from_json(json)
     admin_increment_code("SKU", sku.id)
     db.sku.insert_one(sku.to_mongodb_doc())
+    event_bus.publish(ResourceSaved("sku", sku.id))
     # dbSku = Sku.from_mongodb_doc(db.sku.find_one({'id': sku.id}))
 
     # Add text index if not yet created
@@ -44,7 +47,7 @@ def skus_post():
 def sku_get(id):
     # detailed = request.args.get("details") == "true"
 
-    sku = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
+    sku = skus.load(id)
     if sku is None:
         return problem.missing_bin_response(id)
     return SkuEndpoint.from_sku(sku).get_response()
@@ -58,34 +61,18 @@ def sku_patch(id):
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
-    if not existing:
+    updated_sku = skus.patch(id, json, fields=[])
+    if not updated_sku:
         return problem.invalid_params_response(problem.missing_resource_param_error("id"))
-
-    if "owned_codes" in json:
-        db.sku.update_one({"_id": id},
-                          {"$set": {"owned_codes": json["owned_codes"]}})
-    if "associated_codes" in json:
-        db.sku.update_one({"_id": id},
-                          {"$set": {"associated_codes": json["associated_codes"]}})
-    if "name" in json:
-        db.sku.update_one({"_id": id},
-                          {"$set": {"name": json["name"]}})
-    if "props" in json:
-        db.sku.update_one({"_id": id},
-                          {"$set": {"props": json["props"]}})
-
-    updated_sku = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
+    event_bus.publish(ResourceSaved("sku", id))
     return SkuEndpoint.from_sku(updated_sku).updated_success_response()
 
 @ sku.route('/api/sku/<id>', methods=['DELETE'])
 def sku_delete(id):
-    existing = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
-
     resp = Response()
     resp.headers.add("Cache-Control", "no-cache")
 
-    if existing is None:
+    if not skus.exists(id):
         resp.status_code = 404
         resp.mimetype = "application/problem+json"
         resp.data = json.dumps({
@@ -113,7 +100,8 @@ def sku_delete(id):
         })
         return resp
 
-    db.sku.delete_one({"_id": existing.id})
+    db.sku.delete_one({"_id": id})
+    event_bus.publish(ResourceDeleted("sku", id))
     resp.status_code = 204
     return resp
 
@@ -122,8 +110,7 @@ def sku_delete(id):
 def sku_bins_get(id):
     resp = Response()
 
-    existing = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
-    if not existing:
+    if not skus.exists(id):
         resp.status_code = 404
         resp.mimetype = "application/problem+json"
         resp.data = json.dumps({
@@ -136,25 +123,20 @@ def sku_bins_get(id):
         })
         return resp
 
-    contained_by_bins = [Bin.from_mongodb_doc(bson) for bson in db.bin.find(
-        {f"contents.{id}": {"$exists": True}})]
+    contained_by_bins = bins.find(
+        {f"contents.{id}": {"$exists": True}}, fields=[f"contents.{id}"])
     locations = {bin.id: {id: bin.contents[id]} for bin in contained_by_bins}
 
-    resp.status_code = 200
-    resp.mimetype = "application/json"
-    resp.data = json.dumps({
+    return negotiated_response({
         "state": locations
     })
 
-    return resp
-
 
 @ sku.route('/api/sku/<id>/batches', methods=['GET'])
 def sku_batches_get(id):
     resp = Response()
 
-    existing = Sku.from_mongodb_doc(db.sku.find_one({"_id": id}))
-    if not existing:
+    if not skus.exists(id):
         resp.status_code = 404
         resp.mimetype = "application/problem+json"
         resp.data = json.dumps({
@@ -167,11 +149,7 @@ def sku_batches_get(id):
         })
         return resp
 
-    batches = [Batch.from_mongodb_doc(bson).id
-               for bson in db.batch.find({"sku_id": id})]
-    resp.mimetype = "application/json"
-    resp.data = json.dumps({
-        "state": batches
+    batch_ids = [batch.id for batch in batches.find({"sku_id": id}, fields=[])]
+    return negotiated_response({
+        "state": batch_ids
     })
-
-    return resp
@@ -9,12 +9,16 @@ from inventorius.data_models import (
     Mixture,
     StepInstance,
     StepTemplate,
+    as_quantity,
     mixture_components_to_bson,
     quantity_to_bson,
 )
 from inventorius.db import db
-from inventorius.mixture import apply_draw
+from inventorius.events import ResourceSaved, event_bus
+from inventorius.repository import batches, bins, mixtures, step_instances, step_templates
+from inventorius.mixture import apply_draw, record_audit
 from inventorius.resource_models import StepInstanceEndpoint
+from inventorius.stock import adjust_bin_contents
 from inventorius.util import admin_increment_code, no_cache
 import inventorius.util_error_responses as problem
 from inventorius.validation import (
@@ -49,16 +53,16 @@ def _prepare_consumption_plan(
     mixture_cache,
 ):
     resource_id = item["resource_id"]
-    quantity = float(item["quantity"])
+    quantity = as_quantity(item["quantity"])
     bin_id = item["bin_id"]
 
     bin_state = bin_cache.get(bin_id)
     if bin_state is None:
-        bin_state = Bin.from_mongodb_doc(db.bin.find_one({"_id": bin_id}))
+        bin_state = bins.load(bin_id, fields=["contents"])
         if bin_state is None:
             return problem.missing_bin_response(bin_id)
         bin_cache[bin_id] = bin_state
-    available_in_bin = float(bin_state.contents.get(resource_id, 0))
+    available_in_bin = as_quantity(bin_state.contents.get(resource_id, 0))
     if available_in_bin < quantity:
         return problem.move_insufficient_quantity(
             name="quantity", available=available_in_bin, requested=quantity
@@ -67,14 +71,12 @@ def _prepare_consumption_plan(
     if resource_id.startswith("BAT"):
         batch_state = batch_cache.get(resource_id)
         if batch_state is None:
-            batch_state = Batch.from_mongodb_doc(
-                db.batch.find_one({"_id": resource_id})
-            )
+            batch_state = batches.load(resource_id, fields=["qty_remaining"])
             if batch_state is None:
                 return problem.missing_batch_response(resource_id)
             batch_cache[resource_id] = batch_state
 
-        remaining = float(batch_state.qty_remaining or 0)
+        remaining = as_quantity(batch_state.qty_remaining or 0)
         if remaining < quantity:
             error = MultipleInvalid(
                 [Invalid("requested quantity exceeds batch", path=["quantity"])]
@@ -106,9 +108,7 @@ def _prepare_consumption_plan(
     if resource_id.startswith("MIX"):
         mixture_state = mixture_cache.get(resource_id)
         if mixture_state is None:
-            mixture_state = Mixture.from_mongodb_doc(
-                db.mixture.find_one({"_id": resource_id})
-            )
+            mixture_state = mixtures.load(resource_id, exclude=["audit"])
             if mixture_state is None:
                 return problem.missing_mixture_response(resource_id)
             mixture_cache[resource_id] = mixture_state
@@ -119,7 +119,7 @@ def _prepare_consumption_plan(
             )
             return problem.invalid_params_response(error)
 
-        total_available = float(mixture_state.qty_total or 0)
+        total_available = as_quantity(mixture_state.qty_total or 0)
         if total_available < quantity:
             error = MultipleInvalid(
                 [Invalid("requested quantity exceeds mixture total", path=["quantity"])]
@@ -157,7 +157,7 @@ def _prepare_consumption_plan(
             "bin_id": bin_id,
             "quantity": quantity,
             "components": extracted,
-            "remaining_qty": float(updated_mixture.qty_total or 0),
+            "remaining_qty": as_quantity(updated_mixture.qty_total or 0),
         }
         return plan, record
 
@@ -169,18 +169,17 @@ def _prepare_consumption_plan(
 
 def _prepare_production_plan(instance_id, item, bin_cache):
     batch_id = item["batch_id"]
-    quantity = float(item["quantity"])
+    quantity = as_quantity(item["quantity"])
     bin_id = item.get("bin_id")
 
-    existing = Batch.from_mongodb_doc(db.batch.find_one({"_id": batch_id}))
-    if existing is not None:
+    if batches.exists(batch_id):
         return problem.duplicate_resource_response("batch_id")
 
     bin_state = None
     if bin_id is not None:
         bin_state = bin_cache.get(bin_id)
         if bin_state is None:
-            bin_state = Bin.from_mongodb_doc(db.bin.find_one({"_id": bin_id}))
+            bin_state = bins.load(bin_id, fields=["contents"])
             if bin_state is None:
                 return problem.missing_bin_response(bin_id)
             bin_cache[bin_id] = bin_state
@@ -202,7 +201,7 @@ def _prepare_production_plan(instance_id, item, bin_cache):
     batch_model = Batch.from_json(batch_payload)
 
     if bin_state is not None:
-        current = float(bin_state.contents.get(batch_id, 0))
+        current = as_quantity(bin_state.contents.get(batch_id, 0))
         bin_state.contents[batch_id] = current + quantity
 
     plan = {
@@ -237,14 +236,7 @@ def _apply_consumption_plan(plan):
             {"_id": plan["batch_id"]},
             {"$set": {"qty_remaining": quantity_to_bson(plan["new_qty_remaining"])}},
         )
-        db.bin.update_one(
-            {"_id": plan["bin_id"]},
-            {"$inc": {f"contents.{plan['batch_id']}": -plan["quantity"]}},
-        )
-        db.bin.update_one(
-            {"_id": plan["bin_id"], f"contents.{plan['batch_id']}": 0},
-            {"$unset": {f"contents.{plan['batch_id']}": ""}},
-        )
+        adjust_bin_contents(plan["bin_id"], plan["batch_id"], -plan["quantity"])
         return
 
     if plan["type"] == "mixture":
@@ -256,30 +248,23 @@ def _apply_consumption_plan(plan):
                     "components": mixture_components_to_bson(mixture_state.components),
                     "qty_total": quantity_to_bson(mixture_state.qty_total),
                 },
-                "$push": {"audit": plan["audit_event"]},
             },
         )
-        db.bin.update_one(
-            {"_id": plan["bin_id"]},
-            {"$inc": {f"contents.{mixture_state.mix_id}": -plan["quantity"]}},
-        )
-        db.bin.update_one(
-            {"_id": plan["bin_id"], f"contents.{mixture_state.mix_id}": 0},
-            {"$unset": {f"contents.{mixture_state.mix_id}": ""}},
-        )
+        record_audit(mixture_state.mix_id, plan["audit_event"])
+        adjust_bin_contents(plan["bin_id"], mixture_state.mix_id, -plan["quantity"],
+                            sku_id=mixture_state.sku_id)
 
 
 def _apply_production_plan(plan):
     batch_model = plan["batch"]
     db.batch.insert_one(batch_model.to_mongodb_doc())
+    event_bus.publish(ResourceSaved("batch", batch_model.id))
     admin_increment_code("BAT", batch_model.id)
 
     bin_id = plan.get("bin_id")
     if bin_id:
-        db.bin.update_one(
-            {"_id": bin_id},
-            {"$inc": {f"contents.{batch_model.id}": plan["quantity"]}},
-        )
+        adjust_bin_contents(bin_id, batch_model.id, plan["quantity"],
+                            sku_id=batch_model.sku_id)
 
 
 @step_instance.route("/api/step-instances", methods=["POST"])
@@ -290,15 +275,10 @@ def step_instances_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing = StepInstance.from_mongodb_doc(
-        db.step_instance.find_one({"_id": payload["instance_id"]})
-    )
-    if existing is not None:
+    if step_instances.exists(payload["instance_id"]):
         return problem.duplicate_resource_response("instance_id")
 
-    template = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": payload["template_id"]})
-    )
+    template = step_templates.load(payload["template_id"])
     if template is None:
         return problem.missing_step_template_response(payload["template_id"])
 
@@ -361,9 +341,7 @@ def step_instances_post():
 
 @step_instance.route("/api/step-instance/<instance_id>", methods=["GET"])
 def step_instance_get(instance_id):
-    instance = StepInstance.from_mongodb_doc(
-        db.step_instance.find_one({"_id": instance_id})
-    )
+    instance = step_instances.load(instance_id)
     if instance is None:
         return problem.missing_step_instance_response(instance_id)
     return StepInstanceEndpoint.from_instance(instance).get_response()
@@ -379,43 +357,16 @@ def step_instance_patch(instance_id):
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    instance = StepInstance.from_mongodb_doc(
-        db.step_instance.find_one({"_id": instance_id})
-    )
-    if instance is None:
+    if not step_instances.patch(instance_id, payload, fields=[]):
         return problem.missing_step_instance_response(instance_id)
 
-    sets = {}
-    unsets = {}
-    for field in ("operator", "notes", "metadata"):
-        if field in payload:
-            value = payload[field]
-            if value is None:
-                unsets[field] = ""
-            else:
-                sets[field] = value
-
-    updates = {}
-    if sets:
-        updates["$set"] = sets
-    if unsets:
-        updates["$unset"] = unsets
-    if updates:
-        db.step_instance.update_one({"_id": instance_id}, updates)
-
-    refreshed = StepInstance.from_mongodb_doc(
-        db.step_instance.find_one({"_id": instance_id})
-    )
-    return StepInstanceEndpoint.from_instance(refreshed).redirect_response(False)
+    return StepInstanceEndpoint.from_id(instance_id).redirect_response(False)
 
 
 @step_instance.route("/api/step-instance/<instance_id>", methods=["DELETE"])
 @no_cache
 def step_instance_delete(instance_id):
-    instance = StepInstance.from_mongodb_doc(
-        db.step_instance.find_one({"_id": instance_id})
-    )
-    if instance is None:
+    if not step_instances.exists(instance_id):
         return problem.missing_step_instance_response(instance_id)
 
     db.step_instance.delete_one({"_id": instance_id})
@@ -424,4 +375,4 @@ def step_instance_delete(instance_id):
         {"$unset": {"produced_by_instance": ""}},
     )
 
-    return StepInstanceEndpoint.from_instance(instance).deleted_success_response()
+    return StepInstanceEndpoint.from_id(instance_id).deleted_success_response()
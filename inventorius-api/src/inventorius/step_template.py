@@ -4,6 +4,7 @@ from voluptuous.error import MultipleInvalid
 
 from inventorius.data_models import StepTemplate
 from inventorius.db import db
+from inventorius.repository import step_templates
 from inventorius.resource_models import StepTemplateEndpoint
 from inventorius.util import no_cache
 import inventorius.util_error_responses as problem
@@ -25,10 +26,7 @@ def step_templates_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": payload["template_id"]})
-    )
-    if existing is not None:
+    if step_templates.exists(payload["template_id"]):
         return problem.duplicate_resource_response("template_id")
 
     template = StepTemplate(
@@ -46,9 +44,7 @@ def step_templates_post():
 
 @step_template.route("/api/step-template/<template_id>", methods=["GET"])
 def step_template_get(template_id):
-    template = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": template_id})
-    )
+    template = step_templates.load(template_id)
     if template is None:
         return problem.missing_step_template_response(template_id)
     return StepTemplateEndpoint.from_template(template).get_response()
@@ -64,42 +60,17 @@ def step_template_patch(template_id):
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    template = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": template_id})
-    )
-    if template is None:
+    refreshed = step_templates.patch(template_id, payload, fields=[])
+    if refreshed is None:
         return problem.missing_step_template_response(template_id)
 
-    sets = {}
-    unsets = {}
-    for field in ("name", "description", "inputs", "outputs", "metadata"):
-        if field in payload:
-            value = payload[field]
-            if value is None:
-                unsets[field] = ""
-            else:
-                sets[field] = value
-
-    updates = {}
-    if sets:
-        updates["$set"] = sets
-    if unsets:
-        updates["$unset"] = unsets
-    if updates:
-        db.step_template.update_one({"_id": template_id}, updates)
-
-    refreshed = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": template_id})
-    )
     return StepTemplateEndpoint.from_template(refreshed).redirect_response(False)
 
 
 @step_template.route("/api/step-template/<template_id>", methods=["DELETE"])
 @no_cache
 def step_template_delete(template_id):
-    template = StepTemplate.from_mongodb_doc(
-        db.step_template.find_one({"_id": template_id})
-    )
+    template = step_templates.load(template_id)
     if template is None:
         return problem.missing_step_template_response(template_id)
 
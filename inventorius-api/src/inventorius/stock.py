@@ -0,0 +1,282 @@
+"""
+    inventorius.stock
+    ~~~~~~~~~~~~~~
+
+    On hand stock totals.
+
+    Every change to bin contents goes through adjust_bin_contents, which
+    publishes an event that keeps the stock_summary collection up to date:
+
+        {"_id": "BAT000001", "kind": "item", "sku_id": "SKU000001",
+         "total": 12, "bins": {"BIN000001": 12}}
+        {"_id": "SKU000001", "kind": "item", "sku_id": "SKU000001",
+         "total": 3, "bins": {"BIN000002": 3}, "sku_total": 15}
+        {"_id": "BIN000001", "kind": "bin", "total": 12}
+
+    `sku_total` counts everything attributed to a sku, directly or through
+    its batches and mixtures. rebuild_stock_summary recomputes the collection
+    from the bins with an aggregation pipeline, it is run periodically
+    (`flask --app inventorius stock rebuild-summary`) to correct drift, eg.
+    after a batch is moved to another sku. The subscribers also record the
+    items and bins they touch in the capped stock_changes collection, which
+    lets a rebuild recompute whatever changed while it ran.
+"""
+
+from flask import Blueprint, url_for
+from pymongo import UpdateOne
+
+from inventorius.code_index import changes_watermark
+from inventorius.data_models import as_quantity, quantity_to_number
+from inventorius.db import db
+from inventorius.events import BinContentsChanged, BinDeleted, event_bus
+from inventorius.jobs import job
+from inventorius.repository import batches, bins, mixtures, skus
+from inventorius.resource_models import HypermediaEndpoint
+import inventorius.util_error_responses as problem
+
+stock = Blueprint("stock", __name__)
+
+
+def sku_of(item_id):
+    """The sku a bin item counts toward, or None."""
+    if item_id.startswith("SKU"):
+        return item_id
+    if item_id.startswith("BAT"):
+        doc = db.batch.find_one({"_id": item_id}, {"sku_id": 1})
+    elif item_id.startswith("MIX"):
+        doc = db.mixture.find_one({"_id": item_id}, {"sku_id": 1})
+    else:
+        return None
+    return (doc or {}).get("sku_id")
+
+
+def _summary_updates(bin_id, item_id, quantity, sku_id):
+    item_update = {"$inc": {"total": quantity, f"bins.{bin_id}": quantity},
+                   "$set": {"kind": "item"}}
+    if sku_id:
+        item_update["$set"]["sku_id"] = sku_id
+
+    updates = [
+        UpdateOne({"_id": item_id}, item_update, upsert=True),
+        UpdateOne({"_id": item_id, f"bins.{bin_id}": 0},
+                  {"$unset": {f"bins.{bin_id}": ""}}),
+        UpdateOne({"_id": bin_id},
+                  {"$inc": {"total": quantity}, "$set": {"kind": "bin"}},
+                  upsert=True),
+    ]
+    if sku_id:
+        updates.append(UpdateOne(
+            {"_id": sku_id},
+            {"$inc": {"sku_total": quantity},
+             "$set": {"kind": "item", "sku_id": sku_id}},
+            upsert=True))
+    return updates
+
+
+def adjust_bin_contents(bin_id, item_id, delta, sku_id=None):
+    """Add `delta` (negative to remove) of item_id to a bin.
+
+    Empty entries are removed from the bin. The stock summary is updated by
+    a BinContentsChanged subscriber, pass sku_id when it is already known to
+    save it a lookup.
+    """
+    quantity = quantity_to_number(as_quantity(delta))
+    db.bin.update_one({"_id": bin_id},
+                      {"$inc": {f"contents.{item_id}": quantity}})
+    db.bin.update_one({"_id": bin_id, f"contents.{item_id}": 0},
+                      {"$unset": {f"contents.{item_id}": ""}})
+    event_bus.publish(BinContentsChanged(bin_id, item_id, quantity, sku_id))
+
+
+def remove_bin(bin_id, contents):
+    """Publish the deletion of a bin that held `contents`."""
+    event_bus.publish(BinDeleted(bin_id, dict(contents)))
+
+
+# stock_changes is written first, a rebuild that renames its collection
+# over the one written here recomputes the change afterwards
+
+
+@event_bus.subscriber(BinContentsChanged)
+def _summarize_contents_change(event):
+    db.stock_changes.insert_one({"bin_id": event.bin_id, "item_ids": [event.item_id]})
+    sku_id = event.sku_id if event.sku_id is not None else sku_of(event.item_id)
+    db.stock_summary.bulk_write(
+        _summary_updates(event.bin_id, event.item_id, event.quantity, sku_id),
+        ordered=True)
+
+
+@event_bus.subscriber(BinDeleted)
+def _summarize_bin_deletion(event):
+    db.stock_changes.insert_one({"bin_id": event.bin_id, "item_ids": list(event.contents)})
+    updates = []
+    for item_id, quantity in event.contents.items():
+        quantity = quantity_to_number(as_quantity(quantity))
+        updates.extend(_summary_updates(event.bin_id, item_id, -quantity, sku_of(item_id)))
+    if updates:
+        db.stock_summary.bulk_write(updates, ordered=True)
+    db.stock_summary.delete_one({"_id": event.bin_id})
+
+
+def summarize_items(database, item_ids=None):
+    """Per item totals computed from the bins, in one aggregation. All items
+    unless item_ids is given."""
+    match = {"contents.v": {"$ne": 0}}
+    if item_ids is not None:
+        match["contents.k"] = {"$in": list(item_ids)}
+    pipeline = [
+        {"$project": {"contents": {"$objectToArray": "$contents"}}},
+        {"$unwind": "$contents"},
+        {"$match": match},
+        {"$group": {
+            "_id": "$contents.k",
+            "total": {"$sum": "$contents.v"},
+            "bins": {"$push": {"k": "$_id", "v": "$contents.v"}},
+        }},
+        {"$lookup": {"from": "batch", "localField": "_id",
+                     "foreignField": "_id", "as": "batch"}},
+        {"$lookup": {"from": "mixture", "localField": "_id",
+                     "foreignField": "_id", "as": "mixture"}},
+        {"$project": {
+            "total": 1,
+            "bins": 1,
+            "batch_sku": {"$arrayElemAt": ["$batch.sku_id", 0]},
+            "mixture_sku": {"$arrayElemAt": ["$mixture.sku_id", 0]},
+        }},
+    ]
+    for doc in database.bin.aggregate(pipeline):
+        item_id = doc["_id"]
+        if item_id.startswith("SKU"):
+            sku_id = item_id
+        else:
+            sku_id = doc.get("batch_sku") or doc.get("mixture_sku")
+        item = {
+            "_id": item_id,
+            "kind": "item",
+            "total": doc["total"],
+            "bins": {entry["k"]: entry["v"] for entry in doc["bins"]},
+        }
+        if sku_id:
+            item["sku_id"] = sku_id
+        yield item
+
+
+def _resummarize(summary, since, database):
+    """Recompute the entries of `summary` touched by stock_changes since the
+    ObjectId `since`, from the current bin contents."""
+    item_ids = set()
+    bin_ids = set()
+    for change in database.stock_changes.find({"_id": {"$gte": since}}):
+        bin_ids.add(change["bin_id"])
+        item_ids.update(change["item_ids"])
+    if not item_ids and not bin_ids:
+        return
+
+    # the sku an item counted toward before, in case it moved to another one
+    sku_ids = {doc["sku_id"] for doc in summary.find(
+        {"_id": {"$in": list(item_ids)}, "sku_id": {"$exists": True}}, {"sku_id": 1})}
+    items = {item["_id"]: item for item in summarize_items(database, item_ids)}
+    for item_id in item_ids:
+        item = items.get(item_id, {"total": 0, "bins": {}})
+        update = {"$set": {"kind": "item", "total": item["total"], "bins": item["bins"]}}
+        if item.get("sku_id"):
+            update["$set"]["sku_id"] = item["sku_id"]
+            sku_ids.add(item["sku_id"])
+        summary.update_one({"_id": item_id}, update, upsert=True)
+    for sku_id in sku_ids:
+        sku_total = sum(doc.get("total", 0) for doc in summary.find(
+            {"kind": "item", "sku_id": sku_id}, {"total": 1}))
+        summary.update_one({"_id": sku_id},
+                           {"$set": {"kind": "item", "sku_id": sku_id, "sku_total": sku_total}},
+                           upsert=True)
+
+    contents = {doc["_id"]: doc.get("contents") or {}
+                for doc in database.bin.find({"_id": {"$in": list(bin_ids)}}, {"contents": 1})}
+    for bin_id in bin_ids:
+        if bin_id in contents:
+            total = sum(quantity_to_number(as_quantity(quantity))
+                        for quantity in contents[bin_id].values())
+            summary.update_one({"_id": bin_id},
+                               {"$set": {"kind": "bin", "total": total}}, upsert=True)
+        else:
+            summary.delete_one({"_id": bin_id})
+
+
+def rebuild_stock_summary(database=None):
+    """Recompute the whole stock_summary collection from the bins.
+
+    The new summary is written to a scratch collection and renamed over the
+    old one, so readers never see a half built summary. Entries adjusted
+    while the rebuild ran are recomputed in the scratch collection before
+    the rename, and once more in the live one for adjustments made since.
+    """
+    if database is None:
+        database = db
+    since = changes_watermark()
+    summary = {}
+    bin_totals = {}
+    for item in summarize_items(database):
+        summary[item["_id"]] = {**summary.get(item["_id"], {}), **item}
+        sku_id = item.get("sku_id")
+        if sku_id:
+            sku_doc = summary.setdefault(
+                sku_id, {"_id": sku_id, "kind": "item", "sku_id": sku_id})
+            sku_doc["sku_total"] = sku_doc.get("sku_total", 0) + item["total"]
+        for bin_id, quantity in item["bins"].items():
+            bin_totals[bin_id] = bin_totals.get(bin_id, 0) + quantity
+    for bin_id, total in bin_totals.items():
+        summary[bin_id] = {"_id": bin_id, "kind": "bin", "total": total}
+
+    scratch = database.stock_summary_rebuild
+    scratch.drop()
+    if summary:
+        scratch.insert_many(list(summary.values()))
+    _resummarize(scratch, since, database)
+    if scratch.estimated_document_count():
+        scratch.rename("stock_summary", dropTarget=True)
+    else:
+        database.stock_summary.delete_many({})
+    _resummarize(database.stock_summary, since, database)
+    return len(summary)
+
+
+@job("rebuild-stock-summary")
+def rebuild_stock_summary_job(job):
+    return {"entries": rebuild_stock_summary()}
+
+
+@stock.cli.command("rebuild-summary")
+def rebuild_summary_command():
+    """Recompute stock totals from bin contents."""
+    count = rebuild_stock_summary()
+    print(f"rebuilt stock summary with {count} entries")
+
+
+_resources = {
+    "SKU": (skus, problem.missing_sku_response),
+    "BAT": (batches, problem.missing_batch_response),
+    "MIX": (mixtures, problem.missing_mixture_response),
+    "BIN": (bins, problem.missing_bin_response),
+}
+
+
+@stock.route("/api/stock/<id>", methods=["GET"])
+def stock_get(id):
+    doc = db.stock_summary.find_one({"_id": id})
+    if doc is None:
+        # nothing stocked yet, only worth a second lookup on this path
+        if id[:3] not in _resources:
+            return problem.missing_resource_response(url_for("stock.stock_get", id=id))
+        repository, missing_response = _resources[id[:3]]
+        if not repository.exists(id):
+            return missing_response(id)
+        doc = {}
+
+    state = {"id": id, "total": doc.get("total", 0)}
+    if id.startswith("SKU"):
+        state["sku_total"] = doc.get("sku_total", 0)
+    if not id.startswith("BIN"):
+        state["sku_id"] = doc.get("sku_id", id if id.startswith("SKU") else None)
+        state["bins"] = doc.get("bins", {})
+
+    return HypermediaEndpoint(url_for("stock.stock_get", id=id), state).get_response()
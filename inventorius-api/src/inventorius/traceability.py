@@ -8,6 +8,7 @@ from voluptuous.error import MultipleInvalid
 
 from inventorius.data_models import Batch, StepInstance
 from inventorius.db import db
+from inventorius.jobs import accepted_response, job, job_runner
 from inventorius.util import no_cache
 import inventorius.util_error_responses as problem
 from inventorius.validation import traceability_request_schema
@@ -220,23 +221,15 @@ def _initial_quantity(service: TraceabilityService, batch: Batch) -> float:
     return float(batch.qty_remaining or 0.0)
 
 
-@traceability.route("/api/traceability", methods=["POST"])
-@no_cache
-def traceability_post():
-    try:
-        payload = traceability_request_schema(request.json or {})
-    except MultipleInvalid as e:
-        return problem.invalid_params_response(e)
-
-    batch_ids = payload.get("batch_ids", [])
-    step_instance_ids = payload.get("step_instance_ids", [])
-
-    service = TraceabilityService(db)
+def _seed(service: TraceabilityService, batch_ids, step_instance_ids):
+    """Seed the service with the queried batches and step instances.
 
+    Returns ("batch", id) or ("step_instance", id) for a missing resource.
+    """
     for batch_id in batch_ids:
         batch = service.get_batch(batch_id)
         if batch is None:
-            return problem.missing_batch_response(batch_id)
+            return "batch", batch_id
         quantity = _initial_quantity(service, batch)
         if quantity <= 0:
             continue
@@ -245,16 +238,17 @@ def traceability_post():
     for instance_id in step_instance_ids:
         step = service.get_step(instance_id)
         if step is None:
-            return problem.missing_step_instance_response(instance_id)
+            return "step_instance", instance_id
         for produced in step.produced or []:
             batch_id = produced.get("batch_id")
             quantity = float(produced.get("quantity") or 0.0)
             if batch_id and quantity > 0:
                 service.seed_batch(batch_id, quantity)
+    return None
 
-    service.run()
 
-    response_payload = {
+def _traceability_payload(service: TraceabilityService, batch_ids, step_instance_ids):
+    return {
         "query": {
             "batch_ids": batch_ids,
             "step_instance_ids": step_instance_ids,
@@ -262,4 +256,42 @@ def traceability_post():
         "inputs": service.results(),
     }
 
-    return jsonify(response_payload)
+
+@job("traceability", params_schema=traceability_request_schema)
+def traceability_job(job, batch_ids=(), step_instance_ids=()):
+    service = TraceabilityService(db)
+    missing = _seed(service, batch_ids, step_instance_ids)
+    if missing is not None:
+        raise LookupError(f"missing {missing[0]} {missing[1]}")
+    service.run()
+    return _traceability_payload(service, batch_ids, step_instance_ids)
+
+
+@traceability.route("/api/traceability", methods=["POST"])
+@no_cache
+def traceability_post():
+    try:
+        payload = traceability_request_schema(request.json or {})
+    except MultipleInvalid as e:
+        return problem.invalid_params_response(e)
+
+    batch_ids = payload.get("batch_ids", [])
+    step_instance_ids = payload.get("step_instance_ids", [])
+
+    # large traceability runs can be handed to the job runner
+    if request.args.get("async") == "true":
+        job_id = job_runner.enqueue("traceability", {
+            "batch_ids": batch_ids, "step_instance_ids": step_instance_ids})
+        return accepted_response(job_id)
+
+    service = TraceabilityService(db)
+    missing = _seed(service, batch_ids, step_instance_ids)
+    if missing is not None:
+        kind, id = missing
+        if kind == "batch":
+            return problem.missing_batch_response(id)
+        return problem.missing_step_instance_response(id)
+
+    service.run()
+
+    return jsonify(_traceability_payload(service, batch_ids, step_instance_ids))
@@ -1,24 +1,28 @@
-from flask import Blueprint, request, Response, url_for, session, make_response, current_app, app
+from flask import Blueprint, request, Response, url_for, session, make_response, current_app, app, g
 from flask.ctx import after_this_request
 import flask_login
 from flask_login import current_user
 from flask_principal import Permission, UserNeed, identity_changed, Identity, AnonymousIdentity, identity_loaded
 from json import dumps
-import os
 import hashlib
 import random
 import time
 import base64
-from voluptuous import MultipleInvalid
+from collections import OrderedDict
+from threading import Lock
+from voluptuous import Invalid, MultipleInvalid
 from werkzeug.wrappers import response
 
 from inventorius.data_models import Batch, Bin, Sku, DataModelJSONEncoder as Encoder, UserData
 from inventorius.db import db
+from inventorius.device_tokens import issue_token, revoke_tokens, token_state, token_user_data
+from inventorius.passwords import PasswordHasherBusy, login_throttle, needs_rehash, password_hasher
+from inventorius.repository import users
 from inventorius.util import admin_increment_code, check_code_list, login_manager, no_cache, principals, admin_permission
 import inventorius.util_error_responses as problem
 import inventorius.util_success_responses as success
-from inventorius.validation import new_user_schema, user_patch_schema, login_request_schema
-from inventorius.resource_models import PrivateProfile, Profile
+from inventorius.validation import new_device_token_schema, new_user_schema, user_patch_schema, login_request_schema
+from inventorius.resource_models import HypermediaEndpoint, PrivateProfile, Profile
 
 user = Blueprint("user", __name__)
 
@@ -46,13 +50,76 @@ class User:
         return self.valid_shadow_id
 
 
+# seconds a loaded user is reused, a change made through another worker can
+# take this long to be seen (overridden by the USER_CACHE_TTL config)
+USER_CACHE_TTL = 30
+USER_CACHE_SIZE = 1024
+
+
+class UserCache:
+    """Short lived cache of session users keyed by shadow_id.
+
+    Entries are dropped when the user changes (see invalidate), expire after
+    USER_CACHE_TTL seconds and the least recently used are evicted beyond
+    USER_CACHE_SIZE entries.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, shadow_id):
+        with self._lock:
+            entry = self._entries.get(shadow_id)
+            if entry is None:
+                return None
+            expires, user_data = entry
+            if expires < time.monotonic():
+                del self._entries[shadow_id]
+                return None
+            self._entries.move_to_end(shadow_id)
+            return user_data
+
+    def put(self, shadow_id, user_data):
+        ttl = current_app.config.get("USER_CACHE_TTL", USER_CACHE_TTL)
+        size = current_app.config.get("USER_CACHE_SIZE", USER_CACHE_SIZE)
+        if not ttl or not size:
+            return
+        with self._lock:
+            self._entries[shadow_id] = (time.monotonic() + ttl, user_data)
+            self._entries.move_to_end(shadow_id)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, fixed_id):
+        with self._lock:
+            for shadow_id, (_, user_data) in list(self._entries.items()):
+                if user_data.fixed_id == fixed_id:
+                    del self._entries[shadow_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
 @login_manager.user_loader
 def load_user(shadow_id):
-    user_data = UserData.from_mongodb_doc(
-        db.user.find_one({"shadow_id": shadow_id}))
+    user_data = user_cache.get(shadow_id)
+    if user_data is None:
+        # password fields are only needed to log in, which loads the user itself
+        user_data = next(users.find({"shadow_id": shadow_id},
+                                    exclude=["password_hash", "password_salt"]), None)
+        if user_data:
+            user_cache.put(shadow_id, user_data)
     if user_data:
-        identity_changed.send(current_app._get_current_object(),
-                              identity=Identity(user_data.fixed_id))
+        # principal already loaded this identity from the session, sending it
+        # again would run identity_loaded twice on every request
+        if session.get("identity.id") != user_data.fixed_id:
+            identity_changed.send(current_app._get_current_object(),
+                                  identity=Identity(user_data.fixed_id))
         return User.from_user_data(user_data)
     else:
         session.pop("identity.name", None)
@@ -62,6 +129,15 @@ def load_user(shadow_id):
         return None
 
 
+@login_manager.request_loader
+def load_device_user(request):
+    # the bearer token was already checked by device_tokens before the request
+    claims = g.get("device_token")
+    if claims is None:
+        return None
+    return User.from_user_data(token_user_data(claims))
+
+
 def on_identity_loaded(sender, identity):
     if identity.id:
         identity.provides.add(UserNeed(identity.id))
@@ -90,18 +166,16 @@ def set_password_dangerous(id, password):
     clipped_shadow_id = base64.encodebytes(
         derived_shadow_id.digest()).decode("ascii")[:16]
 
-    salt = os.urandom(64)
+    password_fields = password_hasher.hash(password)
+    revoke_tokens({"user_id": id})
     db.user.update_one({"_id": id}, {
         "$set": {
             "shadow_id": clipped_shadow_id,
-            "password_hash": hashlib.pbkdf2_hmac(
-                "sha256",
-                password.encode("utf-8"),
-                salt,
-                100000),
-            "password_salt": salt,
+            **password_fields,
         }
     })
+    # after the write, a request in between would cache the old user again
+    user_cache.invalidate(id)
 
 
 # @user.route("/api/admin-secret")
@@ -118,15 +192,28 @@ def login_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e, status_code=401)
 
+    address = request.remote_addr
+    retry_after = login_throttle.retry_after(json['id'], address)
+    if retry_after:
+        return problem.too_many_login_attempts_response(retry_after)
+
     requested_user_data = UserData.from_mongodb_doc(
         db.user.find_one({"_id": json['id']}))
     if requested_user_data is None:
+        login_throttle.record_failure(json['id'], address)
         return problem.bad_username_password_response("id")
 
-    request_hashed_password = hashlib.pbkdf2_hmac("sha256", str(
-        json['password']).encode("utf-8"), requested_user_data.password_salt, 100000)
-    if requested_user_data.password_hash != request_hashed_password:
-        return problem.bad_username_password_response("password")
+    try:
+        if not password_hasher.verify(requested_user_data, str(json['password'])):
+            login_throttle.record_failure(json['id'], address)
+            return problem.bad_username_password_response("password")
+        login_throttle.record_success(json['id'])
+
+        if needs_rehash(requested_user_data):
+            password_fields = password_hasher.hash(str(json['password']))
+            db.user.update_one({"_id": requested_user_data.fixed_id}, {"$set": password_fields})
+    except PasswordHasherBusy:
+        return problem.service_busy_response()
 
     user = User.from_user_data(requested_user_data)
     if login_dangerous(user):
@@ -171,26 +258,23 @@ def users_post():
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing_user = db.user.find_one({"_id": json["id"]})
-    if existing_user:
+    if users.exists(json["id"]):
         return problem.duplicate_resource_response("id")
 
     derived_shadow_id = hashlib.sha256((str(time.time()) + str(json['id'])).encode("utf-8"))
     clipped_shadow_id = base64.encodebytes(
         derived_shadow_id.digest()).decode("ascii")[:16]
 
-    salt = os.urandom(64)
+    try:
+        password_fields = password_hasher.hash(json['password'])
+    except PasswordHasherBusy:
+        return problem.service_busy_response()
     user_data = UserData(
         fixed_id=json['id'],
         shadow_id=clipped_shadow_id,
-        password_hash=hashlib.pbkdf2_hmac(
-            "sha256",
-            json['password'].encode("utf-8"),
-            salt,
-            100000),
-        password_salt=salt,
         name=json['name'],
         active=True,
+        **password_fields,
     )
     db.user.insert_one(user_data.to_mongodb_doc())
     return Profile.from_user_data(user_data).created_success_response()
@@ -204,14 +288,18 @@ def user_patch(id):
     except MultipleInvalid as e:
         return problem.invalid_params_response(e)
 
-    existing = UserData.from_mongodb_doc(db.user.find_one({"_id": id}))
+    existing = users.load(id)
     if not existing:
         return problem.invalid_params_response(problem.missing_resource_param_error("id", "user does not exist"), status_code=404)
 
     if "name" in patch:
         db.user.update_one({"_id": id}, {"$set": {"name": patch["name"]}})
+        user_cache.invalidate(id)
     if "password" in patch:
-        set_password_dangerous(id, patch["password"])
+        try:
+            set_password_dangerous(id, patch["password"])
+        except PasswordHasherBusy:
+            return problem.service_busy_response()
 
     return Profile.from_user_data(existing).updated_success_response()
 
@@ -243,11 +331,65 @@ def user_delete(id):
     if current_user.is_authenticated and current_user.user_data.fixed_id == id:
 
         logout_dangerous()
-    if not db.user.find_one({"_id": id}):
+    if not users.exists(id):
         return problem.missing_user_response(id)
     db.user.delete_one({"_id": id})
+    user_cache.invalidate(id)
+    revoke_tokens({"user_id": id})
     return Profile(id).deleted_success_response()
 
+def _session_user_is(id):
+    """Only a user logged in with a password manages their device tokens."""
+    return (current_user.is_authenticated and g.get("device_token") is None
+            and current_user.user_data.fixed_id == id)
+
+
+@ user.route("/api/user/<id>/tokens", methods=["POST"])
+@no_cache
+def user_tokens_post(id):
+    if not _session_user_is(id):
+        return problem.permission_denied_response()
+    try:
+        json = new_device_token_schema(request.get_json())
+    except MultipleInvalid as e:
+        return problem.invalid_params_response(e)
+
+    max_lifetime = current_app.config["DEVICE_TOKEN_MAX_LIFETIME"]
+    expires_in = json.get("expires_in", current_app.config["DEVICE_TOKEN_DEFAULT_LIFETIME"])
+    if expires_in > max_lifetime:
+        return problem.invalid_params_response(MultipleInvalid([Invalid(
+            f"must be at most {max_lifetime}", path=["expires_in"])]))
+
+    record, token = issue_token(id, json["roles"], expires_in, json.get("name"))
+    resource_uri = url_for("user.user_token_delete", id=id, token_id=record["_id"])
+    # the token itself is only ever shown here
+    resp = HypermediaEndpoint(resource_uri, {**token_state(record), "token": token}).get_response(201)
+    resp.headers["Location"] = resource_uri
+    return resp
+
+
+@ user.route("/api/user/<id>/tokens", methods=["GET"])
+@no_cache
+def user_tokens_get(id):
+    if not _session_user_is(id):
+        return problem.permission_denied_response()
+    records = db.device_tokens.find({"user_id": id}).sort("created_at", 1)
+    return HypermediaEndpoint(url_for("user.user_tokens_get", id=id),
+                              [token_state(record) for record in records]).get_response()
+
+
+@ user.route("/api/user/<id>/token/<token_id>", methods=["DELETE"])
+@no_cache
+def user_token_delete(id, token_id):
+    if not _session_user_is(id):
+        return problem.permission_denied_response()
+    if not db.device_tokens.find_one({"_id": token_id, "user_id": id}, {"_id": 1}):
+        return problem.missing_resource_response(
+            url_for("user.user_token_delete", id=id, token_id=token_id))
+    revoke_tokens({"_id": token_id})
+    return Response(status=204)
+
+
 # @user.route("/api/private-report", methods=["GET"])
 # @login_required
 # def private_report_get():
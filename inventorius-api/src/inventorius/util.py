@@ -3,6 +3,7 @@ from flask import request
 from flask.helpers import make_response
 from flask_login import LoginManager
 from flask_principal import Principal, Permission, RoleNeed
+from pymongo import ReturnDocument
 import re
 from string import ascii_letters
 
@@ -78,29 +79,42 @@ def admin_increment_code(prefix, code):
         db.admin.replace_one({"_id": prefix}, {"_id": prefix, "next": next_code}, upsert=True)
 
 
-def admin_get_next(prefix):
+def _max_code_value(collection, prefix=ascii_letters):
+    max_value = 0
+    for doc in collection.find({}, {"_id": 1}):
+        code_number = int(doc['_id'].strip(prefix))
+        if code_number > max_value:
+            max_value = code_number
+    return max_value
+
+
+def admin_recount_next(prefix):
+    """Move the next code of prefix past every code in use and return it.
 
-    def max_code_value(collection, prefix=ascii_letters):
-        cursor = collection.find()
-        max_value = 0
-        for doc in cursor:
-            code_number = int(doc['_id'].strip(prefix))
-            if code_number > max_value:
-                max_value = code_number
-        return max_value
+    The counter is only ever moved forward, in one update, so it is safe
+    alongside admin_get_next and admin_increment_code.
+    """
+    max_value = _max_code_value(_collection_for_prefix(prefix))
+    next_code = _next_available_code(prefix, max_value + 1)
+    next_code_doc = db.admin.find_one_and_update(
+        {"_id": prefix}, {"$max": {"next": next_code}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    return next_code_doc["next"]
 
+
+def admin_get_next(prefix):
     next_code_doc = db.admin.find_one({"_id": prefix})
     if not next_code_doc:
         if prefix == "SKU":
-            max_value = max_code_value(db.sku, "SKU")
+            max_value = _max_code_value(db.sku, "SKU")
             db.admin.insert_one({"_id": "SKU",
                                  "next": _next_available_code("SKU", max_value + 1)})
         if prefix == "BAT":
-            max_value = max_code_value(db.batch)
+            max_value = _max_code_value(db.batch)
             db.admin.insert_one({"_id": "BAT",
                                  "next": _next_available_code("BAT", max_value + 1)})
         if prefix == "BIN":
-            max_value = max_code_value(db.bin, "BIN")
+            max_value = _max_code_value(db.bin, "BIN")
             db.admin.insert_one({"_id": "BIN",
                                  "next": _next_available_code("BIN", max_value + 1)})
         next_code_doc = db.admin.find_one({"_id": prefix})
@@ -1,8 +1,7 @@
 from flask import Response, url_for
-from json import JSONEncoder, dumps
 from voluptuous import MultipleInvalid, Invalid
 from inventorius.resource_operations import operation
-from inventorius.resource_models import BlankEncoder
+from inventorius.serialization import dumps
 import inventorius.resource_operations as operations
 
 problem_titles = {
@@ -12,7 +11,12 @@ problem_titles = {
     "insufficient-quantity": "Requested greater quantity than is available.",
     "invalid-credentials": "Identity not authorized.",
     "account-deactivated": "Account is deactivated.",
-    "dangerous-operation": "This operation requires force=true."
+    "dangerous-operation": "This operation requires force=true.",
+    "too-many-requests": "Too many failed attempts, try again later.",
+    "service-busy": "The server is busy, try again later.",
+    "invalid-token": "Token is invalid, expired or revoked.",
+    "insufficient-scope": "Token does not allow this request.",
+    "permission-denied": "Not allowed for the current user.",
 }
 
 
@@ -21,7 +25,7 @@ def problem_response(status_code=400, json=None):
     resp.status_code = status_code
     if json:
         resp.mimetype = "application/problem+json"
-        resp.data = dumps(json, cls=BlankEncoder)
+        resp.data = dumps(json)
 
     return resp
 
@@ -147,6 +151,60 @@ def bad_username_password_response(name, reason=None):
     )
 
 
+def too_many_login_attempts_response(retry_after):
+    resp = problem_response(
+        status_code=429,
+        json={
+            "type": "too-many-requests",
+            "title": problem_titles["too-many-requests"],
+        })
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def service_busy_response(retry_after=1):
+    resp = problem_response(
+        status_code=503,
+        json={
+            "type": "service-busy",
+            "title": problem_titles["service-busy"],
+        })
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def invalid_token_response():
+    resp = problem_response(
+        status_code=401,
+        json={
+            "type": "invalid-token",
+            "title": problem_titles["invalid-token"],
+        })
+    resp.headers["WWW-Authenticate"] = 'Bearer error="invalid_token"'
+    return resp
+
+
+def insufficient_scope_response(scope):
+    resp = problem_response(
+        status_code=403,
+        json={
+            "type": "insufficient-scope",
+            "title": problem_titles["insufficient-scope"],
+            "scope": scope,
+        })
+    resp.headers["WWW-Authenticate"] = f'Bearer error="insufficient_scope", scope="{scope}"'
+    return resp
+
+
+def permission_denied_response():
+    return problem_response(
+        status_code=403,
+        json={
+            "type": "permission-denied",
+            "title": problem_titles["permission-denied"],
+        })
+
+
 def deactivated_account(id):
     return problem_response(
         status_code=401,
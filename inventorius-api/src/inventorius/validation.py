@@ -1,3 +1,4 @@
+import math
 import re
 from json import dumps
 from locale import currency
@@ -5,9 +6,9 @@ from os import stat
 
 from flask import Response
 from flask.helpers import url_for
-from voluptuous import ALLOW_EXTRA, All, Length, Optional, Range, Required, Schema
+from voluptuous import ALLOW_EXTRA, All, Coerce, Length, Optional, Range, Required, Schema
 from voluptuous.error import Invalid, MultipleInvalid
-from voluptuous.validators import Any
+from voluptuous.validators import Any, In, Unique
 
 
 def NoneOr(Else):
@@ -53,6 +54,13 @@ def alphanum(s: str):
     return s
 
 
+def finite(n):
+    # json.loads accepts Infinity and NaN, they are not quantities
+    if isinstance(n, float) and not math.isfinite(n):
+        raise Invalid("must be a finite number")
+    return n
+
+
 def positive(i: int):
     if i <= 0:
         raise Invalid("must be greater than or equal to 1")
@@ -110,6 +118,15 @@ login_request_schema = Schema(
     }
 )
 
+new_device_token_schema = Schema(
+    {
+        Optional("name"): str,
+        Optional("roles", default=["read", "write"]): All(
+            [In(["read", "write"])], Length(min=1), Unique()),
+        Optional("expires_in"): All(int, Range(min=60)),
+    }
+)
+
 units_schema = Schema(
     {
         Required("unit"): str,
@@ -148,7 +165,7 @@ new_batch_schema = Schema(
         "props": props_schema,
         "sku_id": NoneOr(prefixed_id("SKU")),
         "produced_by_instance": NoneOr(All(str, non_empty_string, non_whitespace)),
-        "qty_remaining": NoneOr(All(Any(int, float), Range(min=0))),
+        "qty_remaining": NoneOr(All(Any(int, float), finite, Range(min=0))),
         "codes": codes_schema,
     }
 )
@@ -162,11 +179,47 @@ batch_patch_schema = Schema(
         "props": NoneOr(props_schema),
         "sku_id": NoneOr(prefixed_id("SKU")),
         "produced_by_instance": NoneOr(All(str, non_empty_string, non_whitespace)),
-        "qty_remaining": NoneOr(All(Any(int, float), Range(min=0))),
+        "qty_remaining": NoneOr(All(Any(int, float), finite, Range(min=0))),
         "codes": NoneOr(codes_schema),
     }
 )
 
+bin_list_fields = ["id", "props", "contents", "item_count", "unit_count"]
+bin_list_sort_keys = ["id", "item_count", "unit_count"]
+
+
+def comma_separated(allowed):
+    def validate(s):
+        values = [value for value in s.split(",") if value]
+        for value in values:
+            if value not in allowed:
+                raise Invalid(f"must be a comma separated list of {', '.join(allowed)}")
+        return values
+    return All(str, validate)
+
+
+# query args of GET /api/bins, props.<key>=<value> args are passed through
+bins_query_schema = Schema(
+    {
+        "prefix": All(str, non_empty_string, non_whitespace),
+        "nonEmpty": Any("true", "false"),
+        "contains": Any(prefixed_id("SKU"), prefixed_id("BAT"), prefixed_id("MIX")),
+        "sort": Any(*bin_list_sort_keys, *[f"-{key}" for key in bin_list_sort_keys]),
+        "fields": comma_separated(bin_list_fields),
+        "limit": All(Coerce(int), Range(min=1, max=1000)),
+        "after": All(str, non_empty_string),
+    },
+    extra=ALLOW_EXTRA,
+)
+
+# query args of GET /api/autocomplete
+autocomplete_query_schema = Schema(
+    {
+        Required("query"): str,
+        "limit": All(Coerce(int), Range(min=1, max=50)),
+    }
+)
+
 new_bin_schema = Schema(
     {
         Required("id"): prefixed_id("BIN"),
@@ -220,7 +273,7 @@ item_release_receive_schema = Schema(
 mixture_component_schema = Schema(
     {
         Required("batch_id"): prefixed_id("BAT"),
-        Required("quantity"): All(Any(int, float), Range(min=0, min_included=False)),
+        Required("quantity"): All(Any(int, float), finite, Range(min=0, min_included=False)),
     }
 )
 
@@ -237,7 +290,7 @@ mixture_create_schema = Schema(
 
 mixture_draw_schema = Schema(
     {
-        Required("quantity"): All(Any(int, float), Range(min=0, min_included=False)),
+        Required("quantity"): All(Any(int, float), finite, Range(min=0, min_included=False)),
         Required("created_by"): All(str, non_empty_string, non_whitespace),
         "note": str,
     }
@@ -245,7 +298,7 @@ mixture_draw_schema = Schema(
 
 mixture_split_schema = Schema(
     {
-        Required("quantity"): All(Any(int, float), Range(min=0, min_included=False)),
+        Required("quantity"): All(Any(int, float), finite, Range(min=0, min_included=False)),
         Required("destination_bin"): prefixed_id("BIN"),
         Required("new_mix_id"): prefixed_id("MIX"),
         Required("created_by"): All(str, non_empty_string, non_whitespace),
@@ -257,7 +310,7 @@ mixture_split_schema = Schema(
 step_requirement_schema = Schema(
     {
         Required("sku_id"): prefixed_id("SKU"),
-        "quantity": NoneOr(All(Any(int, float), Range(min=0, min_included=False))),
+        "quantity": NoneOr(All(Any(int, float), finite, Range(min=0, min_included=False))),
     },
     extra=ALLOW_EXTRA,
 )
@@ -296,7 +349,7 @@ step_template_patch_schema = Schema(
 step_instance_consumed_schema = Schema(
     {
         Required("resource_id"): Any(prefixed_id("BAT"), prefixed_id("MIX")),
-        Required("quantity"): All(Any(int, float), Range(min=0, min_included=False)),
+        Required("quantity"): All(Any(int, float), finite, Range(min=0, min_included=False)),
         Required("bin_id"): prefixed_id("BIN"),
         "resource_type": Any("batch", "mixture"),
     },
@@ -308,7 +361,7 @@ step_instance_produced_schema = Schema(
     {
         Required("batch_id"): prefixed_id("BAT"),
         Required("sku_id"): prefixed_id("SKU"),
-        Required("quantity"): All(Any(int, float), Range(min=0, min_included=False)),
+        Required("quantity"): All(Any(int, float), finite, Range(min=0, min_included=False)),
         "name": str,
         "owned_codes": code_list_schema,
         "associated_codes": code_list_schema,
@@ -361,3 +414,11 @@ traceability_request_schema = Schema(
         _traceability_non_empty,
     )
 )
+
+
+new_job_schema = Schema(
+    {
+        Required("kind"): All(str, non_empty_string),
+        Optional("params", default={}): dict,
+    }
+)
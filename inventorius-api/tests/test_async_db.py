@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import pytest
+from flask import g
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.async_db import async_database
+from inventorius.db import get_mongo_client
+from inventorius.repository import async_skus
+
+
+def _mongo_reachable():
+    async def ping():
+        client = AsyncMongoClient(os.getenv("INVENTORIUS_MONGO_HOST", "localhost"),
+                                  int(os.getenv("INVENTORIUS_MONGO_PORT", "27017")),
+                                  serverSelectionTimeoutMS=1000)
+        try:
+            await client.admin.command("ping")
+        finally:
+            await client.close()
+    try:
+        asyncio.run(ping())
+    except PyMongoError:
+        return False
+    return True
+
+
+@pytest.fixture
+def async_db_enabled():
+    if not _mongo_reachable():
+        pytest.skip("the async client needs a running mongod")
+    app.config["ASYNC_DB"] = True
+    yield
+    app.config["ASYNC_DB"] = False
+
+
+def test_move_with_gathered_lookups(async_db_enabled):
+    with clientContext() as client:
+        for bin_id in ("BIN000001", "BIN000002"):
+            assert client.post("/api/bins", json={"id": bin_id, "props": {}}).status_code == 201
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "resistor"})
+        assert resp.status_code == 201
+        resp = client.post("/api/bin/BIN000001/contents", json={"id": "SKU000001", "quantity": 3})
+        assert resp.status_code == 201
+
+        def move(source, item_id, destination="BIN000002", quantity=1):
+            return client.put(f"/api/bin/{source}/contents/move", json={
+                "id": item_id, "destination": destination, "quantity": quantity})
+
+        assert move("BIN000001", "SKU000001").status_code == 200
+        assert move("BIN000009", "SKU000001").status_code == 404
+        assert move("BIN000001", "SKU000001", destination="BIN000009").status_code == 404
+        assert move("BIN000001", "SKU000009").status_code == 404
+        assert move("BIN000001", "SKU000001", quantity=5).status_code == 405
+        resp = client.get("/api/bin/BIN000002")
+        assert resp.json["state"]["contents"] == {"SKU000001": 1}
+
+
+def test_async_patch(async_db_enabled):
+    with clientContext() as client:
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "resistor"})
+        assert resp.status_code == 201
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            patched, missing = async_database.gather(
+                async_skus.patch("SKU000001", {"name": "capacitor"}, fields=["name"]),
+                async_skus.patch("SKU000009", {"name": "capacitor"}))
+        assert patched.name == "capacitor"
+        assert missing is None
+        assert client.get("/api/sku/SKU000001").json["state"]["name"] == "capacitor"
+
+
+def test_asgi_entrypoint():
+    pytest.importorskip("a2wsgi")
+    pytest.importorskip("asgiref")
+    from asgiref.testing import ApplicationCommunicator
+
+    from inventorius.asgi import app as asgi_app
+    app.config["ASYNC_DB"] = False
+
+    async def get_status():
+        communicator = ApplicationCommunicator(asgi_app, {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": "/api/status",
+            "raw_path": b"/api/status", "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"localhost")], "server": ("localhost", 80),
+        })
+        await communicator.send_input({"type": "http.request", "body": b""})
+        start = await communicator.receive_output(5)
+        body = await communicator.receive_output(5)
+        return start, body
+
+    start, body = asyncio.run(get_status())
+    assert start["status"] == 200
+    assert b"version" in body["body"]
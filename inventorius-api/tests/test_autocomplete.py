@@ -0,0 +1,94 @@
+import importlib
+
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.autocomplete import rebuild_prefix_index
+from inventorius.db import get_mongo_client
+
+
+def _complete(client, query, **args):
+    resp = client.get("/api/autocomplete", query_string={"query": query, **args})
+    assert resp.status_code == 200
+    return [result["id"] for result in resp.json["state"]["results"]]
+
+
+def test_autocomplete_matches_word_prefixes():
+    with clientContext() as client:
+        for sku_id, name in (("SKU000001", "Resistor 10k"), ("SKU000002", "Resin, epoxy")):
+            resp = client.post("/api/skus", json={"id": sku_id, "name": name, "owned_codes": [],
+                                                  "associated_codes": [], "props": {}})
+            assert resp.status_code == 201
+        resp = client.post("/api/batches", json={
+            "id": "BAT000001", "sku_id": "SKU000001", "name": "reel",
+            "codes": [{"code": "LOT4242"}]})
+        assert resp.status_code == 201
+
+        assert _complete(client, "resis") == ["SKU000001"]
+        assert _complete(client, "RES") == ["SKU000001", "SKU000002"]
+        assert _complete(client, "res", limit=1) == ["SKU000001"]
+        assert _complete(client, "10 resi") == ["SKU000001"]
+        assert _complete(client, "lot42") == ["BAT000001"]
+        assert _complete(client, "") == []
+
+        resp = client.patch("/api/sku/SKU000002", json={"name": "Glue"})
+        assert resp.status_code == 200
+        assert _complete(client, "res") == ["SKU000001"]
+        assert _complete(client, "glu") == ["SKU000002"]
+
+        assert client.delete("/api/batch/BAT000001").status_code == 200
+        assert _complete(client, "lot") == []
+
+        assert client.get("/api/autocomplete").status_code == 400
+        assert client.get("/api/autocomplete?query=a&limit=0").status_code == 400
+
+
+def test_rebuild_prefix_index():
+    with clientContext() as client:
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "Capacitor", "owned_codes": [],
+                                              "associated_codes": [], "props": {}})
+        assert resp.status_code == 201
+
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            g.db.prefix_index.delete_many({})
+            assert rebuild_prefix_index() == 1
+
+        assert _complete(client, "capa") == ["SKU000001"]
+
+
+def test_saves_during_a_rebuild_are_kept(monkeypatch):
+    with clientContext() as client:
+        for sku_id, name in (("SKU000001", "Capacitor"), ("SKU000002", "Resistor")):
+            resp = client.post("/api/skus", json={"id": sku_id, "name": name, "owned_codes": [],
+                                                  "associated_codes": [], "props": {}})
+            assert resp.status_code == 201
+
+        # the package exports the blueprint under the module's name
+        module = importlib.import_module("inventorius.autocomplete")
+        prefix_doc = module._prefix_doc
+        during = []
+
+        def save_during_rebuild(resource_type, model):
+            if not during:
+                during.append(_complete(client, "capa"))
+                # SKU000002 is renamed after the rebuild read it
+                resp = client.patch("/api/sku/SKU000002", json={"name": "Inductor"})
+                assert resp.status_code == 200
+                resp = client.post("/api/skus", json={"id": "SKU000003", "name": "Diode",
+                                                      "owned_codes": [], "associated_codes": [],
+                                                      "props": {}})
+                assert resp.status_code == 201
+            return prefix_doc(resource_type, model)
+
+        monkeypatch.setattr(module, "_prefix_doc", save_during_rebuild)
+        resp = client.post("/api/jobs", json={"kind": "rebuild-prefix-index"})
+        assert client.get(resp.headers["Location"]).json["state"]["status"] == "succeeded"
+
+        # the live index answered while the rebuild ran
+        assert during == [["SKU000001"]]
+        assert _complete(client, "capa") == ["SKU000001"]
+        assert _complete(client, "induc") == ["SKU000002"]
+        assert _complete(client, "diod") == ["SKU000003"]
+        assert _complete(client, "resis") == []
@@ -0,0 +1,67 @@
+import base64
+import json
+
+from conftest import clientContext
+
+
+def _setup(client):
+    assert client.post("/api/skus", json={"id": "SKU000001", "name": "", "owned_codes": [],
+                                          "associated_codes": [], "props": {}}).status_code == 201
+    for i in range(1, 6):
+        bin_id = f"BIN00000{i}"
+        props = {"zone": "A" if i % 2 else "B", "shelf": i}
+        assert client.post("/api/bins", json={"id": bin_id, "props": props}).status_code == 201
+        if i > 1:
+            resp = client.post(f"/api/bin/{bin_id}/contents",
+                               json={"id": "SKU000001", "quantity": 10 * i})
+            assert resp.status_code == 201
+    assert client.post("/api/bins", json={"id": "BIN000100", "props": {}}).status_code == 201
+
+
+def _ids(resp):
+    assert resp.status_code == 200
+    return [result["id"] for result in resp.json["state"]["results"]]
+
+
+def test_filters_and_projection():
+    with clientContext() as client:
+        _setup(client)
+        resp = client.get("/api/bins")
+        assert _ids(resp) == ["BIN000001", "BIN000002", "BIN000003",
+                              "BIN000004", "BIN000005", "BIN000100"]
+        first = resp.json["state"]["results"][1]
+        assert first == {"id": "BIN000002", "props": {"zone": "B", "shelf": 2},
+                         "item_count": 1, "unit_count": 20}
+
+        assert _ids(client.get("/api/bins?prefix=BIN0001")) == ["BIN000100"]
+        assert _ids(client.get("/api/bins?nonEmpty=true&props.zone=A")) == ["BIN000003", "BIN000005"]
+        assert _ids(client.get("/api/bins?contains=SKU000001&props.shelf=4")) == ["BIN000004"]
+
+        resp = client.get("/api/bins?fields=id,contents&limit=1&prefix=BIN000002")
+        assert resp.json["state"]["results"] == [{"id": "BIN000002", "contents": {"SKU000001": 20}}]
+
+        assert client.get("/api/bins?fields=id,secret").status_code == 400
+        assert client.get("/api/bins?after=garbage!").status_code == 400
+        for cursor in ([{"$gt": ""}, "BIN000001"], [1, {"$ne": None}], [[1], "BIN000001"]):
+            after = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            resp = client.get("/api/bins", query_string={"sort": "unit_count", "after": after})
+            assert resp.status_code == 400
+        for key in ("props.$where", "props.zone.x", "props.", "props.zone[$ne]"):
+            resp = client.get("/api/bins", query_string={key: "A"})
+            assert resp.status_code == 400
+            assert resp.json["invalid-params"][0]["name"] == key
+
+
+def test_sorting_and_keyset_pages():
+    with clientContext() as client:
+        _setup(client)
+        seen = []
+        url = "/api/bins?sort=-unit_count&limit=4&fields=id"
+        resp = client.get(url)
+        seen.extend(_ids(resp))
+        assert resp.json["state"]["results"][0] == {"id": "BIN000005"}
+        resp = client.get(f"{url}&after={resp.json['state']['next']}")
+        seen.extend(_ids(resp))
+        assert "next" not in resp.json["state"]
+        assert seen == ["BIN000005", "BIN000004", "BIN000003", "BIN000002",
+                        "BIN000100", "BIN000001"]
@@ -0,0 +1,100 @@
+import importlib
+
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.code_index import rebuild_code_index
+from inventorius.db import get_mongo_client
+
+
+def _matches(client, code):
+    resp = client.get(f"/api/code/{code}")
+    assert resp.status_code == 200
+    return resp.json["state"]
+
+
+def test_code_lookup_follows_changes():
+    with clientContext() as client:
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "", "owned_codes": ["111"],
+                                              "associated_codes": ["222"], "props": {}})
+        assert resp.status_code == 201
+        resp = client.post("/api/batches", json={
+            "id": "BAT000001", "sku_id": "SKU000001", "associated_codes": ["111"],
+            "codes": [{"code": "LOT42", "metadata": {"kind": "supplier"}}]})
+        assert resp.status_code == 201
+
+        state = _matches(client, "111")
+        assert state["owner"] == "SKU000001"
+        assert state["matches"] == [
+            {"kind": "owned", "type": "sku", "resource_id": "SKU000001"},
+            {"kind": "associated", "type": "batch", "resource_id": "BAT000001"},
+        ]
+        state = _matches(client, "LOT42")
+        assert state["owner"] is None
+        assert state["matches"][0]["metadata"] == {"kind": "supplier"}
+
+        resp = client.get("/api/search", query_string={"query": "LOT42"})
+        assert [result["id"] for result in resp.json["state"]["results"]] == ["BAT000001"]
+
+        resp = client.patch("/api/batch/BAT000001", json={"id": "BAT000001", "codes": []})
+        assert resp.status_code == 200
+        assert client.get("/api/code/LOT42").status_code == 404
+
+        resp = client.patch("/api/sku/SKU000001", json={"owned_codes": ["333"]})
+        assert resp.status_code == 200
+        assert _matches(client, "333")["owner"] == "SKU000001"
+        assert _matches(client, "111")["owner"] is None
+
+        assert client.delete("/api/batch/BAT000001").status_code == 200
+        assert client.get("/api/code/111").status_code == 404
+
+
+def test_rebuild_code_index():
+    with clientContext() as client:
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "", "owned_codes": ["111"],
+                                              "associated_codes": [], "props": {}})
+        assert resp.status_code == 201
+
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            g.db.code_index.delete_many({})
+            assert rebuild_code_index() == 1
+
+        assert _matches(client, "111")["owner"] == "SKU000001"
+
+
+def test_saves_during_a_rebuild_are_kept(monkeypatch):
+    with clientContext() as client:
+        for sku_id, code in (("SKU000001", "111"), ("SKU000002", "222")):
+            resp = client.post("/api/skus", json={"id": sku_id, "name": "", "owned_codes": [code],
+                                                  "associated_codes": [], "props": {}})
+            assert resp.status_code == 201
+
+        # the package exports the blueprint under the module's name
+        module = importlib.import_module("inventorius.code_index")
+        code_entries = module.code_entries
+        during = []
+
+        def save_during_rebuild(resource_type, model):
+            if not during:
+                during.append(_matches(client, "111")["owner"])
+                # SKU000002 gets a new code after the rebuild read it
+                resp = client.patch("/api/sku/SKU000002", json={"owned_codes": ["333"]})
+                assert resp.status_code == 200
+                resp = client.post("/api/skus", json={"id": "SKU000003", "name": "",
+                                                      "owned_codes": ["444"],
+                                                      "associated_codes": [], "props": {}})
+                assert resp.status_code == 201
+            return code_entries(resource_type, model)
+
+        monkeypatch.setattr(module, "code_entries", save_during_rebuild)
+        resp = client.post("/api/jobs", json={"kind": "rebuild-code-index"})
+        assert client.get(resp.headers["Location"]).json["state"]["status"] == "succeeded"
+
+        # the live index answered while the rebuild ran
+        assert during == ["SKU000001"]
+        assert _matches(client, "111")["owner"] == "SKU000001"
+        assert _matches(client, "333")["owner"] == "SKU000002"
+        assert _matches(client, "444")["owner"] == "SKU000003"
+        assert client.get("/api/code/222").status_code == 404
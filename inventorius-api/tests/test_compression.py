@@ -0,0 +1,48 @@
+import gzip
+import json
+
+from flask import Response
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.compression import compress
+
+
+def _create_bins(client, count):
+    for i in range(count):
+        resp = client.post("/api/bins", json={"id": f"BIN{i:06}", "props": {}})
+        assert resp.status_code == 201
+
+
+def test_large_response_is_gzipped():
+    with clientContext() as client:
+        _create_bins(client, 40)
+        plain = client.get("/api/search?query=!BINS&limit=100")
+        assert "Content-Encoding" not in plain.headers
+
+        resp = client.get("/api/search?query=!BINS&limit=100",
+                          headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["Vary"]
+        assert len(resp.data) < len(plain.data)
+        assert json.loads(gzip.decompress(resp.data)) == plain.json
+
+
+def test_small_response_is_not_compressed():
+    with clientContext() as client:
+        _create_bins(client, 1)
+        resp = client.get("/api/bin/BIN000000", headers={"Accept-Encoding": "gzip"})
+        assert len(resp.data) < app.config["COMPRESS_MIN_SIZE"]
+        assert "Content-Encoding" not in resp.headers
+        assert resp.json["state"]["id"] == "BIN000000"
+
+
+def test_streamed_response_is_compressed():
+    chunks = [json.dumps({"row": i}) + "\n" for i in range(100)]
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        resp = Response((chunk for chunk in chunks), mimetype="application/json")
+        resp = compress.after_request(resp)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in resp.headers
+        assert gzip.decompress(b"".join(resp.response)).decode() == "".join(chunks)
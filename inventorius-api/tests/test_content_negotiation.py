@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import clientContext
+
+
+def _create_bin(client, bin_id):
+    resp = client.post("/api/bins", json={"id": bin_id, "props": {}})
+    assert resp.status_code == 201
+
+
+def test_json_is_default():
+    with clientContext() as client:
+        _create_bin(client, "BIN1")
+        resp = client.get("/api/bin/BIN1")
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/json"
+        assert resp.json["state"]["id"] == "BIN1"
+        assert "Accept" in resp.headers["Vary"]
+
+
+def test_operations_can_be_omitted():
+    with clientContext() as client:
+        _create_bin(client, "BIN1")
+        resp = client.get("/api/bin/BIN1?operations=false")
+        assert "operations" not in resp.json
+        assert resp.json["state"]["id"] == "BIN1"
+
+        resp = client.get("/api/search?query=BIN1&operations=false")
+        assert "operations" not in resp.json
+        assert resp.json["state"]["results"][0]["id"] == "BIN1"
+
+
+def test_msgpack_response():
+    msgpack = pytest.importorskip("msgpack")
+    with clientContext() as client:
+        _create_bin(client, "BIN1")
+        resp = client.get("/api/bin/BIN1", headers={"Accept": "application/msgpack"})
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/msgpack"
+        data = msgpack.unpackb(resp.data)
+        assert data == client.get("/api/bin/BIN1").json
+
+        resp = client.get("/api/search?query=BIN1", headers={"Accept": "application/msgpack"})
+        assert msgpack.unpackb(resp.data)["state"]["results"][0]["id"] == "BIN1"
+
+
+def test_cbor_response():
+    cbor2 = pytest.importorskip("cbor2")
+    with clientContext() as client:
+        _create_bin(client, "BIN1")
+        resp = client.get("/api/bin/BIN1", headers={"Accept": "application/cbor"})
+        assert resp.mimetype == "application/cbor"
+        assert cbor2.loads(resp.data) == client.get("/api/bin/BIN1").json
@@ -1,6 +1,8 @@
+from decimal import Decimal
+
 from bson.decimal128 import Decimal128
 
-from inventorius.data_models import Bin, Sku, Batch, Props, DataModelJSONEncoder as Encoder
+from inventorius.data_models import Bin, Sku, Batch, Props, DataModelJSONEncoder as Encoder, as_quantity, quantity_to_number
 
 import pytest
 import json
@@ -83,6 +85,26 @@ def test_batch_qty_remaining_round_trip():
     assert restored.qty_remaining == pytest.approx(5.5)
 
 
+def test_quantities_stay_decimal():
+    doc = Batch(id="BAT000001", qty_remaining=0.1).to_mongodb_doc()
+    assert doc["qty_remaining"] == Decimal128("0.1")
+
+    restored = Batch.from_mongodb_doc(doc)
+    assert restored.qty_remaining == Decimal("0.1")
+    assert json.loads(json.dumps(restored.to_dict(), cls=Encoder))["qty_remaining"] == 0.1
+
+    assert quantity_to_number(Decimal("4.0")) == 4
+    assert isinstance(quantity_to_number(Decimal("4.0")), int)
+    assert as_quantity(Decimal128("2.25")) == Decimal("2.25")
+
+
+def test_nonfinite_quantities_convert_to_floats():
+    assert quantity_to_number(Decimal("Infinity")) == float("inf")
+    assert quantity_to_number(Decimal128("-Infinity")) == float("-inf")
+    nan = quantity_to_number(Decimal("NaN"))
+    assert nan != nan
+
+
 def test_batch_codes_normalization():
     codes = [
         {"code": "LOT1"},
@@ -0,0 +1,84 @@
+import time
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.device_tokens import sign_token
+
+
+def _bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _logged_in_alice(client):
+    resp = client.post("/api/users", json={"id": "alice", "name": "Alice", "password": "password1"})
+    assert resp.status_code == 201
+    resp = client.post("/api/login", json={"id": "alice", "password": "password1"})
+    assert resp.status_code == 200
+
+
+def test_device_token_authenticates_without_session():
+    with clientContext() as client:
+        _logged_in_alice(client)
+        resp = client.post("/api/user/alice/tokens", json={"name": "scanner 1"})
+        assert resp.status_code == 201
+        token = resp.json["state"]["token"]
+        assert resp.json["state"]["roles"] == ["read", "write"]
+        assert "token" not in client.get("/api/user/alice/tokens").json["state"][0]
+
+        device = app.test_client()
+        resp = device.get("/api/whoami", headers=_bearer(token))
+        assert resp.json["id"] == "alice"
+        assert "Set-Cookie" not in resp.headers
+        # the private profile needs the user's identity
+        resp = device.get("/api/user/alice", headers=_bearer(token))
+        assert "shadow_id" not in resp.json["state"]
+        assert resp.json["state"] == client.get("/api/user/alice").json["state"]
+
+        # tokens can not issue tokens
+        resp = device.post("/api/user/alice/tokens", json={}, headers=_bearer(token))
+        assert resp.status_code == 403
+
+        resp = device.get("/api/whoami", headers=_bearer(token + "x"))
+        assert resp.status_code == 401
+        assert resp.json["type"] == "invalid-token"
+        assert device.get("/api/whoami").json["id"] is None
+
+
+def test_read_token_cannot_write():
+    with clientContext() as client:
+        _logged_in_alice(client)
+        token = client.post("/api/user/alice/tokens", json={"roles": ["read"]}).json["state"]["token"]
+
+        device = app.test_client()
+        assert device.get("/api/bins", headers=_bearer(token)).status_code == 200
+        resp = device.post("/api/bins", json={"id": "BIN000001"}, headers=_bearer(token))
+        assert resp.status_code == 403
+        assert resp.json["type"] == "insufficient-scope"
+
+        resp = client.post("/api/user/alice/tokens", json={"roles": ["admin"]})
+        assert resp.status_code == 400
+        resp = client.post("/api/user/alice/tokens", json={"expires_in": 10 * 365 * 24 * 60 * 60})
+        assert resp.status_code == 400
+
+
+def test_revoked_and_expired_tokens_are_refused():
+    with clientContext() as client:
+        _logged_in_alice(client)
+        resp = client.post("/api/user/alice/tokens", json={})
+        token, token_id = resp.json["state"]["token"], resp.json["state"]["id"]
+        other = client.post("/api/user/alice/tokens", json={}).json["state"]["token"]
+
+        device = app.test_client()
+        assert device.get("/api/whoami", headers=_bearer(token)).json["id"] == "alice"
+        assert client.delete(f"/api/user/alice/token/{token_id}").status_code == 204
+        assert device.get("/api/whoami", headers=_bearer(token)).status_code == 401
+        assert device.get("/api/whoami", headers=_bearer(other)).json["id"] == "alice"
+
+        # a new password revokes every token of the user
+        assert client.patch("/api/user/alice", json={"password": "password2"}).status_code == 200
+        assert device.get("/api/whoami", headers=_bearer(other)).status_code == 401
+
+        with app.test_request_context():
+            expired = sign_token({"sub": "alice", "jti": "x", "roles": ["read"],
+                                  "exp": int(time.time()) - 1})
+        assert device.get("/api/whoami", headers=_bearer(expired)).status_code == 401
@@ -0,0 +1,58 @@
+import threading
+
+from flask import Flask
+
+from inventorius.events import BinContentsChanged, EventBus, ResourceSaved
+
+
+def test_events_are_handled_in_the_background():
+    app = Flask("events")
+    bus = EventBus(app)
+    handled = []
+
+    @bus.subscriber(BinContentsChanged)
+    def record(event):
+        handled.append((event, threading.current_thread().name))
+
+    @bus.subscriber(BinContentsChanged)
+    def fail(event):
+        raise RuntimeError("subscriber errors are logged, not raised")
+
+    bus.publish(BinContentsChanged("BIN000001", "SKU000001", 5))
+    bus.publish(ResourceSaved("sku", "SKU000001"))
+    bus.join()
+    assert handled == [(BinContentsChanged(bin_id="BIN000001", item_id="SKU000001", quantity=5),
+                        "event-bus")]
+
+
+def test_testing_apps_handle_events_before_publish_returns():
+    app = Flask("events")
+    app.testing = True
+    bus = EventBus(app)
+    handled = []
+    bus.subscribe(ResourceSaved, handled.append)
+
+    bus.publish(ResourceSaved("batch", "BAT000001"))
+    assert handled == [ResourceSaved("batch", "BAT000001")]
+
+
+def test_queued_events_are_handled_before_exit():
+    app = Flask("events")
+    bus = EventBus(app)
+    handled = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @bus.subscriber(ResourceSaved)
+    def record(event):
+        started.set()
+        release.wait()
+        handled.append(event.id)
+
+    bus.publish(ResourceSaved("sku", "SKU000001"))
+    bus.publish(ResourceSaved("sku", "SKU000002"))
+    started.wait()
+    release.set()
+    bus.drain()
+    assert handled == ["SKU000001", "SKU000002"]
+    assert not bus._worker.is_alive()
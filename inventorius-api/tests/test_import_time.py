@@ -0,0 +1,56 @@
+"""Import-time budget for the app, which every worker pays on a cold start."""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parent.parent / "src"
+
+# cumulative microseconds reported by `python -X importtime` for `inventorius`
+IMPORT_BUDGET_US = int(os.getenv("INVENTORIUS_IMPORT_BUDGET_US", "1000000"))
+
+# heavy optional dependencies that must only be loaded on first use
+LAZY_MODULES = ["sentry_sdk", "wand", "gridfs"]
+
+
+def _import_inventorius():
+    env = dict(os.environ)
+    env.pop("SENTRY_DSN", None)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(SRC_PATH), env.get("PYTHONPATH", "")])
+    script = (
+        "import sys, json, inventorius; "
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True, text=True, env=env, check=True)
+    return completed
+
+
+def _cumulative_us(importtime_output, module):
+    # lines look like "import time:  self [us] | cumulative | <indent>name",
+    # only top level imports have a single space before the name
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line.split("|")
+        if name == f" {module}":
+            return int(cumulative_us)
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_import_time_within_budget():
+    completed = _import_inventorius()
+    cumulative = _cumulative_us(completed.stderr, "inventorius")
+    assert cumulative < IMPORT_BUDGET_US, (
+        f"importing inventorius took {cumulative}us, "
+        f"budget is {IMPORT_BUDGET_US}us (INVENTORIUS_IMPORT_BUDGET_US)")
+
+
+def test_optional_dependencies_are_lazy():
+    completed = _import_inventorius()
+    loaded = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert loaded == []
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.db import db, get_mongo_client
+from inventorius.jobs import job_runner
+
+
+def _job(client, resp):
+    assert resp.status_code == 202
+    location = resp.headers["Location"]
+    assert location == f"/api/job/{resp.json['state']['id']}"
+    resp = client.get(location)
+    assert resp.status_code == 200
+    return resp.json["state"]
+
+
+def test_jobs_report_results():
+    with clientContext() as client:
+        assert client.post("/api/bins", json={"id": "BIN000001", "props": {}}).status_code == 201
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "", "owned_codes": [],
+                                              "associated_codes": [], "props": {}})
+        assert resp.status_code == 201
+        assert client.post("/api/bin/BIN000001/contents",
+                           json={"id": "SKU000001", "quantity": 2}).status_code == 201
+
+        state = _job(client, client.post("/api/jobs", json={"kind": "rebuild-stock-summary"}))
+        assert state["kind"] == "rebuild-stock-summary"
+        assert state["status"] == "succeeded"
+        assert state["progress"] == 1.0
+        assert state["result"] == {"entries": 2}
+
+        state = _job(client, client.post("/api/jobs", json={"kind": "recount-next-codes"}))
+        assert state["result"] == {"SKU": "SKU000002", "BAT": "BAT000001", "BIN": "BIN000002"}
+
+        # counters handed out past the codes in use are kept
+        assert client.get("/api/next/bin").json["state"] == "BIN000002"
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            db.admin.update_one({"_id": "BIN"}, {"$set": {"next": "BIN000007"}})
+        state = _job(client, client.post("/api/jobs", json={"kind": "recount-next-codes"}))
+        assert state["result"]["BIN"] == "BIN000007"
+
+
+def test_traceability_job():
+    with clientContext() as client:
+        resp = client.post("/api/traceability?async=true", json={"batch_ids": ["BAT000001"]})
+        state = _job(client, resp)
+        assert state["status"] == "failed"
+        assert state["error"] == "missing batch BAT000001"
+
+        assert client.post("/api/batches", json={"id": "BAT000001", "qty_remaining": 3}).status_code == 201
+        resp = client.post("/api/jobs", json={"kind": "traceability",
+                                              "params": {"batch_ids": ["BAT000001"]}})
+        state = _job(client, resp)
+        assert state["status"] == "succeeded"
+        assert state["result"] == client.post("/api/traceability",
+                                              json={"batch_ids": ["BAT000001"]}).json
+
+
+def test_invalid_jobs():
+    with clientContext() as client:
+        resp = client.post("/api/jobs", json={"kind": "nope"})
+        assert resp.status_code == 400
+        resp = client.post("/api/jobs", json={"kind": "rebuild-stock-summary", "params": {"x": 1}})
+        assert resp.status_code == 400
+        assert client.get("/api/job/nope").status_code == 404
+        assert client.get("/api/job/0123456789abcdef01234567").status_code == 404
+
+
+def test_stale_jobs_are_recovered():
+    with clientContext() as client:
+        now = datetime.now(timezone.utc)
+        jobs = {name: {"_id": ObjectId(), "kind": "rebuild-stock-summary", "params": {},
+                       "progress": 0.0, "created_at": now, **fields}
+                for name, fields in {
+                    "queued": {"status": "queued"},
+                    "expired": {"status": "running", "attempts": 1,
+                                "lease_until": now - timedelta(minutes=1)},
+                    "leased": {"status": "running", "attempts": 1,
+                               "lease_until": now + timedelta(minutes=1)},
+                    "exhausted": {"status": "running", "attempts": 3,
+                                  "lease_until": now - timedelta(minutes=1)},
+                }.items()}
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            db.jobs.insert_many(list(jobs.values()))
+            job_runner.recover()
+
+        states = {name: client.get(f"/api/job/{doc['_id']}").json["state"]
+                  for name, doc in jobs.items()}
+        assert states["queued"]["status"] == "succeeded"
+        assert states["expired"]["status"] == "succeeded"
+        assert states["leased"]["status"] == "running"
+        assert states["exhausted"]["status"] == "failed"
+        assert states["exhausted"]["error"] == "gave up after 3 attempts"
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from bson.decimal128 import Decimal128
+from pymongo import ReturnDocument, TEXT, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from inventorius.memory_db import MemoryClient
+from inventorius.stock import summarize_items
+
+
+@pytest.fixture
+def database():
+    return MemoryClient().testing
+
+
+def test_queries_projections_and_cursor_options(database):
+    database.bin.insert_many([
+        {"_id": "BIN000001", "props": {"aisle": 1}, "contents": {"SKU000001": 3}},
+        {"_id": "BIN000002", "props": {"aisle": 2}, "contents": {}},
+        {"_id": "BIN000003", "contents": {"SKU000001": 1, "BAT000001": 2}},
+    ])
+    find_ids = lambda filter, **kwargs: [doc["_id"] for doc in database.bin.find(filter, **kwargs)]
+
+    assert find_ids({"contents.SKU000001": {"$exists": True}}) == ["BIN000001", "BIN000003"]
+    assert find_ids({"_id": {"$in": ["BIN000002", "BIN000009"]}}) == ["BIN000002"]
+    assert find_ids({"contents": {"$exists": True, "$ne": {}}}) == ["BIN000001", "BIN000003"]
+    assert find_ids({"$or": [{"props.aisle": 2}, {"contents.BAT000001": {"$gt": 1}}]}) \
+        == ["BIN000002", "BIN000003"]
+    assert find_ids({"_id": {"$regex": "^BIN00000[12]"}}, sort=[("_id", -1)]) \
+        == ["BIN000002", "BIN000001"]
+    assert find_ids({}, skip=1, limit=1) == ["BIN000002"]
+    assert [doc["_id"] for doc in database.bin.find().sort("_id", -1).limit(2)] \
+        == ["BIN000003", "BIN000002"]
+
+    assert database.bin.find_one({"_id": "BIN000003"}, {"contents.BAT000001": 1}) \
+        == {"_id": "BIN000003", "contents": {"BAT000001": 2}}
+    assert database.bin.find_one("BIN000001", {"contents": 0, "_id": 0}) == {"props": {"aisle": 1}}
+    assert database.bin.count_documents({"contents.SKU000001": {"$gte": 1}}) == 2
+    assert database.missing.find_one({}) is None
+
+    # results are copies
+    database.bin.find_one({"_id": "BIN000001"})["contents"]["SKU000001"] = 100
+    assert database.bin.find_one({"_id": "BIN000001"})["contents"]["SKU000001"] == 3
+
+
+def test_updates_and_upserts(database):
+    database.bin.insert_one({"_id": "BIN000001", "contents": {"SKU000001": 3}})
+    database.bin.update_one({"_id": "BIN000001"}, {"$inc": {"contents.SKU000001": -3}})
+    result = database.bin.update_one({"_id": "BIN000001", "contents.SKU000001": 0},
+                                     {"$unset": {"contents.SKU000001": ""}})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert database.bin.find_one({"_id": "BIN000001"})["contents"] == {}
+
+    database.bin.update_one({"_id": "BIN000001"}, {"$push": {"log": "moved"},
+                                                   "$set": {"props.aisle": 4}})
+    doc = database.bin.find_one_and_update(
+        {"_id": "BIN000001"}, {"$push": {"log": "counted"}},
+        {"log": 1}, return_document=ReturnDocument.AFTER)
+    assert doc == {"_id": "BIN000001", "log": ["moved", "counted"]}
+
+    result = database.stock_summary.bulk_write([
+        UpdateOne({"_id": "SKU000001"}, {"$inc": {"total": 2}, "$set": {"kind": "item"}},
+                  upsert=True),
+        UpdateOne({"_id": "SKU000001"}, {"$inc": {"total": 3}}, upsert=True),
+    ], ordered=True)
+    assert (result.upserted_count, result.modified_count) == (1, 1)
+    assert database.stock_summary.find_one({"_id": "SKU000001"}) \
+        == {"_id": "SKU000001", "total": 5, "kind": "item"}
+
+    database.admin.replace_one({"_id": "SKU"}, {"_id": "SKU", "next": "SKU000002"}, upsert=True)
+    assert database.admin.find_one({"_id": "SKU"})["next"] == "SKU000002"
+    assert database.admin.delete_many({}).deleted_count == 1
+
+
+def test_unique_indexes(database):
+    database.code_index.create_index([("code", 1), ("kind", 1)], unique=True)
+    database.code_index.insert_one({"code": "123", "kind": "owned"})
+    database.code_index.insert_one({"code": "123", "kind": "associated"})
+    with pytest.raises(DuplicateKeyError):
+        database.code_index.insert_one({"code": "123", "kind": "owned"})
+    database.sku.insert_one({"_id": "SKU000001"})
+    with pytest.raises(DuplicateKeyError):
+        database.sku.insert_one({"_id": "SKU000001"})
+    with pytest.raises(BulkWriteError):
+        database.sku.insert_many([{"_id": "SKU000002"}, {"_id": "SKU000001"}])
+    assert database.sku.count_documents({}) == 2
+    assert "code_1_kind_1" in database.code_index.index_information()
+
+
+def test_values_round_trip_like_bson(database):
+    now = datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+    database.batch.insert_one({"_id": "BAT000001", "qty_remaining": Decimal128("2.5"),
+                               "codes": ("a", "b"), "created_at": now})
+    doc = database.batch.find_one({"created_at": {"$gt": now - timedelta(seconds=1)}})
+    assert doc["qty_remaining"] == Decimal("2.5")
+    assert doc["codes"] == ["a", "b"]
+    assert doc["created_at"] == datetime(2024, 5, 1, 12, 0, 0, 123000)
+    database.batch.update_one({"_id": "BAT000001"}, {"$inc": {"qty_remaining": 1}})
+    assert database.batch.find_one({"_id": "BAT000001"})["qty_remaining"] == Decimal("3.5")
+
+
+def test_text_search_needs_a_text_index(database):
+    database.sku.insert_many([{"_id": "SKU000001", "name": "Red LED"},
+                              {"_id": "SKU000002", "name": "resistor"}])
+    with pytest.raises(OperationFailure):
+        database.sku.find_one({"$text": {"$search": "led"}})
+    database.sku.create_index([("name", TEXT)])
+    assert "name_text" in database.sku.index_information()
+    assert [doc["_id"] for doc in database.sku.find({"$text": {"$search": "led lamp"}})] \
+        == ["SKU000001"]
+
+
+def test_summarize_items_pipeline(database):
+    database.bin.insert_many([
+        {"_id": "BIN000001", "contents": {"SKU000001": 3, "BAT000001": 2}},
+        {"_id": "BIN000002", "contents": {"BAT000001": 1, "SKU000002": 0}},
+    ])
+    database.batch.insert_one({"_id": "BAT000001", "sku_id": "SKU000001"})
+    items = {item["_id"]: item for item in summarize_items(database)}
+    assert items == {
+        "SKU000001": {"_id": "SKU000001", "kind": "item", "total": 3,
+                      "bins": {"BIN000001": 3}, "sku_id": "SKU000001"},
+        "BAT000001": {"_id": "BAT000001", "kind": "item", "total": 3,
+                      "bins": {"BIN000001": 2, "BIN000002": 1}, "sku_id": "SKU000001"},
+    }
+
+
+def test_collection_management_and_unsupported_features(database):
+    database.stock_summary.insert_one({"_id": "old"})
+    database.stock_summary_rebuild.insert_one({"_id": "new"})
+    database.stock_summary_rebuild.rename("stock_summary", dropTarget=True)
+    assert list(database.stock_summary.find()) == [{"_id": "new"}]
+    assert database.list_collection_names() == ["stock_summary"]
+    database.stock_summary.drop()
+    assert database.list_collection_names() == []
+
+    with pytest.raises(OperationFailure):
+        database.watch([])
+    database.bin.insert_one({"_id": "BIN000001", "contents": {}})
+    with pytest.raises(NotImplementedError):
+        database.bin.find_one({"contents": {"$all": []}})
+    with pytest.raises(NotImplementedError):
+        list(database.bin.aggregate([{"$facet": {}}]))
+
+
+def test_max_and_min_updates(database):
+    database.admin.update_one({"_id": "SKU"}, {"$max": {"next": "SKU000005"}}, upsert=True)
+    database.admin.update_one({"_id": "SKU"}, {"$max": {"next": "SKU000003"}})
+    assert database.admin.find_one({"_id": "SKU"})["next"] == "SKU000005"
+    database.admin.update_one({"_id": "SKU"}, {"$min": {"next": "SKU000003"}})
+    assert database.admin.find_one({"_id": "SKU"})["next"] == "SKU000003"
@@ -1,8 +1,14 @@
+import re
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock
+
 import pytest
 
 from conftest import clientContext
 from inventorius.data_models import Batch, Bin, Mixture
 from inventorius.db import get_mongo_client
+from inventorius.mixture import _proportional_allocation, _timestamp
 
 
 def _create_bin(client, bin_id):
@@ -186,3 +192,81 @@ def test_mixture_hypermedia_operations_present():
         assert fetched.status_code == 200
         fetched_operations = {op["rel"] for op in fetched.json["operations"]}
         assert fetched_operations == {"draw", "split", "append-audit"}
+
+
+def test_proportional_allocation_is_exact():
+    components = [
+        {"batch_id": "BAT1", "qty_initial": 1, "qty_remaining": 1},
+        {"batch_id": "BAT2", "qty_initial": 1, "qty_remaining": 1},
+        {"batch_id": "BAT3", "qty_initial": 1, "qty_remaining": Decimal("0.0000001")},
+    ]
+    remaining, extracted = _proportional_allocation(components, 2)
+
+    assert sum(component["qty_initial"] for component in extracted) == Decimal("2")
+    for before, after, taken in zip(components, remaining, extracted):
+        assert taken["qty_initial"] >= 0
+        assert after["qty_remaining"] >= 0
+        assert after["qty_remaining"] + taken["qty_initial"] == before["qty_remaining"]
+
+
+def test_audit_is_stored_outside_mixture_document():
+    with clientContext() as client:
+        mix_id = "MIX500"
+        _bootstrap_mixture(client, mix_id, [("BAT500", 6), ("BAT501", 4)])
+        for _ in range(3):
+            resp = client.post(
+                f"/api/mixture/{mix_id}/draw",
+                json={"quantity": 1, "created_by": "operator"},
+            )
+            assert resp.status_code == 200
+
+        db = get_mongo_client().testing
+        assert "audit" not in db.mixture.find_one({"_id": mix_id})
+        assert db.mixture_audit.count_documents({"mix_id": mix_id}) == 4
+
+        fetched = client.get(f"/api/mixture/{mix_id}")
+        assert [event["event"] for event in fetched.json["state"]["audit"]] == [
+            "created", "draw", "draw", "draw"]
+
+
+def test_audit_is_paginated():
+    with clientContext() as client:
+        mix_id = "MIX600"
+        _bootstrap_mixture(client, mix_id, [("BAT600", 5)])
+        for i in range(4):
+            resp = client.post(
+                f"/api/mixture/{mix_id}/audit",
+                json={"event": "inspected", "created_by": "qa", "note": f"check {i}"},
+            )
+            assert resp.status_code == 200
+
+        resp = client.get(f"/api/mixture/{mix_id}/audit?startingFrom=1&limit=2")
+        assert resp.status_code == 200
+        state = resp.json["state"]
+        assert state["total_num_results"] == 5
+        assert state["returned_num_results"] == 2
+        assert [event["note"] for event in state["results"]] == ["check 0", "check 1"]
+
+        assert client.get("/api/mixture/MIX999/audit").status_code == 404
+
+
+def test_audit_timestamps_are_fixed_width():
+    on_the_second = datetime(2024, 5, 1, 12, 0, 0, tzinfo=timezone.utc)
+    with mock.patch("inventorius.mixture.datetime") as clock:
+        clock.now.return_value = on_the_second
+        assert _timestamp() == "2024-05-01T12:00:00.000000Z"
+    assert re.fullmatch(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}Z", _timestamp())
+
+
+def test_nonfinite_quantities_are_rejected():
+    with clientContext() as client:
+        mix_id = "MIX300"
+        _bootstrap_mixture(client, mix_id, [("BAT300", 6)])
+
+        def post(url, body):
+            return client.post(url, data=body, content_type="application/json")
+
+        assert post("/api/batches", '{"id": "BAT301", "qty_remaining": Infinity}').status_code == 400
+        assert post(f"/api/mixture/{mix_id}/draw",
+                    '{"quantity": NaN, "created_by": "operator"}').status_code == 400
+        assert client.get(f"/api/mixture/{mix_id}").status_code == 200
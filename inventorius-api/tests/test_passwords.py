@@ -0,0 +1,61 @@
+import hashlib
+
+from flask import Flask
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.data_models import UserData
+from inventorius.db import get_mongo_client
+from inventorius.passwords import CURRENT_HASH_VERSION, PasswordHasher, derive
+
+
+def _login(client, password):
+    return client.post("/api/login", json={"id": "alice", "password": password})
+
+
+def test_login_throttle(monkeypatch):
+    with clientContext() as client:
+        monkeypatch.setitem(app.config, "LOGIN_MAX_ACCOUNT_FAILURES", 3)
+        monkeypatch.setitem(app.config, "LOGIN_MAX_ADDRESS_FAILURES", 50)
+        resp = client.post("/api/users", json={"id": "alice", "name": "Alice", "password": "password1"})
+        assert resp.status_code == 201
+
+        for _ in range(3):
+            assert _login(client, "wrong-password").status_code == 401
+        resp = _login(client, "password1")
+        assert resp.status_code == 429
+        assert resp.json["type"] == "too-many-requests"
+        assert 0 < int(resp.headers["Retry-After"]) <= app.config["LOGIN_FAILURE_WINDOW"] + 1
+
+        get_mongo_client().testing.login_failures.delete_many({})
+        assert _login(client, "password1").status_code == 200
+        # a successful login clears the account's failures
+        assert _login(client, "wrong-password").status_code == 401
+        assert _login(client, "password1").status_code == 200
+
+
+def test_legacy_hash_is_upgraded_on_login():
+    with clientContext() as client:
+        salt = b"salt" * 16
+        legacy = UserData(fixed_id="alice", shadow_id="shadow0123456789", name="Alice", active=True,
+                          password_hash=hashlib.pbkdf2_hmac("sha256", b"password1", salt, 100000),
+                          password_salt=salt)
+        doc = legacy.to_mongodb_doc()
+        del doc["password_hash_version"]
+        get_mongo_client().testing.user.insert_one(doc)
+
+        assert _login(client, "password1").status_code == 200
+        upgraded = get_mongo_client().testing.user.find_one({"_id": "alice"})
+        assert upgraded["password_hash_version"] == CURRENT_HASH_VERSION
+        assert upgraded["password_hash"] != legacy.password_hash
+
+        client.post("/api/logout")
+        assert _login(client, "password1").status_code == 200
+
+
+def test_hashing_in_the_process_pool():
+    hasher = PasswordHasher(Flask("passwords"))
+    fields = hasher.hash("password1", version=1)
+    assert fields["password_hash"] == derive("password1", fields["password_salt"], 1)
+    assert hasher._executor._mp_context.get_start_method() == "forkserver"
+    hasher._executor.shutdown()
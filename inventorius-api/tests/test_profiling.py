@@ -0,0 +1,114 @@
+import os
+import re
+from datetime import timedelta
+
+from pymongo.monitoring import CommandStartedEvent, CommandSucceededEvent
+
+from conftest import clientContext
+from inventorius.profiling import RequestProfile, current_profile, profiler
+
+
+def test_listener_counts_commands_of_current_request():
+    address = ("localhost", 27017)
+    command = {"find": "bin", "filter": {"_id": "BIN000001"}}
+    reply = {"cursor": {"firstBatch": [], "id": 0, "ns": "testing.bin"}, "ok": 1}
+
+    profile = RequestProfile()
+    token = current_profile.set(profile)
+    try:
+        for request_id in (1, 2):
+            profiler.listener.started(CommandStartedEvent(
+                command, "testing", request_id, address, request_id))
+            profiler.listener.succeeded(CommandSucceededEvent(
+                timedelta(milliseconds=2), reply, "find", request_id, address, request_id))
+    finally:
+        current_profile.reset(token)
+    # outside a request commands are not counted
+    profiler.listener.started(CommandStartedEvent(command, "testing", 3, address, 3))
+
+    assert profile.commands == 2
+    assert abs(profile.db_seconds - 0.004) < 1e-9
+    assert profile.bytes_received > profile.bytes_sent > 0
+
+
+def test_server_timing_and_metrics():
+    with clientContext() as client:
+        profiler.metrics.clear()
+        assert client.post("/api/bins", json={"id": "BIN000001", "props": {}}).status_code == 201
+        for _ in range(2):
+            resp = client.get("/api/bin/BIN000001")
+            assert resp.status_code == 200
+            assert re.fullmatch(r'db;dur=[\d.]+;desc="\d+ commands", app;dur=[\d.]+',
+                                resp.headers["Server-Timing"])
+
+        assert client.get("/api/metrics").status_code == 403
+        resp = client.post("/api/users", json={"id": "alice", "name": "Alice", "password": "password1"})
+        assert resp.status_code == 201
+        resp = client.post("/api/login", json={"id": "alice", "password": "password1"})
+        assert resp.status_code == 200
+
+        resp = client.get("/api/metrics")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        lines = resp.get_data(as_text=True).splitlines()
+        pid = os.getpid()
+        assert "# TYPE inventorius_requests_total counter" in lines
+        assert f'inventorius_requests_total{{route="/api/bin/<id>",method="GET",pid="{pid}"}} 2' in lines
+        assert f'inventorius_requests_total{{route="/api/bins",method="POST",pid="{pid}"}} 1' in lines
+        assert any(line.startswith('inventorius_db_commands_total{route="/api/bin/<id>",method="GET",')
+                   for line in lines)
+
+
+def test_command_shape_leaves_out_values():
+    from inventorius.profiling import command_shape
+
+    assert command_shape({"find": "sku", "filter": {"_id": "SKU000001"}, "limit": 1,
+                          "lsid": {"id": "x"}, "$db": "testing"}) == \
+        'find sku {"filter": {"_id": "?"}}'
+    assert command_shape({"find": "bin", "filter": {"_id": {"$in": ["BIN1", "BIN2", "BIN3"]}}}) == \
+        command_shape({"find": "bin", "filter": {"_id": {"$in": ["BIN4"]}}})
+    assert command_shape({"update": "bin", "updates": [
+        {"q": {"_id": "BIN1"}, "u": {"$inc": {"contents.SKU1": 1}}}]}) == \
+        'update bin {"q": {"_id": "?"}}'
+    assert command_shape({"getMore": 1234, "collection": "sku"}) == "getMore sku"
+
+
+def test_query_log_flags_repeated_and_slow_shapes(caplog):
+    from inventorius.profiling import query_log
+
+    address = ("localhost", 27017)
+    profile = RequestProfile(track_shapes=True)
+    token = current_profile.set(profile)
+    try:
+        for request_id in range(12):
+            command = {"find": "batch", "filter": {"_id": f"BAT{request_id:06}"}}
+            profiler.listener.started(CommandStartedEvent(
+                command, "testing", request_id, address, request_id))
+            profiler.listener.succeeded(CommandSucceededEvent(
+                timedelta(milliseconds=1), {"ok": 1}, "find", request_id, address, request_id))
+        command = {"aggregate": "bin", "pipeline": [{"$match": {"contents.SKU000001": {"$gt": 0}}}]}
+        profiler.listener.started(CommandStartedEvent(command, "testing", 99, address, 99))
+        profiler.listener.succeeded(CommandSucceededEvent(
+            timedelta(milliseconds=250), {"ok": 1}, "aggregate", 99, address, 99))
+    finally:
+        current_profile.reset(token)
+
+    with caplog.at_level("WARNING", logger="inventorius.profiling"):
+        messages = query_log.report("GET /api/traceability", profile, repeats=10,
+                                    slow_ms=100, explain=False)
+    assert messages == [
+        'GET /api/traceability sent 12 x find batch {"filter": {"_id": "?"}} (12.0 ms)',
+        'GET /api/traceability sent a slow aggregate bin '
+        '{"pipeline": [{"$match": {"contents.?": {"$gt": "?"}}}]} (250.0 ms)',
+    ]
+    assert [record.getMessage() for record in caplog.records] == messages
+
+
+def test_explain_summary():
+    from inventorius.profiling import explain_summary
+
+    assert explain_summary({"queryPlanner": {"winningPlan": {
+        "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "sku_id_1"}}}}) == \
+        "IXSCAN(sku_id_1) > FETCH"
+    assert explain_summary({"stages": [{"$cursor": {"queryPlanner": {
+        "winningPlan": {"stage": "COLLSCAN"}}}}, {"$group": {}}]}) == "COLLSCAN"
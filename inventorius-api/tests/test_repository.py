@@ -0,0 +1,76 @@
+import pytest
+
+from bson.decimal128 import Decimal128
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.data_models import Batch, Bin, UnloadedFieldError
+from inventorius.db import get_mongo_client
+from inventorius.repository import bins, compile_patch
+
+
+def test_partial_load_only_has_requested_fields():
+    with clientContext() as client:
+        resp = client.post("/api/bins", json={"id": "BIN1", "props": {"color": "red"}})
+        assert resp.status_code == 201
+        client.post("/api/skus", json={"id": "SKU000001", "name": "", "owned_codes": [],
+                                       "associated_codes": [], "props": {}})
+        resp = client.post("/api/bin/BIN1/contents", json={"id": "SKU000001", "quantity": 2})
+        assert resp.status_code == 201
+
+    with app.app_context():
+        g.db = get_mongo_client().testing
+        assert bins.exists("BIN1")
+        assert not bins.exists("BIN2")
+
+        partial = bins.load("BIN1", fields=["contents.SKU000001"])
+        assert isinstance(partial, Bin)
+        assert partial.id == "BIN1"
+        assert partial.contents == {"SKU000001": 2}
+        with pytest.raises(UnloadedFieldError):
+            partial.props
+        assert partial.to_dict() == {"id": "BIN1", "contents": {"SKU000001": 2}}
+
+        full = bins.load("BIN1")
+        assert full.props == {"color": "red"}
+        assert bins.load("BIN1", exclude=["contents"]).props == {"color": "red"}
+        assert bins.load("BIN2", fields=["props"]) is None
+
+
+def test_compile_patch():
+    update = compile_patch(Batch, {
+        "id": "BAT1",
+        "name": "resistors",
+        "sku_id": None,
+        "qty_remaining": 2.5,
+        "not_a_field": 1,
+    })
+    assert update == {
+        "$set": {"name": "resistors", "qty_remaining": Decimal128("2.5")},
+        "$unset": {"sku_id": ""},
+    }
+    assert compile_patch(Batch, {"id": "BAT1"}) == {}
+
+
+def test_batch_sku_change_needs_force():
+    with clientContext() as client:
+        for sku_id in ("SKU000001", "SKU000002"):
+            client.post("/api/skus", json={"id": sku_id, "name": "", "owned_codes": [],
+                                           "associated_codes": [], "props": {}})
+        resp = client.post("/api/batches", json={"id": "BAT000001", "sku_id": "SKU000001"})
+        assert resp.status_code == 201
+
+        patch = {"id": "BAT000001", "sku_id": "SKU000002", "name": "renamed"}
+        resp = client.patch("/api/batch/BAT000001", json=patch)
+        assert resp.status_code == 405
+        assert client.get("/api/batch/BAT000001").json["state"]["sku_id"] == "SKU000001"
+
+        resp = client.patch("/api/batch/BAT000001?force=true", json=patch)
+        assert resp.status_code == 200
+        state = client.get("/api/batch/BAT000001").json["state"]
+        assert state["sku_id"] == "SKU000002"
+        assert state["name"] == "renamed"
+
+        resp = client.patch("/api/batch/BAT000002", json={"id": "BAT000002", "name": "x"})
+        assert resp.status_code == 404
@@ -0,0 +1,39 @@
+from conftest import clientContext
+from inventorius import app
+
+
+def _search(client, query, **args):
+    resp = client.get("/api/search", query_string={"query": query, "limit": 100, **args})
+    assert resp.status_code == 200
+    return resp.json
+
+
+def test_parallel_search_matches_sequential_order():
+    with clientContext() as client:
+        assert client.post("/api/bins", json={"id": "BIN000001", "props": {}}).status_code == 201
+        for id, name, codes in [("SKU000001", "red resistor", ["SKU000002"]),
+                                ("SKU000002", "blue resistor", ["resistor"])]:
+            resp = client.post("/api/skus", json={"id": id, "name": name, "owned_codes": codes})
+            assert resp.status_code == 201
+        resp = client.post("/api/batches", json={"id": "BAT000001", "sku_id": "SKU000001",
+                                                 "name": "resistor reel"})
+        assert resp.status_code == 201
+
+        workers = app.config["QUERY_FANOUT_WORKERS"]
+        try:
+            parallel = {query: _search(client, query)["state"]
+                        for query in ("SKU000002", "resistor", "!ALL")}
+            app.config["QUERY_FANOUT_WORKERS"] = 0
+            sequential = {query: _search(client, query)["state"] for query in parallel}
+        finally:
+            app.config["QUERY_FANOUT_WORKERS"] = workers
+        assert parallel == sequential
+        assert [result["id"] for result in parallel["SKU000002"]["results"]] == [
+            "SKU000002", "SKU000001"]
+        assert [result["id"] for result in parallel["resistor"]["results"]] == [
+            "SKU000002", "SKU000001", "SKU000002", "BAT000001"]
+
+        debug = _search(client, "BIN000001", debug="true")["debug"]
+        assert debug["source"] == "database"
+        assert list(debug["queries_ms"]) == ["label", "codes", "sku_text", "batch_text"]
+        assert "debug" not in _search(client, "BIN000001")
@@ -0,0 +1,86 @@
+import os
+
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.data_models import Sku
+from inventorius.db import get_mongo_client
+from inventorius.search_index import search_index
+
+
+def _search(client, query):
+    resp = client.get("/api/search", query_string={"query": query})
+    assert resp.status_code == 200
+    return [result["id"] for result in resp.json["state"]["results"]]
+
+
+def _build():
+    with app.app_context():
+        g.db = get_mongo_client().testing
+        search_index.build()
+
+
+def test_memory_search_matches_database_search():
+    with clientContext() as client:
+        resp = client.post("/api/skus", json={"id": "SKU000001", "name": "Resistor 10k", "owned_codes": ["111"],
+                                              "associated_codes": ["222"], "props": {}})
+        assert resp.status_code == 201
+        resp = client.post("/api/batches", json={
+            "id": "BAT000001", "sku_id": "SKU000001", "name": "reel", "associated_codes": ["111"],
+            "codes": [{"code": "LOT42"}]})
+        assert resp.status_code == 201
+
+        queries = ["111", "222", "LOT42", "SKU000001", "BAT000001", "!ALL", "!SKUS", "nothing", ""]
+        from_database = {query: _search(client, query) for query in queries}
+        try:
+            _build()
+            assert {query: _search(client, query) for query in queries} == from_database
+            assert _search(client, "resistor") == ["SKU000001"]
+            resp = client.get("/api/autocomplete", query_string={"query": "resis"})
+            assert [result["id"] for result in resp.json["state"]["results"]] == ["SKU000001"]
+
+            # writes through the api are applied right away
+            resp = client.patch("/api/sku/SKU000001", json={"owned_codes": ["333"]})
+            assert resp.status_code == 200
+            assert _search(client, "333") == ["SKU000001"]
+            assert _search(client, "111") == ["BAT000001"]
+            assert client.delete("/api/batch/BAT000001").status_code == 200
+            assert _search(client, "LOT42") == []
+        finally:
+            search_index.reset()
+
+
+def test_memory_search_polls_changes():
+    with clientContext() as client:
+        try:
+            _build()
+            with app.app_context():
+                database = get_mongo_client().testing
+                search_index.poll_changes(database)
+                # written by another worker
+                database.sku.insert_one(Sku(id="SKU000002", name="Capacitor", owned_codes=["444"]).to_mongodb_doc())
+                database.search_changes.insert_one({"resource_id": "SKU000002"})
+                search_index.poll_changes(database)
+            assert _search(client, "444") == ["SKU000002"]
+        finally:
+            search_index.reset()
+
+
+def test_refresh_thread_starts_once_per_process(monkeypatch):
+    started = []
+    monkeypatch.setattr(search_index, "_run", lambda: started.append(os.getpid()))
+    monkeypatch.setattr(search_index, "_pid", None)
+    try:
+        search_index._ensure_thread()
+        search_index._ensure_thread()
+        search_index._thread.join()
+        assert started == [os.getpid()]
+
+        # a forked worker starts its own
+        monkeypatch.setattr(search_index, "_pid", -1)
+        search_index._ensure_thread()
+        search_index._thread.join()
+        assert started == [os.getpid()] * 2
+    finally:
+        search_index.reset()
@@ -0,0 +1,78 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+import inventorius.serialization as serialization
+from inventorius.data_models import Batch, Bin, DataModelJSONEncoder as Encoder
+from inventorius.resource_models import BlankEncoder
+
+
+def _available_backends():
+    available = []
+    for name, factory in serialization.backends.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+@pytest.fixture(params=_available_backends())
+def backend(request):
+    return serialization.backends[request.param]()
+
+
+def test_data_models_match_encoder(backend):
+    results = [
+        Batch(id="BAT1", name="resistors", props={"cost_per_case": {"unit": "USD", "value": 2.5}}),
+        Bin(id="BIN1", contents={"BAT1": 3}),
+    ]
+    expected = json.loads(json.dumps(results, cls=Encoder))
+
+    assert json.loads(backend(results, serialization.data_model_default)) == expected
+    assert [result.to_json_dict() for result in results] == expected
+
+
+def test_unserializable_values_are_blank(backend):
+    data = {"Id": "/api/thing", "state": {"blob": b"\x00\x01", "n": 1, "batch": Batch(id="BAT1")}}
+    expected = json.loads(json.dumps(data, cls=BlankEncoder))
+
+    assert json.loads(backend(data, serialization.blank_default)) == expected
+
+
+def test_nonfinite_floats_match_encoder(backend):
+    data = {"state": Bin(id="BIN1", props={"a": float("inf"), "b": None}).to_dict(),
+            "results": [Batch(id="BAT1", props={"c": [float("-inf")]}).to_json_dict()]}
+    expected = json.dumps(data, cls=BlankEncoder)
+
+    assert json.loads(backend(data, serialization.blank_default)) == json.loads(expected)
+
+
+@pytest.mark.parametrize("mimetype", serialization.available_mimetypes())
+def test_datetimes_and_quantities_in_every_format(mimetype):
+    data = {"state": {"created_at": datetime(2024, 5, 1, 12, 0, 0, 123456),
+                      "expires_at": datetime(2024, 5, 2, tzinfo=timezone.utc),
+                      "qty": Decimal("2.50"), "batch": Batch(id="BAT1", qty_remaining=Decimal("3"))}}
+    expected = {"state": {"created_at": "2024-05-01T12:00:00.123456",
+                          "expires_at": "2024-05-02T00:00:00+00:00",
+                          "qty": 2.5, "batch": {}}}
+
+    encoded = serialization.encode(data, mimetype)
+    if mimetype == serialization.MSGPACK_MIMETYPE:
+        import msgpack
+        decoded = msgpack.unpackb(encoded)
+    elif mimetype == serialization.CBOR_MIMETYPE:
+        import cbor2
+        decoded = cbor2.loads(encoded)
+    else:
+        decoded = json.loads(encoded)
+    assert decoded == expected
+
+
+def test_datetimes_match_across_backends(backend):
+    data = {"state": {"created_at": datetime(2024, 5, 1, 12, 0, 0, 123456), "qty": Decimal("2.50")}}
+    assert json.loads(backend(data, serialization.blank_default)) \
+        == {"state": {"created_at": "2024-05-01T12:00:00.123456", "qty": 2.5}}
@@ -0,0 +1,111 @@
+import importlib
+
+from flask import g
+
+from conftest import clientContext
+from inventorius import app
+from inventorius.db import get_mongo_client
+from inventorius.stock import rebuild_stock_summary
+
+
+def _create_sku(client, sku_id):
+    resp = client.post("/api/skus", json={"id": sku_id, "name": "", "owned_codes": [],
+                                          "associated_codes": [], "props": {}})
+    assert resp.status_code == 201
+
+
+def _receive(client, bin_id, item_id, quantity):
+    resp = client.post(f"/api/bin/{bin_id}/contents", json={"id": item_id, "quantity": quantity})
+    assert resp.status_code == 201
+
+
+def _stock(client, id):
+    resp = client.get(f"/api/stock/{id}")
+    assert resp.status_code == 200
+    return resp.json["state"]
+
+
+def test_stock_totals_follow_bin_changes():
+    with clientContext() as client:
+        for bin_id in ("BIN000001", "BIN000002"):
+            assert client.post("/api/bins", json={"id": bin_id, "props": {}}).status_code == 201
+        _create_sku(client, "SKU000001")
+        resp = client.post("/api/batches", json={"id": "BAT000001", "sku_id": "SKU000001"})
+        assert resp.status_code == 201
+
+        _receive(client, "BIN000001", "SKU000001", 3)
+        _receive(client, "BIN000001", "BAT000001", 10)
+        _receive(client, "BIN000001", "BAT000001", -2)
+        resp = client.put("/api/bin/BIN000001/contents/move",
+                          json={"id": "BAT000001", "destination": "BIN000002", "quantity": 5})
+        assert resp.status_code == 200
+
+        assert _stock(client, "BAT000001") == {
+            "id": "BAT000001", "sku_id": "SKU000001", "total": 8,
+            "bins": {"BIN000001": 3, "BIN000002": 5}}
+        sku = _stock(client, "SKU000001")
+        assert sku["total"] == 3
+        assert sku["sku_total"] == 11
+        assert _stock(client, "BIN000001")["total"] == 6
+        assert _stock(client, "BIN000002")["total"] == 5
+
+        resp = client.delete("/api/bin/BIN000002?force=true")
+        assert resp.status_code == 200
+        assert _stock(client, "SKU000001")["sku_total"] == 6
+        assert _stock(client, "BAT000001")["bins"] == {"BIN000001": 3}
+
+        incremental = {id: _stock(client, id)
+                       for id in ("SKU000001", "BAT000001", "BIN000001")}
+        with app.app_context():
+            g.db = get_mongo_client().testing
+            rebuild_stock_summary()
+        assert {id: _stock(client, id) for id in incremental} == incremental
+
+
+def test_stock_of_unstocked_and_missing_resources():
+    with clientContext() as client:
+        _create_sku(client, "SKU000001")
+        assert _stock(client, "SKU000001") == {
+            "id": "SKU000001", "sku_id": "SKU000001", "total": 0, "sku_total": 0, "bins": {}}
+        assert client.get("/api/stock/SKU000002").status_code == 404
+        assert client.get("/api/stock/BIN000009").status_code == 404
+
+
+def test_adjustments_during_a_rebuild_are_kept(monkeypatch):
+    with clientContext() as client:
+        for bin_id in ("BIN000001", "BIN000002"):
+            assert client.post("/api/bins", json={"id": bin_id, "props": {}}).status_code == 201
+        _create_sku(client, "SKU000001")
+        resp = client.post("/api/batches", json={"id": "BAT000001", "sku_id": "SKU000001"})
+        assert resp.status_code == 201
+        _receive(client, "BIN000001", "BAT000001", 10)
+        _receive(client, "BIN000002", "SKU000001", 1)
+
+        # the package exports the blueprint under the module's name
+        module = importlib.import_module("inventorius.stock")
+        summarize_items = module.summarize_items
+
+        def adjust_during_rebuild(database, item_ids=None):
+            items = list(summarize_items(database, item_ids))
+            if item_ids is None:
+                # after the rebuild read the bins
+                _receive(client, "BIN000001", "BAT000001", 4)
+                resp = client.put("/api/bin/BIN000001/contents/move",
+                                  json={"id": "BAT000001", "destination": "BIN000002",
+                                        "quantity": 3})
+                assert resp.status_code == 200
+                assert client.delete("/api/bin/BIN000002?force=true").status_code == 200
+            return iter(items)
+
+        monkeypatch.setattr(module, "summarize_items", adjust_during_rebuild)
+        resp = client.post("/api/jobs", json={"kind": "rebuild-stock-summary"})
+        assert client.get(resp.headers["Location"]).json["state"]["status"] == "succeeded"
+
+        assert _stock(client, "BAT000001") == {
+            "id": "BAT000001", "sku_id": "SKU000001", "total": 11,
+            "bins": {"BIN000001": 11}}
+        sku = _stock(client, "SKU000001")
+        assert sku["total"] == 0
+        assert sku["bins"] == {}
+        assert sku["sku_total"] == 11
+        assert _stock(client, "BIN000001")["total"] == 11
@@ -0,0 +1,40 @@
+from conftest import clientContext
+from inventorius.db import get_mongo_client
+from inventorius.user import user_cache
+
+
+def _whoami(client):
+    resp = client.get("/api/whoami")
+    assert resp.status_code == 200
+    return resp
+
+
+def test_session_user_is_cached_until_changed():
+    with clientContext() as client:
+        resp = client.post("/api/users", json={"id": "alice", "name": "Alice", "password": "password1"})
+        assert resp.status_code == 201
+        resp = client.post("/api/login", json={"id": "alice", "password": "password1"})
+        assert resp.status_code == 200
+        assert _whoami(client).json["id"] == "alice"
+
+        # served from the cache, a user removed behind the api's back stays
+        # logged in until the entry expires
+        get_mongo_client().testing.user.delete_one({"_id": "alice"})
+        assert _whoami(client).json["id"] == "alice"
+        user_cache.clear()
+        assert _whoami(client).json["id"] is None
+
+
+
+def test_password_change_ends_cached_sessions():
+    with clientContext() as client:
+        resp = client.post("/api/users", json={"id": "alice", "name": "Alice", "password": "password1"})
+        assert resp.status_code == 201
+        resp = client.post("/api/login", json={"id": "alice", "password": "password1"})
+        assert resp.status_code == 200
+        assert _whoami(client).json["id"] == "alice"
+
+        # a new password changes the shadow id, the cached user is dropped
+        resp = client.patch("/api/user/alice", json={"password": "password2"})
+        assert resp.status_code == 200
+        assert _whoami(client).json["id"] is None